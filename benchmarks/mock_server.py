@@ -0,0 +1,408 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Local mock of the InvenioRDM (Zenodo) REST API for benchmarks and tests.
+
+The server serves synthetic records cloned from `tests/records/*.json` with
+search pagination, file downloads, record updates and publishing, and
+accepts new drafts with file uploads (init, content, commit). Latency can
+be injected on every response and every Nth request can be answered with
+`429 Too Many Requests` to exercise the client's retry path.
+"""
+
+import copy
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+RECORDS_DIR = os.path.join(os.path.dirname(__file__), "..", "tests", "records")
+
+# Identifier ranges of the synthetic records and of their parent (concept) records
+RECORD_ID_BASE = 20000000
+PARENT_ID_BASE = 30000000
+DRAFT_ID_BASE = 40000000
+
+
+class MockInvenioServer:
+  """
+  Threaded HTTP server emulating the subset of the InvenioRDM API used by the client.
+  """
+
+  def __init__(self, num_records=100, file_size=256 * 1024, latency=0.0, throttle_every=0,
+               communities=("cfconventions",), versions_per_record=3, records_dir=RECORDS_DIR,
+               host="127.0.0.1", port=0):
+    """
+    Initialize the server and build the synthetic records.
+
+    Args:
+      num_records (int, optional): Number of synthetic records.
+      file_size (int, optional): Size in bytes of each synthetic file.
+      latency (float, optional): Delay in seconds added to every response.
+      throttle_every (int, optional): Answer every Nth request with 429 (0 disables throttling).
+      communities (tuple, optional): Community slugs; records are spread across them with some overlap.
+      versions_per_record (int, optional): Number of consecutive records sharing a parent (versions).
+      records_dir (str, optional): Directory with the record JSON files used as templates.
+      host (str, optional): Interface to bind.
+      port (int, optional): Port to bind (0 picks a free port).
+    """
+    self.file_size = file_size
+    self.latency = latency
+    self.throttle_every = throttle_every
+    self.communities = tuple(communities)
+    self.request_count = 0
+    self.requests_by_path = {}
+    self._lock = threading.Lock()
+
+    self.records = {}
+    self.files = {}
+    # New drafts by ID and their uploaded files by (draft ID, key)
+    self.drafts = {}
+    self.draft_files = {}
+    templates = []
+    for path in sorted(glob.glob(os.path.join(records_dir, "*.json"))):
+      with open(path) as f:
+        templates.append(json.load(f))
+    started = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    for i in range(num_records):
+      record = self._make_record(templates[i % len(templates)], i, versions_per_record, started)
+      self.records[record["id"]] = record
+    self.ordered_ids = list(self.records)
+
+    self._server = ThreadingHTTPServer((host, port), self._handler_class())
+    self._server.daemon_threads = True
+    self._thread = None
+
+  @property
+  def base_url(self):
+    host, port = self._server.server_address[:2]
+    return f"http://{host}:{port}/api"
+
+  def _make_record(self, template, index, versions_per_record, started):
+    """Clone a template record under a new identifier with synthetic files."""
+    record_id = str(RECORD_ID_BASE + index)
+    parent_id = str(PARENT_ID_BASE + index // versions_per_record)
+    text = json.dumps(template).replace(template["id"], record_id).replace(template["parent"]["id"], parent_id)
+    record = json.loads(text)
+
+    created = started + timedelta(hours=6 * index)
+    record["created"] = record["updated"] = created.isoformat()
+    record["metadata"]["title"] = f"{template['metadata']['title']} ({index})"
+    record["metadata"]["publication_date"] = created.date().isoformat()
+    record["versions"] = {"index": index % versions_per_record + 1,
+                          "is_latest": index % versions_per_record == versions_per_record - 1}
+    n = len(self.communities)
+    slugs = {self.communities[index % n]}
+    if index % 5 == 0:
+      slugs.add(self.communities[(index + 1) % n])
+    record["parent"]["communities"]["entries"] = [{"slug": slug, "id": slug} for slug in sorted(slugs)]
+    record["parent"]["communities"]["ids"] = sorted(slugs)
+
+    entries = {}
+    for key, entry in record["files"]["entries"].items():
+      content = self._file_content(record_id, key)
+      self.files[(record_id, key)] = content
+      entry = copy.deepcopy(entry)
+      entry["size"] = len(content)
+      entry["checksum"] = f"md5:{hashlib.md5(content).hexdigest()}"
+      entries[key] = entry
+    record["files"]["entries"] = entries
+    record["files"]["total_bytes"] = sum(entry["size"] for entry in entries.values())
+    return record
+
+  def _file_content(self, record_id, key):
+    header = f"{record_id}/{key}\n".encode()
+    return header + b"\0" * max(self.file_size - len(header), 0)
+
+  def create_draft(self, body):
+    """Create a draft from a request body and return it."""
+    with self._lock:
+      index = len(self.drafts)
+      now = datetime.now(timezone.utc).isoformat()
+      draft = dict(body, id=str(DRAFT_ID_BASE + index), is_draft=True, is_published=False, status="draft",
+                   revision_id=1, created=now, updated=now, parent={"id": str(DRAFT_ID_BASE + 500000 + index)})
+      self.drafts[draft["id"]] = draft
+    return draft
+
+  def publish_draft(self, draft_id):
+    """Publish a draft into a record; returns the response status and payload."""
+    with self._lock:
+      draft = self.drafts[draft_id]
+      files = {key: entry for (owner, key), entry in self.draft_files.items() if owner == draft_id}
+      if draft.get("files", {}).get("enabled", True) and (
+          not files or any(entry["status"] != "completed" for entry in files.values())):
+        return 400, {"status": 400, "message": "A validation error occurred.",
+                     "errors": [{"field": "files.enabled", "messages": ["Missing uploaded files."]}]}
+      record = dict(self.drafts.pop(draft_id), is_draft=False, is_published=True, status="published")
+      record["files"] = dict(record.get("files", {}), entries={
+        key: {"key": key, "checksum": entry["checksum"], "size": entry["size"]} for key, entry in files.items()
+      })
+      for key, entry in files.items():
+        self.files[(draft_id, key)] = entry["content"]
+      self.records[draft_id] = record
+    return 202, record
+
+  def draft_file_entries(self, draft_id):
+    """Return the file entries of a draft, as listed by the API."""
+    with self._lock:
+      files = [entry for (owner, _), entry in self.draft_files.items() if owner == draft_id]
+    return [{key: value for key, value in entry.items() if key != "content"} for entry in files]
+
+  def community_records(self, community=None, query=None):
+    """Return the records matching a community slug and a (minimal) search query."""
+    records = [self.records[record_id] for record_id in self.ordered_ids]
+    if community:
+      records = [r for r in records if community in r["parent"]["communities"]["ids"]]
+    if query:
+      records = [r for r in records if _matches_query(r, query)]
+    return records
+
+  def start(self):
+    """Start serving in a background thread and return the API base URL."""
+    self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+    self._thread.start()
+    return self.base_url
+
+  def stop(self):
+    """Stop the server."""
+    self._server.shutdown()
+    self._server.server_close()
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, *exc):
+    self.stop()
+
+  def _handler_class(self):
+    server = self
+
+    class Handler(MockInvenioHandler):
+      mock = server
+
+    return Handler
+
+
+_RANGE_QUERY = re.compile(r'(\w+):([\[{])"?(\S+?)"? TO "?(\S+?)"?([\]}])')
+
+
+def _matches_query(record, query):
+  """
+  Support `field:[a TO b}` range queries on top-level fields and substring matches on the title.
+
+  Terms may be combined with `AND` (e.g. `(title words) AND created:["a" TO "b"}`).
+  """
+  for match in _RANGE_QUERY.finditer(query):
+    field, left, low, high, right = match.groups()
+    value = record.get(field, "")
+    if low != "*" and (value < low or (left == "{" and value == low)):
+      return False
+    if high != "*" and (value > high or (right == "}" and value == high)):
+      return False
+  query = _RANGE_QUERY.sub("", query).replace(" AND ", " ").strip()
+  if query.startswith("(") and query.endswith(")"):
+    query = query[1:-1]
+  return not query or query.lower() in record["metadata"]["title"].lower()
+
+
+class MockInvenioHandler(BaseHTTPRequestHandler):
+  """
+  Request handler bound to a `MockInvenioServer` (through the `mock` class attribute).
+  """
+
+  protocol_version = "HTTP/1.1"
+  disable_nagle_algorithm = True
+  mock = None
+
+  def log_message(self, format, *args):
+    pass
+
+  def _send_json(self, status, payload, headers=None):
+    body = json.dumps(payload).encode()
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    for name, value in (headers or {}).items():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def _read_body(self):
+    length = int(self.headers.get("Content-Length") or 0)
+    return self.rfile.read(length) if length else b""
+
+  def _admit(self, path):
+    """Apply latency injection and throttling; return False if the request was throttled."""
+    mock = self.mock
+    with mock._lock:
+      mock.request_count += 1
+      count = mock.request_count
+      mock.requests_by_path[path] = mock.requests_by_path.get(path, 0) + 1
+    if mock.latency:
+      time.sleep(mock.latency)
+    if mock.throttle_every and count % mock.throttle_every == 0:
+      self._read_body()
+      self._send_json(429, {"status": 429, "message": "Too many requests"}, {"Retry-After": "0"})
+      return False
+    return True
+
+  def _route(self):
+    url = urlsplit(self.path)
+    parts = [unquote(p) for p in url.path.strip("/").split("/")]
+    if parts and parts[0] == "api":
+      parts = parts[1:]
+    return parts, parse_qs(url.query)
+
+  def do_GET(self):
+    parts, query = self._route()
+    if not self._admit("/".join(parts[:1])):
+      return
+    mock = self.mock
+
+    if parts == ["records"]:
+      page = int(query.get("page", ["1"])[0])
+      size = int(query.get("size", ["10"])[0])
+      records = mock.community_records(query.get("communities", [None])[0], query.get("q", [None])[0])
+      if query.get("sort", [""])[0] in ("newest", "-created"):
+        records = records[::-1]
+      hits = records[(page - 1) * size:page * size]
+      links = {"self": f"{mock.base_url}/records?page={page}&size={size}"}
+      if page * size < len(records):
+        links["next"] = f"{mock.base_url}/records?page={page + 1}&size={size}"
+      self._send_json(200, {"hits": {"hits": hits, "total": len(records)}, "links": links, "aggregations": {}})
+
+    elif len(parts) == 4 and parts[0] == "records" and parts[2:] == ["draft", "files"] and parts[1] in mock.drafts:
+      self._send_json(200, {"entries": mock.draft_file_entries(parts[1])})
+
+    elif len(parts) == 3 and parts[0] == "records" and parts[2] == "draft" and parts[1] in mock.drafts:
+      self._send_json(200, mock.drafts[parts[1]])
+
+    elif len(parts) == 2 and parts[0] == "records":
+      record = mock.records.get(parts[1])
+      if record is None:
+        self._send_json(404, {"status": 404, "message": "The persistent identifier does not exist."})
+      else:
+        self._send_json(200, record)
+
+    elif len(parts) == 5 and parts[0] == "records" and parts[2] == "files" and parts[4] == "content":
+      content = mock.files.get((parts[1], parts[3]))
+      if content is None:
+        self._send_json(404, {"status": 404, "message": "File not found."})
+        return
+      self.send_response(200)
+      self.send_header("Content-Type", "application/octet-stream")
+      self.send_header("Content-Length", str(len(content)))
+      self.end_headers()
+      self.wfile.write(content)
+
+    else:
+      self._send_json(404, {"status": 404, "message": "Not found."})
+
+  def do_PUT(self):
+    parts, _ = self._route()
+    if not self._admit("/".join(parts[:1])):
+      return
+    body = self._read_body()
+    mock = self.mock
+
+    if len(parts) == 6 and parts[0] == "records" and parts[2:4] == ["draft", "files"] and parts[5] == "content":
+      entry = mock.draft_files.get((parts[1], parts[4]))
+      if entry is None or entry["status"] != "pending":
+        self._send_json(400, {"status": 400, "message": "File is not pending upload."})
+        return
+      with mock._lock:
+        entry["content"] = body
+        entry["size"] = len(body)
+      self._send_json(200, {key: value for key, value in entry.items() if key != "content"})
+
+    elif len(parts) == 3 and parts[0] == "records" and parts[2] == "draft" and parts[1] in mock.drafts:
+      draft = mock.drafts[parts[1]]
+      with mock._lock:
+        draft.update(json.loads(body or b"{}"))
+        draft["revision_id"] += 1
+        draft["updated"] = datetime.now(timezone.utc).isoformat()
+      self._send_json(200, draft)
+
+    elif len(parts) in (2, 3) and parts[0] == "records" and parts[1] in mock.records:
+      record = mock.records[parts[1]]
+      with mock._lock:
+        record.update(json.loads(body or b"{}"))
+        record["revision_id"] = record.get("revision_id", 0) + 1
+        record["updated"] = datetime.now(timezone.utc).isoformat()
+      self._send_json(200, record)
+    else:
+      self._send_json(404, {"status": 404, "message": "Not found."})
+
+  def do_POST(self):
+    parts, _ = self._route()
+    if not self._admit("/".join(parts[:1])):
+      return
+    body = self._read_body()
+    mock = self.mock
+
+    if parts == ["records"]:
+      self._send_json(201, mock.create_draft(json.loads(body or b"{}")))
+
+    elif len(parts) == 4 and parts[0] == "records" and parts[2:] == ["draft", "files"] and parts[1] in mock.drafts:
+      keys = [item["key"] for item in json.loads(body or b"[]")]
+      with mock._lock:
+        if any((parts[1], key) in mock.draft_files for key in keys):
+          self._send_json(400, {"status": 400, "message": "File with key already exists."})
+          return
+        for key in keys:
+          mock.draft_files[(parts[1], key)] = {"key": key, "status": "pending", "content": None}
+      self._send_json(201, {"entries": mock.draft_file_entries(parts[1])})
+
+    elif len(parts) == 6 and parts[0] == "records" and parts[2:4] == ["draft", "files"] and parts[5] == "commit":
+      entry = mock.draft_files.get((parts[1], parts[4]))
+      if entry is None or entry["content"] is None:
+        self._send_json(400, {"status": 400, "message": "File has no content."})
+        return
+      with mock._lock:
+        entry["status"] = "completed"
+        entry["checksum"] = f"md5:{hashlib.md5(entry['content']).hexdigest()}"
+      self._send_json(200, {key: value for key, value in entry.items() if key != "content"})
+
+    elif parts[0] == "records" and parts[-3:] == ["draft", "actions", "publish"] and parts[1] in mock.drafts:
+      status, payload = mock.publish_draft(parts[1])
+      self._send_json(status, payload)
+
+    elif parts[0] == "records" and parts[-2:] == ["actions", "publish"] and parts[1] in mock.records:
+      record = mock.records[parts[1]]
+      with mock._lock:
+        record["is_published"] = True
+        record["is_draft"] = False
+        record["status"] = "published"
+      self._send_json(202, record)
+    else:
+      self._send_json(404, {"status": 404, "message": "Not found."})
+
+  def do_DELETE(self):
+    parts, _ = self._route()
+    if not self._admit("/".join(parts[:1])):
+      return
+    mock = self.mock
+    if len(parts) == 5 and parts[0] == "records" and parts[2:4] == ["draft", "files"]:
+      with mock._lock:
+        deleted = mock.draft_files.pop((parts[1], parts[4]), None)
+      if deleted is None:
+        self._send_json(404, {"status": 404, "message": "Not found."})
+      else:
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+    elif len(parts) == 2 and parts[0] == "records" and mock.records.pop(parts[1], None) is not None:
+      mock.ordered_ids.remove(parts[1])
+      self.send_response(204)
+      self.send_header("Content-Length", "0")
+      self.end_headers()
+    else:
+      self._send_json(404, {"status": 404, "message": "Not found."})
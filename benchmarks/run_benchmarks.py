@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Offline benchmarks of the Zenodo client against a local mock InvenioRDM server.
+
+Usage:
+  run_benchmarks.py [--only=<names>] [--records=<n>] [--file-size=<bytes>] [--latency=<s>] [--throttle-every=<n>] [--results-dir=<dir>] [--compare=<file>] [--tolerance=<pct>] [--memory]
+
+Options:
+  --only=<names>         Comma-separated benchmarks to run (default: all).
+  --records=<n>          Number of synthetic records served [default: 500].
+  --file-size=<bytes>    Size of each synthetic file [default: 262144].
+  --latency=<s>          Latency injected on every response, in seconds [default: 0].
+  --throttle-every=<n>   Answer every Nth request with 429 (0 disables) [default: 0].
+  --results-dir=<dir>    Directory where results are stored [default: benchmarks/results].
+  --compare=<file>       Previous results file to compare against.
+  --tolerance=<pct>      Allowed throughput drop before reporting a regression [default: 10].
+  --memory               Run each benchmark a second time under tracemalloc to measure its peak memory.
+"""
+
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Dynamically add the project root directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.mock_server import MockInvenioServer
+from utils import compression
+from utils.dedup import analyze_cache
+from utils.docopt import docopt
+from utils.record_cache import RecordCache
+from utils.rules import load_rules, transform_cache, update_records
+from utils.zenodo_api import ZenodoAPI
+
+logger = logging.getLogger("benchmarks")
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "..", "config")
+
+
+def bench_fetch(api, server, workdir):
+  """Page through the whole community listing."""
+  size = 100
+  page = 1
+  count = 0
+  while True:
+    records = api.fetch_records(community_id=server.communities[0], page=page, size=size)
+    count += len(records)
+    if len(records) < size:
+      break
+    page += 1
+  return {"records": count}
+
+
+def bench_fetch_stream(api, server, workdir):
+  """Page through the whole community listing, decoding the records from the response stream."""
+  size = 100
+  page = 1
+  count = 0
+  started = time.perf_counter()
+  first_record = None
+  while True:
+    meta = {}
+    listed = 0
+    for record in api.iter_search_records(server.communities[0], page=page, size=size, meta=meta):
+      if first_record is None:
+        first_record = time.perf_counter() - started
+      listed += 1
+    count += listed
+    if listed < size or "next" not in meta["links"]:
+      break
+    page += 1
+  return {"records": count, "first_record_seconds": first_record}
+
+
+def bench_download(api, server, workdir):
+  """Download every file of every record."""
+  count = 0
+  total = 0
+  for record in server.community_records():
+    for key in record["files"]["entries"]:
+      size = api.download_file(record["id"], key, os.path.join(workdir, "download.bin"))
+      total += size or 0
+    count += 1
+  return {"records": count, "bytes": total}
+
+
+def bench_update(api, server, workdir):
+  """Update the metadata of every record."""
+  count = 0
+  for record in server.community_records():
+    metadata = {"metadata": dict(record["metadata"], publisher="CF Conventions")}
+    if api.update_record(record["id"], metadata) is not None:
+      count += 1
+  return {"records": count}
+
+
+def bench_publish(api, server, workdir):
+  """Publish every record."""
+  count = 0
+  for record in server.community_records():
+    if api.publish_record(record["id"]) is not None:
+      count += 1
+  return {"records": count}
+
+
+def bench_rules(api, server, workdir):
+  """
+  Apply the example curation rules to a cache of every record, then update the changed records.
+
+  Only the transformation of the cache is timed; the concurrent update of
+  the changed records is reported as `update_seconds`.
+  """
+  with open(os.path.join(CONFIG_DIR, "metadata_template.json")) as f:
+    cache = RecordCache(workdir, json.load(f))
+  for record in server.community_records():
+    cache.store(record)
+  cache.save_index()
+
+  report = transform_cache(cache, load_rules(os.path.join(CONFIG_DIR, "curation_rules.json")))
+  update = update_records(api, report["changed"], workers=8)
+  return {
+    "records": report["records"],
+    "changed": len(report["changed"]),
+    "failed": len(update["failed"]),
+    "seconds": report["seconds"],
+    "update_seconds": update["seconds"],
+  }
+
+
+def bench_dedup(api, server, workdir):
+  """
+  Find the duplicates among a cache of every record (blocking and MinHash/LSH over the titles).
+  """
+  cache = RecordCache(workdir)
+  for record in server.community_records():
+    cache.store(record)
+  cache.save_index()
+
+  started = time.perf_counter()
+  report = analyze_cache(cache)
+  return {
+    "records": report["records"],
+    "clusters": len(report["clusters"]),
+    "candidates": report["candidates"],
+    "seconds": time.perf_counter() - started,
+  }
+
+
+def compression_benchmark(codec_name):
+  """
+  Build a benchmark of a cache codec: compression ratio and decode throughput.
+
+  The dictionary is trained on the first 100 records; only decoding
+  (decompression and JSON parsing of every record) is timed.
+  """
+  def bench(api, server, workdir):
+    records = [json.dumps(record).encode() for record in server.community_records()]
+    codec = compression.load_codec(codec_name, workdir, samples=records[:100])
+    blobs = [codec.compress(data) for data in records]
+
+    started = time.perf_counter()
+    for blob in blobs:
+      json.loads(codec.decompress(blob))
+    seconds = time.perf_counter() - started
+
+    raw_size = sum(len(data) for data in records)
+    compressed_size = sum(len(blob) for blob in blobs)
+    return {
+      "records": len(records),
+      "bytes": raw_size,
+      "compressed_bytes": compressed_size,
+      "ratio": raw_size / compressed_size,
+      "seconds": seconds,
+    }
+
+  bench.__doc__ = f"Compress cached records with {codec_name} and time decoding."
+  return bench
+
+
+# Benchmarks run by default, in order
+BENCHMARKS = {
+  "fetch": bench_fetch,
+  "fetch-stream": bench_fetch_stream,
+  "download": bench_download,
+  "update": bench_update,
+  "publish": bench_publish,
+  "rules": bench_rules,
+  "dedup": bench_dedup,
+}
+for _name in compression.CODECS:
+  if _name != "zstd" or compression.zstandard is not None:
+    BENCHMARKS[f"decode-{_name}"] = compression_benchmark(_name)
+
+
+def _bytes_received(api):
+  return sum(stats["bytes_in"] for stats in api.metrics.snapshot()["endpoints"].values())
+
+
+def run_benchmark(name, func, api, server, memory=False):
+  """
+  Run a benchmark measuring wall time and throughput, and optionally peak traced memory.
+
+  Benchmarks that do not report `bytes` are credited with the bytes received
+  from the API, as recorded by the client metrics. Benchmarks may report
+  their own `seconds` when only part of the work is timed.
+
+  Tracing allocations slows the code down, so throughput is timed untraced
+  and the peak memory is measured by a separate run under tracemalloc.
+
+  Args:
+    memory (bool, optional): Also measure peak traced memory (`peak_memory_mb`).
+
+  Returns:
+    dict: The benchmark result.
+  """
+  received_before = _bytes_received(api)
+  with tempfile.TemporaryDirectory() as workdir:
+    started = time.perf_counter()
+    result = func(api, server, workdir)
+    seconds = time.perf_counter() - started
+
+  result.setdefault("bytes", _bytes_received(api) - received_before)
+  seconds = result.setdefault("seconds", seconds)
+  result["records_per_second"] = result.get("records", 0) / seconds if seconds else 0.0
+  result["mb_per_second"] = result.get("bytes", 0) / 1024 / 1024 / seconds if seconds else 0.0
+  details = ""
+  if memory:
+    with tempfile.TemporaryDirectory() as workdir:
+      tracemalloc.start()
+      try:
+        func(api, server, workdir)
+        _, peak = tracemalloc.get_traced_memory()
+      finally:
+        tracemalloc.stop()
+    result["peak_memory_mb"] = peak / 1024 / 1024
+    details += f"  {result['peak_memory_mb']:7.1f} MB peak"
+  if "ratio" in result:
+    details += f"  ratio {result['ratio']:.1f}x"
+  if result.get("first_record_seconds") is not None:
+    details += f"  first record {result['first_record_seconds'] * 1000:.1f} ms"
+  logger.info(
+    f"{name:<16} {result.get('records', 0):>7} records  {seconds:8.3f}s  "
+    f"{result['records_per_second']:10.1f} rec/s  {result['mb_per_second']:8.1f} MB/s{details}"
+  )
+  return result
+
+
+def compare_results(current, previous, tolerance):
+  """
+  Compare throughput with a previous run.
+
+  Args:
+    current (dict): Results of this run, by benchmark name.
+    previous (dict): Results of the previous run, by benchmark name.
+    tolerance (float): Allowed relative drop of `records_per_second` (percent).
+
+  Returns:
+    list: Names of the benchmarks that regressed.
+  """
+  regressions = []
+  for name, result in current.items():
+    before = previous.get(name, {}).get("records_per_second")
+    if not before:
+      continue
+    change = (result["records_per_second"] - before) / before * 100
+    logger.info(f"{name:<16} {before:10.1f} -> {result['records_per_second']:10.1f} rec/s ({change:+.1f}%)")
+    if change < -tolerance:
+      regressions.append(name)
+  return regressions
+
+
+def main():
+  args = docopt(__doc__)
+  logging.basicConfig(level=logging.INFO, format="%(message)s")
+  logging.getLogger("zenodo_api").setLevel(logging.WARNING)
+
+  names = args["--only"].split(",") if args["--only"] else list(BENCHMARKS)
+  unknown = [name for name in names if name not in BENCHMARKS]
+  if unknown:
+    logger.error(f"Unknown benchmarks: {', '.join(unknown)}. Available: {', '.join(BENCHMARKS)}")
+    sys.exit(1)
+
+  parameters = {
+    "records": int(args["--records"]),
+    "file_size": int(args["--file-size"]),
+    "latency": float(args["--latency"]),
+    "throttle_every": int(args["--throttle-every"]),
+  }
+
+  results = {}
+  with MockInvenioServer(
+    num_records=parameters["records"],
+    file_size=parameters["file_size"],
+    latency=parameters["latency"],
+    throttle_every=parameters["throttle_every"],
+  ) as server:
+    api = ZenodoAPI(base_url=server.base_url, access_token="benchmark")
+    for name in names:
+      results[name] = run_benchmark(name, BENCHMARKS[name], api, server, memory=args["--memory"])
+
+  os.makedirs(args["--results-dir"], exist_ok=True)
+  results_path = os.path.join(args["--results-dir"], f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+  with open(results_path, "w") as f:
+    json.dump({
+      "timestamp": time.time(),
+      "python": platform.python_version(),
+      "parameters": parameters,
+      "results": results,
+    }, f, indent=2)
+  logger.info(f"Results stored in {results_path}")
+
+  if args["--compare"]:
+    with open(args["--compare"]) as f:
+      previous = json.load(f)
+    if previous.get("parameters") != parameters:
+      logger.warning(f"Comparing runs with different parameters: {previous.get('parameters')} vs {parameters}")
+    regressions = compare_results(results, previous.get("results", {}), float(args["--tolerance"]))
+    if regressions:
+      logger.error(f"Throughput regressions: {', '.join(regressions)}")
+      sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -3,6 +3,16 @@
 # Copyright (c) 2024 Antonio S. Cofiño
 # Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
 
+"""
+Fetch and cache Zenodo records
+
+Usage:
+  fetch_records.py [--profile]
+
+Options:
+  --profile    Profile the harvest and write a report next to the log file.
+"""
+
 import sys
 import os
 import logging
@@ -10,30 +20,50 @@ import logging
 # Dynamically add the project root directory to the Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from utils.config_utils import initialize_workspace
+from utils.docopt import docopt
+from utils.config_utils import DEFAULT_LOG_FILE, initialize_workspace
+from utils.harvest import build_sources, harvest_sources, load_harvest_spec, source_name
+from utils.metrics import report_metrics
+from utils.pipeline import QUEUE_SIZE
+from utils.profiling import profile_command
+from utils.record_cache import RecordCache
+from utils.validation import load_validator
 from utils.zenodo_api import ZenodoAPI
 
-# Initialize environment and configurations
-zenodo_config, fetch_settings, metadata_template = initialize_workspace()
+# Configurations, loaded by main() (importing the script has no side effects)
+zenodo_config, fetch_settings, metadata_template = {}, {}, None
 
-# Set up logging
+# Logger of the script (queued logging is set up by initialize_workspace in main)
 logger = logging.getLogger("fetch_records")
-logging.basicConfig(
-  level=logging.INFO, 
-  format="%(asctime)s - %(levelname)s - %(message)s"
-)
 
 
 def main():
+  """
+  Entry point: parse the CLI arguments and run the harvest, optionally profiled.
+  """
+  global zenodo_config, fetch_settings, metadata_template
+  args = docopt(__doc__)
+  zenodo_config, fetch_settings, metadata_template = initialize_workspace()
+  log_file = fetch_settings.get("log_file", DEFAULT_LOG_FILE)
+  with profile_command("fetch_records", log_file, enabled=args["--profile"]):
+    fetch()
+
+
+def fetch():
   """
   Main function to fetch records from Zenodo.
   """
   try:
     # Get configuration details
-    community_id = zenodo_config.get("community_id")
-    if not community_id:
-      logger.error("No community ID provided in the configuration. Please check zenodo_config.json or environment variables.")
+    spec_path = fetch_settings.get("harvest_spec")
+    spec = load_harvest_spec(spec_path) if spec_path else {}
+    sources = spec.get("sources")
+    if not sources and zenodo_config.get("community_id"):
+      sources = build_sources([zenodo_config["community_id"]])
+    if not sources:
+      logger.error("No community ID or harvest spec provided in the configuration. Please check zenodo_config.json, default_settings.json or environment variables.")
       sys.exit(1)
+    workers = int(spec.get("workers") or fetch_settings.get("harvest_workers", 4))
       
     output_dir = fetch_settings.get("output_dir", "./records")
     dry_run = fetch_settings.get("dry_run", False)
@@ -49,18 +79,30 @@ def main():
       logger.error(f"Failed to initialize ZenodoAPI: {e}", exc_info=True)
       sys.exit(1)
 
-    logger.info(f"Starting to fetch records from Zenodo community: {community_id}")
+    logger.info(f"Starting to fetch records from Zenodo: {', '.join(source_name(source) for source in sources)}")
     
-    # Call the API to fetch records
+    # Harvest the records of every source into the cache
     try:
-      records = api.fetch_records(community_id=community_id, page=1, size=zenodo_config.get("max_records_per_page", 1000))
-      if not records:
-        logger.info(f"No records found for community {community_id}.")
+      size = zenodo_config.get("max_records_per_page", 1000)
+      if dry_run:
+        for source in sources:
+          records = api.fetch_records(community_id=source.get("community"), page=1, size=size, query=source.get("query"))
+          logger.info(f"[DRY RUN] Would have cached {len(records)} records from the first page of {source_name(source)}.")
       else:
-        logger.info(f"Successfully fetched {len(records)} records from community {community_id}.")
+        cache = RecordCache(output_dir, metadata_template, metrics=api.metrics, compression=fetch_settings.get("cache_compression"))
+        pipeline_settings = fetch_settings.get("pipeline", {})
+        harvest_sources(
+          api, cache, sources, size=size,
+          download_files=fetch_settings.get("download_files", True), workers=workers,
+          stage_workers=pipeline_settings.get("stage_workers"),
+          queue_size=pipeline_settings.get("queue_size", QUEUE_SIZE),
+          validator=load_validator(pipeline_settings.get("validation_schema"))
+        )
     except Exception as e:
       logger.error(f"Error occurred while fetching records: {e}", exc_info=True)
       sys.exit(1)
+    finally:
+      report_metrics(api.metrics, fetch_settings.get("metrics_exporters"))
     
     logger.info("All records have been fetched successfully.")
 
@@ -7,73 +7,192 @@
 Zenodo CLI
 
 Usage:
-  zenodo.py fetch [--community-id=<id>] [--output-dir=<dir>] [--dry-run]
-  zenodo.py update --record-id=<id> [--output-dir=<dir>]
-  zenodo.py publish --record-id=<id> [--dry-run]
-  zenodo.py show --record-id=<id> [--output-dir=<dir>]
+  zenodo.py fetch [--community-id=<id>]... [--query=<q>]... [--spec=<file>] [--workers=<n>] [--sharded] [--processes=<n>] [--partition-size=<n>] [--bandwidth=<rate>] [--output-dir=<dir>] [--dry-run] [--profile]
+  zenodo.py shard-worker [--processes=<n>] [--output-dir=<dir>] [--profile]
+  zenodo.py update --record-id=<id> [--output-dir=<dir>] [--profile]
+  zenodo.py curate --rules=<file> [--workers=<n>] [--output-dir=<dir>] [--dry-run] [--profile]
+  zenodo.py publish --record-id=<id> [--dry-run] [--profile]
+  zenodo.py show --record-id=<id> [--output-dir=<dir>] [--profile]
+  zenodo.py export --export-dir=<dir> [--layout=<layout>] [--copy] [--output-dir=<dir>] [--profile]
+  zenodo.py cite [--format=<fmt>] [--out=<file>] [--output-dir=<dir>] [--profile] [<record_id>...]
+  zenodo.py changes [--since=<date>] [--type=<type>]... [--json] [--output-dir=<dir>] [--profile]
+  zenodo.py download [--order=<order>] [--budget=<size>] [--bandwidth=<rate>] [--workers=<n>] [--per-host=<n>] [--output-dir=<dir>] [--dry-run] [--profile]
+  zenodo.py check-links [--ttl=<days>] [--workers=<n>] [--json] [--output-dir=<dir>] [--profile]
+  zenodo.py dedup [--threshold=<x>] [--json] [--output-dir=<dir>] [--profile]
+  zenodo.py stats [--metric=<name>] [--since=<date>] [--top=<n>] [--json] [--output-dir=<dir>] [--profile]
+  zenodo.py verify [--repair] [--processes=<n>] [--output-dir=<dir>] [--profile]
+  zenodo.py upload --batch-dir=<dir> [--workers=<n>] [--dry-run] [--profile]
+  zenodo.py publish-batch [--draft-id=<id>]... [--batch-dir=<dir>] [--workers=<n>] [--dry-run] [--profile]
 
 Options:
-  --community-id=<id>    The Zenodo community to fetch records from.
+  --community-id=<id>    The Zenodo community to fetch records from (repeatable).
+  --query=<q>            A search query to fetch records from (repeatable).
+  --spec=<file>          A harvest spec (JSON) listing the communities and queries to fetch.
+  --workers=<n>          Number of communities/queries fetched (files uploaded or downloaded, records updated, links checked) concurrently.
+  --sharded              Split the harvest into date partitions run by a pool of worker processes.
+  --processes=<n>        Number of worker processes of a sharded harvest or of a verification.
+  --partition-size=<n>   Number of records per partition of a sharded harvest.
   --output-dir=<dir>     Directory to store records [default: ./records].
   --dry-run              Run the command without making any changes.
   --record-id=<id>       The ID of the record to update, publish, or view.
+  --rules=<file>         A curation rules file (JSON) applied to the cached metadata.
+  --since=<date>         List changes (or stats growth) from this ISO date/datetime or age (e.g. 2024-06-01, 12h, 7d).
+  --type=<type>          Only list changes of this type (new_record, new_version, metadata, files, revision).
+  --json                 Print the changes as JSON lines (or the stats, duplicates and broken links as JSON).
+  --ttl=<days>           Age in days after which a working link is checked again.
+  --threshold=<x>        Minimum title similarity (Jaccard, 0-1) of near-duplicate records.
+  --metric=<name>        Statistic: views, unique_views, downloads, unique_downloads, data_volume,
+                         or all_<name> for all versions [default: downloads].
+  --top=<n>              Number of records listed by growth [default: 10].
+  --batch-dir=<dir>      Directory with one folder (metadata.json and files/) per draft to create.
+  --draft-id=<id>        A draft to publish in a batch (repeatable).
+  --export-dir=<dir>     Directory of the exported mirror.
+  --layout=<layout>      Export layout: static or bagit [default: static].
+  --copy                 Copy the exported files instead of hardlinking them.
+  --format=<fmt>         Citation format: bibtex, csl, datacite or cff [default: bibtex].
+  --out=<file>           Write the citations to a file instead of the standard output.
+  --order=<order>        Download priority: smallest, newest or index.
+  --budget=<size>        Maximum bytes downloaded by a run (e.g. 500MB, 2GiB); the other files are deferred.
+  --bandwidth=<rate>     Maximum download rate of the files, in bytes per second (e.g. 5MB, 500KiB).
+  --per-host=<n>         Maximum downloads in flight to each host (Zenodo serves every file from one host).
+  --repair               Re-fetch the records and files found broken by verify.
+  --profile              Profile the command and write a report next to the log file.
 """
 
 import sys
 import os
+import json
 import logging
+from datetime import datetime, timezone
 
 # Dynamically add the project root directory to the Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from utils.dedup import THRESHOLD, analyze_cache
+from utils.downloads import DownloadScheduler, parse_size
 from utils.docopt import docopt
-from utils.config_utils import initialize_workspace
+from utils.changes import CHANGE_TYPES, format_change, parse_since
+from utils.citations import FORMATS, CitationCache, combine_citations
+from utils.config_utils import DEFAULT_LOG_FILE, initialize_workspace
+from utils.export import export_cache
+from utils.harvest import build_sources, harvest_sources, load_harvest_spec, source_name
+from utils.links import LinkChecker, check_cache_links
+from utils.metrics import report_metrics
+from utils.pipeline import QUEUE_SIZE
+from utils.profiling import profile_command
+from utils.publish import publish_drafts
+from utils.record_cache import RecordCache
+from utils.rules import load_rules, transform_cache, update_records
+from utils.shards import PARTITION_SIZE, ShardCoordinator, harvest_sharded, run_shard_workers
+from utils.stats import COLUMNS
+from utils.uploads import JOURNAL_FILE, UploadJournal, find_upload_folders, local_files, upload_batch
+from utils.validation import load_validator
+from utils.verify import PROBLEMS, repair_cache, verify_cache
 from utils.zenodo_api import ZenodoAPI
 
-# Initialize environment and configurations
-zenodo_config, fetch_settings, metadata_template = initialize_workspace()
+# Configurations, loaded by main() (importing the script has no side effects)
+zenodo_config, fetch_settings, metadata_template = {}, {}, None
 
-# Initialize logging
+# Logger of the CLI (queued logging is set up by initialize_workspace in main)
 logger = logging.getLogger("zenodo_cli")
-logging.basicConfig(
-  level=logging.INFO, 
-  format="%(asctime)s - %(levelname)s - %(message)s"
-)
+
+
+COMMANDS = ("fetch", "shard-worker", "update", "curate", "publish", "show", "changes", "verify", "upload", "publish-batch", "export", "cite", "stats", "dedup", "check-links", "download")
 
 
 def main():
   """Main entry point for the CLI."""
+  global zenodo_config, fetch_settings, metadata_template
   args = docopt(__doc__)
+  command = next(name for name in COMMANDS if args[name])
+  zenodo_config, fetch_settings, metadata_template = initialize_workspace()
+
+  log_file = fetch_settings.get("log_file", DEFAULT_LOG_FILE)
+  with profile_command(command, log_file, enabled=args["--profile"]):
+    run_command(args)
+
 
+def run_command(args):
+  """Run the command selected by the parsed CLI arguments."""
   # Load arguments
   output_dir = args["--output-dir"] or fetch_settings.get("output_dir", "./records")
-  community_id = args["--community-id"] or zenodo_config.get("community_id")
   record_id = args["--record-id"]
   dry_run = args["--dry-run"]
 
-  # Instantiate Zenodo API client
+  processes = int(args["--processes"] or fetch_settings.get("shard_processes", 4))
+  pipeline_settings = fetch_settings.get("pipeline", {})
+  download_settings = fetch_settings.get("downloads", {})
+  try:
+    bandwidth = args["--bandwidth"] or download_settings.get("bandwidth")
+    bandwidth_limit = parse_size(bandwidth) if bandwidth else None
+    budget = args["--budget"] or download_settings.get("budget")
+    budget = parse_size(budget) if budget else None
+  except ValueError as e:
+    logger.error(str(e))
+    sys.exit(1)
+
+  # Instantiate Zenodo API client (sharded harvest workers build their own from the same settings)
+  api_settings = {
+    "base_url": zenodo_config.get("base_url"),
+    "access_token": zenodo_config.get("access_token"),
+    "retry_attempts": zenodo_config.get("retry_attempts", 3),
+    "rate_limit_per_minute": zenodo_config.get("rate_limit_per_minute"),
+    "pool_size": zenodo_config.get("pool_size", 10),
+    "bandwidth_limit": bandwidth_limit,
+  }
   try:
-    api_client = ZenodoAPI(
-      base_url=zenodo_config.get("base_url"),
-      access_token=zenodo_config.get("access_token")
-    )
+    api_client = ZenodoAPI(**api_settings)
   except Exception as e:
     logger.error(f"Failed to initialize ZenodoAPI: {e}", exc_info=True)
     sys.exit(1)
 
   try:
     if args["fetch"]:
-      if not community_id:
-        logger.error("Please specify a community ID with --community-id=<id>")
+      spec_path = args["--spec"] or fetch_settings.get("harvest_spec")
+      spec = load_harvest_spec(spec_path) if spec_path else {}
+      sources = build_sources(args["--community-id"], args["--query"]) or spec.get("sources")
+      if not sources and zenodo_config.get("community_id"):
+        sources = build_sources([zenodo_config["community_id"]])
+      if not sources:
+        logger.error("Please specify a community ID with --community-id=<id>, a query with --query=<q> or a spec with --spec=<file>")
         sys.exit(1)
+      workers = int(args["--workers"] or spec.get("workers") or fetch_settings.get("harvest_workers", 4))
 
-      logger.info(f"Fetching records from Zenodo community: {community_id}")
-      records = api_client.fetch_records(community_id=community_id, page=1, size=zenodo_config.get("max_records_per_page", 1000))
-      
-      if not records:
-        logger.info(f"No records found for community {community_id}.")
+      logger.info(f"Fetching records from Zenodo: {', '.join(source_name(source) for source in sources)}")
+      size = zenodo_config.get("max_records_per_page", 1000)
+      if dry_run:
+        for source in sources:
+          records = api_client.fetch_records(community_id=source.get("community"), page=1, size=size, query=source.get("query"))
+          logger.info(f"[DRY RUN] Would have cached {len(records)} records from the first page of {source_name(source)}.")
+      elif args["--sharded"]:
+        cache = RecordCache(output_dir, metadata_template, metrics=api_client.metrics, compression=fetch_settings.get("cache_compression"))
+        partition_size = int(args["--partition-size"] or fetch_settings.get("partition_size", PARTITION_SIZE))
+        harvest_sharded(
+          api_client, cache, sources, api_settings, size=size,
+          download_files=fetch_settings.get("download_files", True),
+          partition_size=partition_size, processes=processes, pipeline_settings=pipeline_settings
+        )
       else:
-        logger.info(f"Fetched {len(records)} records from community {community_id}.")
+        cache = RecordCache(output_dir, metadata_template, metrics=api_client.metrics, compression=fetch_settings.get("cache_compression"))
+        harvest_sources(
+          api_client, cache, sources, size=size,
+          download_files=fetch_settings.get("download_files", True), workers=workers,
+          stage_workers=pipeline_settings.get("stage_workers"),
+          queue_size=pipeline_settings.get("queue_size", QUEUE_SIZE),
+          validator=load_validator(pipeline_settings.get("validation_schema"))
+        )
+
+      report_metrics(api_client.metrics, fetch_settings.get("metrics_exporters"))
+
+    elif args["shard-worker"]:
+      coordinator = ShardCoordinator(output_dir)
+      if not coordinator.exists():
+        logger.error(f"No sharded harvest planned in {output_dir}. Start one with: zenodo.py fetch --sharded")
+        sys.exit(1)
+
+      logger.info(f"Joining sharded harvest in {output_dir} with {processes} worker processes")
+      harvested = run_shard_workers(output_dir, api_settings, metadata_template, processes, pipeline_settings)
+      logger.info(f"Harvested {len(harvested)} partitions; remaining: {coordinator.status() or 'none'}")
 
     elif args["update"]:
       if not record_id:
@@ -93,6 +212,28 @@ def main():
       if response:
         logger.info(f"Successfully updated record {record_id}")
 
+    elif args["curate"]:
+      try:
+        rules = load_rules(args["--rules"])
+      except (OSError, ValueError) as e:
+        logger.error(f"Invalid rules file {args['--rules']}: {e}")
+        sys.exit(1)
+
+      report = transform_cache(RecordCache(output_dir), rules)
+      changed = report["changed"]
+      if dry_run:
+        for record_id, change in changed.items():
+          print(f"{record_id}  {', '.join(change['rules'])}")
+        logger.info(f"[DRY RUN] Would have updated {len(changed)} records.")
+      elif changed:
+        workers = int(args["--workers"] or fetch_settings.get("update_workers", 4))
+        result = update_records(api_client, changed, workers=workers)
+        report_metrics(api_client.metrics, fetch_settings.get("metrics_exporters"))
+        if result["failed"]:
+          logger.error(f"Failed updates (run the rules again to retry): {', '.join(result['failed'])}")
+          sys.exit(1)
+        logger.info("Run zenodo.py fetch to refresh the cache with the updated records.")
+
     elif args["publish"]:
       if not record_id:
         logger.error("Please specify a record ID with --record-id=<id>")
@@ -112,12 +253,225 @@ def main():
         sys.exit(1)
 
       logger.info(f"Showing metadata for record with ID: {record_id}")
-      response = api_client.fetch_record(record_id=record_id)
+      cache = RecordCache(output_dir, metadata_template, metrics=api_client.metrics, compression=fetch_settings.get("cache_compression"))
+      response = cache.load_record(record_id)
+      api_client.metrics.record_cache_lookup(response is not None)
+      if response is None:
+        response = api_client.fetch_record(record_id=record_id)
+        if response:
+          cache.store(response)
+          cache.save_index()
       if response:
         logger.info(f"Record {record_id} metadata: {json.dumps(response, indent=2)}")
       else:
         logger.info(f"Record {record_id} not found.")
 
+    elif args["export"]:
+      if not os.path.exists(os.path.join(output_dir, "index.json")):
+        logger.error(f"No cached records in {output_dir}. Fetch them first with: zenodo.py fetch")
+        sys.exit(1)
+      export_cache(output_dir, args["--export-dir"], layout=args["--layout"], link=not args["--copy"])
+
+    elif args["cite"]:
+      fmt = args["--format"]
+      if fmt not in FORMATS:
+        logger.error(f"Unknown citation format '{fmt}'. Available: {', '.join(FORMATS)}")
+        sys.exit(1)
+      cache = RecordCache(output_dir)
+      missing = [record_id for record_id in args["<record_id>"] if record_id not in cache.index]
+      if missing or not cache.index:
+        logger.error(f"Records not cached in {output_dir}: {', '.join(missing) or 'all'}. Fetch them first with: zenodo.py fetch")
+        sys.exit(1)
+
+      citations, _ = CitationCache(cache).render(fmt, args["<record_id>"])
+      document = combine_citations(fmt, citations)
+      if args["--out"]:
+        with open(args["--out"], "w", encoding="utf-8") as f:
+          f.write(document)
+        logger.info(f"Wrote {len(citations)} {fmt} citations to {args['--out']}")
+      else:
+        sys.stdout.write(document)
+
+    elif args["changes"]:
+      types = set(args["--type"])
+      unknown = types - set(CHANGE_TYPES)
+      if unknown:
+        logger.error(f"Unknown change type(s) {', '.join(sorted(unknown))}. Available: {', '.join(CHANGE_TYPES)}")
+        sys.exit(1)
+      try:
+        since = parse_since(args["--since"]) if args["--since"] else None
+      except ValueError:
+        logger.error(f"Invalid --since value '{args['--since']}': use an ISO date/datetime or an age such as 12h or 7d")
+        sys.exit(1)
+
+      feed = RecordCache(output_dir).changes
+      if not feed.exists():
+        logger.info(f"No changes recorded in {output_dir} yet (the feed starts after the first harvest).")
+      totals = dict.fromkeys(CHANGE_TYPES, 0)
+      for change in feed.read(since):
+        if types and not types.intersection(change["types"]):
+          continue
+        for change_type in change["types"]:
+          totals[change_type] += 1
+        print(json.dumps(change) if args["--json"] else format_change(change))
+      logger.info("Changes: " + ", ".join(f"{count} {change_type}" for change_type, count in totals.items()))
+
+    elif args["stats"]:
+      metric = args["--metric"]
+      if metric not in COLUMNS:
+        logger.error(f"Unknown statistic '{metric}'. Available: {', '.join(COLUMNS)}")
+        sys.exit(1)
+      try:
+        since = parse_since(args["--since"]) if args["--since"] else None
+      except ValueError:
+        logger.error(f"Invalid --since value '{args['--since']}': use an ISO date/datetime or an age such as 12h or 7d")
+        sys.exit(1)
+
+      store = RecordCache(output_dir).stats
+      if not store.exists():
+        logger.info(f"No statistics recorded in {output_dir} yet (they are snapshotted by every harvest).")
+      series = store.community_series(metric)
+      growth = store.growth(metric, since=since, limit=int(args["--top"]))
+      if args["--json"]:
+        print(json.dumps({
+          "series": {name: list(column) for name, column in series.items()},
+          "growth": {name: list(column) for name, column in growth.items()},
+        }))
+      else:
+        print(f"Community {metric}:")
+        for when, total in zip(series["time"], series[metric]):
+          print(f"  {datetime.fromtimestamp(when, timezone.utc).isoformat(timespec='seconds')}  {total}")
+        print(f"Top {len(growth['record_id'])} records by {metric} growth" + (f" since {args['--since']}:" if since else ":"))
+        for record_id, start, end, delta in zip(growth["record_id"], growth["start"], growth["end"], growth["delta"]):
+          print(f"  {record_id}  +{delta} ({start} -> {end})")
+
+    elif args["dedup"]:
+      threshold = float(args["--threshold"] or THRESHOLD)
+      cache = RecordCache(output_dir)
+      if not cache.index:
+        logger.error(f"No cached records in {output_dir}. Fetch them first with: zenodo.py fetch")
+        sys.exit(1)
+      report = analyze_cache(cache, threshold=threshold)
+      if args["--json"]:
+        print(json.dumps({key: value for key, value in report.items() if key != "seconds"}, indent=2))
+      else:
+        for number, cluster in enumerate(report["clusters"], 1):
+          print(f"Cluster {number} ({', '.join(cluster['reasons'])}):")
+          for record in cluster["records"]:
+            print(f"  {record['id']}  {record['publication_date'] or '-':10}  {record['doi'] or '-'}  {record['title']}")
+
+    elif args["download"]:
+      cache = RecordCache(output_dir, metadata_template, metrics=api_client.metrics, compression=fetch_settings.get("cache_compression"))
+      if not cache.index:
+        logger.error(f"No cached records in {output_dir}. Fetch them first with: zenodo.py fetch")
+        sys.exit(1)
+      try:
+        scheduler = DownloadScheduler(
+          api_client, cache,
+          workers=int(args["--workers"] or download_settings.get("workers", 4)),
+          per_host=int(args["--per-host"] or download_settings.get("per_host", 4)),
+          order=args["--order"] or download_settings.get("order", "smallest"),
+          budget=budget,
+        )
+      except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+      if dry_run:
+        selected, deferred = scheduler.plan()
+        for file in selected:
+          print(f"{file['record_id']}  {file['size']:>12}  {file['updated'][:10]}  {file['key']}")
+        logger.info(f"Dry run: {len(selected)} files ({sum(f['size'] for f in selected) / 1e6:.1f} MB) to download, "
+                    f"{len(deferred)} deferred over the budget ({sum(f['size'] for f in deferred) / 1e6:.1f} MB)")
+      else:
+        report = scheduler.run()
+        report_metrics(api_client.metrics, fetch_settings.get("metrics_exporters"))
+        if report["failed"]:
+          failed = ", ".join(f"{file['record_id']}/{file['key']}" for file in report["failed"])
+          logger.error(f"Failed downloads (run the command again to retry): {failed}")
+          sys.exit(1)
+
+    elif args["check-links"]:
+      settings = fetch_settings.get("link_check", {})
+      cache = RecordCache(output_dir)
+      if not cache.index:
+        logger.error(f"No cached records in {output_dir}. Fetch them first with: zenodo.py fetch")
+        sys.exit(1)
+      checker = LinkChecker(
+        workers=int(args["--workers"] or settings.get("workers", 16)),
+        per_host=settings.get("per_host", 2),
+        rate_per_host=settings.get("rate_per_host", 5),
+        timeout=settings.get("timeout", 10),
+      )
+      ttl = float(args["--ttl"] or settings.get("ttl_days", 7)) * 86400
+      report = check_cache_links(cache, checker, ttl=ttl)
+      if args["--json"]:
+        print(json.dumps({key: value for key, value in report.items() if key != "seconds"}, indent=2))
+      else:
+        for link in report["broken"]:
+          records = ", ".join(sorted({reference["record_id"] for reference in link["records"]}))
+          print(f"{link['status'] or link['error']}  {link['url']}  (records: {records})")
+
+    elif args["verify"]:
+      download_files = fetch_settings.get("download_files", True)
+      report = verify_cache(output_dir, check_files=download_files, processes=processes)
+      for problem in report["problems"]:
+        logger.warning(f"Record {problem['record_id']}: {problem['problem']} ({problem['detail']}) at {problem['path']}")
+      totals = {name: sum(p["problem"] == name for p in report["problems"]) for name in PROBLEMS}
+      logger.info("Problems: " + ", ".join(f"{count} {name}" for name, count in totals.items()))
+
+      if report["problems"] and args["--repair"]:
+        result = repair_cache(
+          api_client, output_dir, report["problems"], metadata_template,
+          compression=fetch_settings.get("cache_compression"), download_files=download_files
+        )
+        if result["failed"]:
+          sys.exit(1)
+      elif report["problems"]:
+        logger.info("Run with --repair to re-fetch the broken records.")
+        sys.exit(1)
+
+    elif args["upload"]:
+      batch_dir = args["--batch-dir"]
+      if not os.path.isdir(batch_dir):
+        logger.error(f"Batch directory {batch_dir} does not exist")
+        sys.exit(1)
+
+      folders = find_upload_folders(batch_dir)
+      if dry_run:
+        for folder in folders:
+          files = local_files(os.path.join(batch_dir, folder))
+          size = sum(os.path.getsize(path) for path in files.values())
+          logger.info(f"[DRY RUN] Would have created a draft for {folder} with {len(files)} files ({size / 1e6:.1f} MB).")
+      else:
+        logger.info(f"Uploading {len(folders)} drafts from {batch_dir}")
+        workers = int(args["--workers"] or fetch_settings.get("upload_workers", 4))
+        report = upload_batch(api_client, batch_dir, workers=workers)
+        for folder in sorted(report["drafts"]):
+          logger.info(f"{folder}: draft {report['drafts'][folder]}")
+        report_metrics(api_client.metrics, fetch_settings.get("metrics_exporters"))
+        if report["failed"]:
+          logger.error(f"Failed folders (run the upload again to resume): {', '.join(report['failed'])}")
+          sys.exit(1)
+
+    elif args["publish-batch"]:
+      draft_ids = list(args["--draft-id"])
+      if args["--batch-dir"]:
+        uploads = UploadJournal(os.path.join(args["--batch-dir"], JOURNAL_FILE)).replay()
+        draft_ids += [upload["draft_id"] for upload in uploads.values() if upload["draft_id"]]
+      if not draft_ids:
+        logger.error("Please specify drafts with --draft-id=<id> or an uploaded batch with --batch-dir=<dir>")
+        sys.exit(1)
+
+      workers = int(args["--workers"] or fetch_settings.get("upload_workers", 4))
+      report = publish_drafts(
+        api_client, draft_ids, workers=workers, dry_run=dry_run,
+        validator=load_validator(pipeline_settings.get("validation_schema"))
+      )
+      if report["invalid"] or report["failed"]:
+        if report["unpublished"]:
+          logger.error(f"Unpublished drafts: {', '.join(report['unpublished'])}")
+        sys.exit(1)
+
   except Exception as e:
     logger.error(f"An unexpected error occurred: {e}", exc_info=True)
     sys.exit(1)
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from benchmarks.mock_server import MockInvenioServer
+from utils.changes import ChangeFeed, describe_change, parse_since
+from utils.harvest import harvest_sources
+from utils.record_cache import RecordCache
+from utils.zenodo_api import ZenodoAPI
+
+ENTRY = {
+  "revision_id": 3, "updated": "2024-01-01T00:00:00", "parent_id": "p1", "metadata_sha256": "aaa",
+  "files": {"data.nc": {"checksum": "md5:1", "size": 10}, "README": {"checksum": "md5:2", "size": 5}},
+}
+
+
+class TestChanges(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def test_describe_change_compares_hashes(self):
+    self.assertEqual(describe_change("1", None, ENTRY, set())["types"], ["new_record"])
+    self.assertEqual(describe_change("1", None, ENTRY, {"p1"})["types"], ["new_version"])
+    self.assertIsNone(describe_change("1", ENTRY, dict(ENTRY), {"p1"}))
+
+    edited = dict(ENTRY, revision_id=4, metadata_sha256="bbb",
+                  files={"data.nc": {"checksum": "md5:9", "size": 10}, "extra.txt": {"checksum": "md5:3", "size": 1}})
+    change = describe_change("1", ENTRY, edited, {"p1"})
+    self.assertEqual(change["types"], ["metadata", "files"])
+    self.assertEqual(change["files"], {"added": ["extra.txt"], "removed": ["README"], "changed": ["data.nc"]})
+    self.assertEqual((change["previous_revision_id"], change["revision_id"]), (3, 4))
+    self.assertEqual(describe_change("1", ENTRY, dict(ENTRY, revision_id=4), {"p1"})["types"], ["revision"])
+
+  def test_feed_reads_changes_since(self):
+    feed = ChangeFeed(os.path.join(self.tmpdir.name, "changes.jsonl"))
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(2000):
+      stamp = (started + timedelta(minutes=i)).isoformat(timespec="seconds")
+      with patch("utils.changes.utc_now", return_value=stamp):
+        feed.append(describe_change(str(i), None, ENTRY, set()), run="r")
+    # A change repeated after a crash is listed once
+    with patch("utils.changes.utc_now", return_value=stamp):
+      feed.append(describe_change("1999", None, ENTRY, set()), run="r")
+
+    since = parse_since("2024-01-02T00:00:00")
+    changes = list(feed.read(since))
+    self.assertEqual([c["record_id"] for c in changes], [str(i) for i in range(1440, 2000)])
+    self.assertEqual(len(list(feed.read())), 2000)
+    self.assertEqual(parse_since("2h", now=since), since - timedelta(hours=2))
+    with self.assertRaises(ValueError):
+      parse_since("yesterday")
+
+  def test_incremental_harvest_appends_changes(self):
+    server = MockInvenioServer(num_records=13, file_size=256)
+    with server:
+      api = ZenodoAPI(base_url=server.base_url, access_token="test_token", retry_attempts=0)
+      # Records 11 (a new version of parent 3) and 12 (a new parent) are published after the first harvest
+      server.ordered_ids = server.ordered_ids[:11]
+      harvest_sources(api, RecordCache(self.tmpdir.name), [{"community": "cfconventions"}], size=5)
+      cache = RecordCache(self.tmpdir.name)
+      self.assertFalse(cache.changes.exists())
+
+      server.ordered_ids = list(server.records)
+      ids = server.ordered_ids
+      server.records[ids[0]]["metadata"]["title"] = "Edited title"
+      server.records[ids[1]]["files"]["entries"] = {}
+      for record_id in ids[:3]:
+        server.records[record_id]["revision_id"] += 1
+      harvest_sources(api, cache, [{"community": "cfconventions"}], size=5)
+
+    changes = {c["record_id"]: c["types"] for c in cache.changes.read()}
+    self.assertEqual(changes, {
+      ids[0]: ["metadata"], ids[1]: ["files"], ids[2]: ["revision"], ids[11]: ["new_version"], ids[12]: ["new_record"],
+    })
@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from unittest.mock import Mock, patch
+
+from utils.citations import DATACITE_NAMESPACE, FORMATS, CitationCache, combine_citations, render_bibtex
+from utils.record_cache import RecordCache
+
+RECORD_PATH = os.path.join(os.path.dirname(__file__), "records", "14270689.json")
+
+
+class TestCitations(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    with open(RECORD_PATH, "r") as f:
+      self.record = json.load(f)
+    self.cache = RecordCache(self.tmpdir.name)
+    for offset in range(3):
+      record = json.loads(json.dumps(self.record))
+      record["id"] = str(int(self.record["id"]) + offset)
+      self.cache.store(record)
+    self.cache.save_index()
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def test_render_formats(self):
+    bibtex = render_bibtex(self.record)
+    self.assertTrue(bibtex.startswith("@misc{gutierrezllorente2024_14270689,"))
+    self.assertIn("author = {Gutiérrez Llorente, José Manuel}", bibtex)
+    self.assertIn("doi = {10.5281/zenodo.14270689}", bibtex)
+
+    csl = json.loads(FORMATS["csl"][0](self.record))
+    self.assertEqual((csl["type"], csl["issued"]), ("speech", {"date-parts": [[2024, 9, 17]]}))
+
+    resource = ET.fromstring(FORMATS["datacite"][0](self.record))
+    ns = {"d": DATACITE_NAMESPACE}
+    self.assertEqual(resource.find("d:identifier", ns).text, "10.5281/zenodo.14270689")
+    self.assertEqual(resource.find("d:resourceType", ns).get("resourceTypeGeneral"), "Text")
+    self.assertEqual(resource.find("d:creators/d:creator/d:nameIdentifier", ns).text, "0000-0002-2766-6297")
+
+    cff = FORMATS["cff"][0](self.record)
+    self.assertIn('  - family-names: "Gutiérrez Llorente"\n    given-names: "José Manuel"\n', cff)
+    self.assertIn('license: "CC-BY-4.0"', cff)
+
+  def test_only_changed_records_are_rendered_again(self):
+    citations, rendered = CitationCache(self.cache).render("bibtex")
+    self.assertEqual((len(citations), rendered), (3, 3))
+
+    changed = sorted(self.cache.index)[1]
+    self.cache.index[changed]["revision_id"] += 1
+    renderer = Mock(wraps=render_bibtex)
+    with patch.dict(FORMATS, bibtex=(renderer, ".bib")):
+      again, rendered = CitationCache(self.cache).render("bibtex")
+    self.assertEqual(rendered, 1)
+    self.assertEqual(renderer.call_count, 1)
+    self.assertEqual(again, citations)
+
+    document = combine_citations("datacite", CitationCache(self.cache).render("datacite")[0])
+    self.assertEqual(len(ET.fromstring(document)), 3)
+    self.assertEqual(len(json.loads(combine_citations("csl", CitationCache(self.cache).render("csl")[0]))), 3)
+    with self.assertRaises(ValueError):
+      CitationCache(self.cache).render("ris")
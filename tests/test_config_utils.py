@@ -9,7 +9,7 @@ from utils.config_utils import (
   validate_and_warn_config,
   mask_sensitive_data,
   dump_config,
-  initialize_environment
+  initialize_workspace
 )
 
 class TestConfigUtils(unittest.TestCase):
@@ -44,21 +44,25 @@ class TestConfigUtils(unittest.TestCase):
     self.assertEqual(os.getenv("TEST_KEY"), "TEST_VALUE")
     self.assertEqual(os.getenv("ANOTHER_KEY"), "AnotherValue")
 
+  @patch("os.path.exists", return_value=True)
   @patch("builtins.open", new_callable=mock_open, read_data='{"key": "value"}')
-  @patch("os.getenv", side_effect=lambda x: {"ENV_KEY": "env_value"}.get(x))
-  def test_load_config_with_env(self, mock_getenv, mock_file):
+  @patch.dict(os.environ, {"ENV_KEY": "env_value"})
+  def test_load_config_with_env(self, mock_file, mock_exists):
     config = load_config_with_env("mock_config.json", env_overrides={"key": "ENV_KEY"})
     self.assertEqual(config["key"], "env_value")
 
+  @patch("os.path.exists", return_value=True)
   @patch("builtins.open", new_callable=mock_open, read_data='{"base_url": "https://zenodo.org/api", "access_token": "test_token", "community_id": "cf-community"}')
-  def test_load_zenodo_config(self, mock_file):
+  @patch.dict(os.environ, {}, clear=True)
+  def test_load_zenodo_config(self, mock_file, mock_exists):
     config = load_zenodo_config("mock_config.json")
     self.assertEqual(config["base_url"], "https://zenodo.org/api")
     self.assertEqual(config["access_token"], "test_token")
     self.assertEqual(config["community_id"], "cf-community")
 
+  @patch("os.path.exists", return_value=True)
   @patch("builtins.open", new_callable=mock_open, read_data='{"fetch_metadata": {"output_dir": "/tmp/output"}}')
-  def test_load_fetch_settings(self, mock_file):
+  def test_load_fetch_settings(self, mock_file, mock_exists):
     settings = load_fetch_settings("mock_fetch.json")
     self.assertEqual(settings["output_dir"], "/tmp/output")
 
@@ -81,7 +85,7 @@ class TestConfigUtils(unittest.TestCase):
     }
     with self.assertLogs("utils", level="WARNING") as log:
       validate_and_warn_config(config, required_keys=["base_url", "community_id"])
-      self.assertIn("WARNING:utils:No access token provided", log.output)
+      self.assertTrue(any(line.startswith("WARNING:utils:No access token provided") for line in log.output))
 
   def test_mask_sensitive_data(self):
     sensitive_config = {
@@ -99,13 +103,18 @@ class TestConfigUtils(unittest.TestCase):
     dump_config(self.mock_config, "Test Config")
     mock_logger_info.assert_any_call('Test Config:\n{\n  "base_url": "https://zenodo.org/api",\n  "access_token": "************",\n  "community_id": "cf-community"\n}')
 
+  @patch("utils.config_utils.load_env_file")
   @patch("utils.config_utils.load_zenodo_config", return_value={"base_url": "https://zenodo.org/api", "access_token": "test_token", "community_id": "cf-community"})
   @patch("utils.config_utils.load_fetch_settings", return_value={"output_dir": "/tmp/output"})
   @patch("utils.config_utils.validate_and_warn_config")
   @patch("utils.config_utils.dump_config")
-  def test_initialize_environment(self, mock_dump, mock_validate, mock_fetch, mock_zenodo):
-    config, settings = initialize_environment()
+  @patch("utils.config_utils.setup_logging")
+  @patch("utils.config_utils.load_metadata_template", return_value={"metadata": {"title": True}})
+  def test_initialize_workspace(self, mock_template, mock_logging, mock_dump, mock_validate, mock_fetch, mock_zenodo, mock_env):
+    config, settings, template = initialize_workspace()
     self.assertEqual(config["base_url"], "https://zenodo.org/api")
     self.assertEqual(settings["output_dir"], "/tmp/output")
+    self.assertEqual(template, {"metadata": {"title": True}})
     mock_validate.assert_called_once()
     mock_dump.assert_called_once()
+    mock_logging.assert_called_once_with("./logs/fetch_records.log", "config/logging_config.json")
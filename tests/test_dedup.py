@@ -0,0 +1,81 @@
+import copy
+import json
+import random
+import tempfile
+import unittest
+
+from utils.dedup import analyze_cache, find_duplicates, normalize_title
+from utils.record_cache import RecordCache
+
+with open("config/metadata_template.json", "r") as f:
+  TEMPLATE = json.load(f)
+
+with open("tests/records/14270689.json", "r") as f:
+  RECORD = json.load(f)
+
+
+def make_record(record_id, title, parent=None, creators=("Eaton",), checksum=None, related=()):
+  record = copy.deepcopy(RECORD)
+  record["id"] = record_id
+  record["parent"] = {"id": parent or f"p{record_id}"}
+  record["pids"] = {"doi": {"identifier": f"10.5281/zenodo.{record_id}"}}
+  record["metadata"]["title"] = title
+  record["metadata"]["creators"] = [{"person_or_org": {"name": f"{name}, A.", "family_name": name}} for name in creators]
+  record["metadata"]["related_identifiers"] = [
+    {"identifier": identifier, "scheme": "doi", "relation_type": {"id": relation}} for identifier, relation in related
+  ]
+  record["files"] = {"entries": {"talk.pdf": {"checksum": checksum or f"md5:{record_id}", "size": 10}}}
+  return record
+
+
+class TestDedup(unittest.TestCase):
+
+  def test_clusters_by_files_identifiers_and_titles(self):
+    records = [
+      make_record("1", "Provenance for complex climate products"),
+      make_record("2", "Provenance for (complex) Climate Products.", creators=("Eaton", "Hassell")),
+      # A new version of 1 is not a duplicate of it, but joins its cluster
+      make_record("3", "Provenance for complex climate products", parent="p1"),
+      # A similar title by other creators
+      make_record("4", "Provenance of complex climate products", creators=("Lawrence",)),
+      make_record("5", "CF Workshop 2023 summary", checksum="md5:same"),
+      make_record("6", "Summary of the CF workshop", creators=("Hassell",), checksum="md5:same"),
+      make_record("7", "Vertical coordinates", related=[("https://doi.org/10.5281/zenodo.8", "isidenticalto")]),
+      make_record("8", "Vertical coordinate systems", creators=("Gregory",),
+                  related=[("https://doi.org/10.5281/zenodo.1", "cites")]),
+      make_record("9", "Unrelated talk"),
+    ]
+    with tempfile.TemporaryDirectory() as tmpdir:
+      cache = RecordCache(tmpdir, TEMPLATE)
+      for record in records:
+        cache.store(record)
+      report = analyze_cache(cache)
+
+    self.assertEqual(report["records"], 9)
+    clusters = [([record["id"] for record in cluster["records"]], cluster["reasons"]) for cluster in report["clusters"]]
+    self.assertEqual(clusters, [(["1", "2", "3"], ["title"]), (["5", "6"], ["files"]), (["7", "8"], ["identifiers"])])
+    links = report["clusters"][0]["links"]
+    self.assertTrue(all(link["score"] >= 0.8 for link in links))
+    self.assertNotIn(["1", "3"], [link["records"] for link in links])
+    self.assertEqual(normalize_title("Ñandú: the CF-Conventions, v1.11"), "nandu cf conventions v1 11")
+
+  def test_lsh_scales_to_near_duplicates_without_quadratic_comparisons(self):
+    words = ["ocean", "grid", "mapping", "ensemble", "aerosol", "cell", "bounds", "axis", "calendar", "units", "flags",
+             "geometry", "quantization", "taxon", "domain", "label", "coordinate", "standard", "name", "chunking"]
+    features = {}
+    for index in range(3000):
+      title = " ".join(random.Random(index).sample(words, 6))
+      features[str(index)] = {"id": str(index), "parent_id": str(index), "title": title, "norm_title": normalize_title(title),
+                              "creators": {f"author{index}"}, "identifiers": set(), "checksums": set(),
+                              "doi": None, "publication_date": None}
+    # A near-duplicate (one character changed) of every 100th record
+    for index in range(0, 3000, 100):
+      copy_id = f"copy-{index}"
+      feature = dict(features[str(index)], id=copy_id, parent_id=copy_id)
+      feature["norm_title"] = feature["norm_title"][:-1] + "x" + feature["norm_title"][-1:]
+      features[copy_id] = feature
+
+    report = find_duplicates(features, threshold=0.7)
+    found = sorted(tuple(record["id"] for record in cluster["records"]) for cluster in report["clusters"])
+    self.assertEqual(found, sorted((str(index), f"copy-{index}") for index in range(0, 3000, 100)))
+    self.assertLess(report["candidates"], 3030 * 3029 // 2 // 100)
@@ -0,0 +1,63 @@
+import os
+import tempfile
+import time
+import unittest
+
+from benchmarks.mock_server import MockInvenioServer
+from utils.downloads import DownloadScheduler, parse_size, pending_files, plan_downloads
+from utils.harvest import harvest_sources
+from utils.record_cache import RecordCache
+from utils.zenodo_api import ZenodoAPI
+
+
+def pending(record_id, key, size, updated):
+  return {"record_id": record_id, "key": key, "size": size, "checksum": None, "updated": updated}
+
+
+class TestDownloads(unittest.TestCase):
+
+  def test_priority_orders_and_budget(self):
+    self.assertEqual([parse_size(value) for value in ("512", "500k", "10MB", "1.5GiB", 42)],
+                     [512, 500000, 10000000, 1610612736, 42])
+    with self.assertRaises(ValueError):
+      parse_size("ten MB")
+
+    files = [
+      pending("1", "big.nc", 900, "2024-01-01"),
+      pending("2", "talk.pdf", 300, "2024-06-01"),
+      pending("2", "slides.pdf", 500, "2024-06-01"),
+      pending("3", "notes.txt", 100, "2023-01-01"),
+    ]
+    name = lambda selection: [file["key"] for file in selection]
+    self.assertEqual(name(plan_downloads(files, "smallest")[0]), ["notes.txt", "talk.pdf", "slides.pdf", "big.nc"])
+    self.assertEqual(name(plan_downloads(files, "newest")[0]), ["talk.pdf", "slides.pdf", "big.nc", "notes.txt"])
+    # Files over the budget are deferred, smaller ones still fill it
+    selected, deferred = plan_downloads(files, "newest", budget=1000)
+    self.assertEqual((name(selected), name(deferred)), (["talk.pdf", "slides.pdf", "notes.txt"], ["big.nc"]))
+    with self.assertRaises(ValueError):
+      plan_downloads(files, "largest")
+
+  def test_runs_within_budget_and_bandwidth(self):
+    file_size = 4000
+    with tempfile.TemporaryDirectory() as tmpdir, MockInvenioServer(num_records=6, file_size=file_size) as server:
+      api = ZenodoAPI(base_url=server.base_url, access_token="test_token", retry_attempts=0, bandwidth_limit=16000)
+      cache = RecordCache(tmpdir)
+      harvest_sources(api, cache, [{"community": "cfconventions"}], size=10, download_files=False)
+      missing = pending_files(cache)
+      self.assertEqual(len(missing), sum(len(entry["files"]) for entry in cache.index.values()))
+
+      # The first run downloads 5 files (20 kB) at 16 kB/s: 16 kB from the full bucket, then 4 kB in 0.25 s
+      started = time.monotonic()
+      report = DownloadScheduler(api, cache, workers=4, budget=5 * file_size).run()
+      self.assertGreaterEqual(time.monotonic() - started, 0.25 * 0.9)
+      self.assertEqual((report["downloaded"], report["bytes"], report["failed"]), (5, 5 * file_size, []))
+      self.assertEqual(report["deferred"], len(missing) - 5)
+
+      # The next run downloads the deferred files only; all files come from one host
+      with self.assertLogs("downloads", "INFO") as logs:
+        report = DownloadScheduler(api, cache, workers=4, per_host=2, order="newest").run()
+      self.assertIn("Downloading with 2 of 4 workers", logs.output[0])
+      self.assertEqual((report["downloaded"], report["deferred"]), (len(missing) - 5, 0))
+      self.assertEqual(pending_files(cache), [])
+      for file in missing:
+        self.assertEqual(os.path.getsize(cache.file_path(file["record_id"], file["key"])), file_size)
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.mock_server import MockInvenioServer
+from utils.export import export_cache
+from utils.harvest import harvest_sources
+from utils.record_cache import RecordCache
+from utils.zenodo_api import ZenodoAPI
+
+
+class TestExport(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.server = MockInvenioServer(num_records=5, file_size=2048)
+    cls.server.start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.stop()
+
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.cache_dir = os.path.join(self.tmpdir.name, "cache")
+    self.export_dir = os.path.join(self.tmpdir.name, "export")
+    api = ZenodoAPI(base_url=self.server.base_url, access_token="test_token", retry_attempts=0)
+    harvest_sources(api, RecordCache(self.cache_dir), [{"community": "cfconventions"}], size=10)
+
+    # The last record shares a file with the first one (e.g. an unchanged file of a new version)
+    cache = RecordCache(self.cache_dir)
+    self.ids = sorted(cache.index)
+    first, last = cache.index[self.ids[0]], cache.index[self.ids[-1]]
+    key = next(iter(first["files"]))
+    shutil.copy(cache.file_path(self.ids[0], key), cache.file_path(self.ids[-1], "shared.nc"))
+    last["files"]["shared.nc"] = dict(first["files"][key])
+    cache.save_index()
+    self.shared = (key, "shared.nc")
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def test_static_export_links_and_deduplicates(self):
+    report = export_cache(self.cache_dir, self.export_dir)
+    self.assertEqual((report["exported"], report["copied"], report["deduplicated"], report["missing_files"]), (5, 0, 1, 0))
+
+    cache = RecordCache(self.cache_dir)
+    record_dir = os.path.join(self.export_dir, "records", self.ids[1])
+    self.assertTrue(os.path.samefile(os.path.join(record_dir, "metadata.json"), cache.metadata_path(self.ids[1])))
+    first = os.path.join(self.export_dir, "records", self.ids[0], "files", self.shared[0])
+    last = os.path.join(self.export_dir, "records", self.ids[-1], "files", self.shared[1])
+    self.assertTrue(os.path.samefile(first, last))
+    with open(os.path.join(self.export_dir, "index.json")) as f:
+      self.assertEqual([record["id"] for record in json.load(f)], self.ids)
+    self.assertTrue(os.path.exists(os.path.join(self.export_dir, "index.html")))
+
+    # A re-export only rebuilds the changed records and removes the records no longer cached
+    cache.index[self.ids[2]]["revision_id"] += 1
+    del cache.index[self.ids[3]]
+    cache.save_index()
+    report = export_cache(self.cache_dir, self.export_dir)
+    self.assertEqual((report["exported"], report["unchanged"], report["removed"]), (1, 3, 1))
+    self.assertFalse(os.path.exists(os.path.join(self.export_dir, "records", self.ids[3])))
+
+  def test_bagit_export_writes_manifests(self):
+    report = export_cache(self.cache_dir, self.export_dir, layout="bagit", link=False)
+    self.assertEqual((report["exported"], report["linked"]), (5, 0))
+
+    bag = os.path.join(self.export_dir, "bags", self.ids[0])
+    with open(os.path.join(bag, "bagit.txt")) as f:
+      self.assertIn("BagIt-Version: 1.0", f.read())
+    with open(os.path.join(bag, "manifest-md5.txt")) as f:
+      manifest = [line.split("  ", 1) for line in f.read().splitlines()]
+    self.assertIn("data/metadata.json", [path for _, path in manifest])
+    for checksum, path in manifest:
+      with open(os.path.join(bag, path), "rb") as f:
+        self.assertEqual(hashlib.md5(f.read()).hexdigest(), checksum)
+    with open(os.path.join(bag, "bag-info.txt")) as f:
+      oxum = dict(line.split(": ", 1) for line in f.read().splitlines())["Payload-Oxum"]
+    self.assertEqual(oxum, f"{sum(os.path.getsize(os.path.join(bag, path)) for _, path in manifest)}.{len(manifest)}")
+
+    with self.assertRaises(ValueError):
+      export_cache(self.cache_dir, self.export_dir, layout="static")
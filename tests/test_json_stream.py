@@ -0,0 +1,40 @@
+import io
+import json
+import unittest
+from unittest.mock import patch
+
+from utils import json_stream
+from utils.json_stream import iter_hits
+
+class TestIterHits(unittest.TestCase):
+
+  def setUp(self):
+    with open("tests/records/14270689.json") as f:
+      record = json.load(f)
+    self.hits = [dict(record, id=str(i), score=i / 3) for i in range(5)]
+    self.links = {"self": "https://zenodo.org/api/records?page=1&size=5", "next": "https://zenodo.org/api/records?page=2&size=5"}
+    self.body = json.dumps({"hits": {"hits": self.hits, "total": 12}, "aggregations": {}, "sortBy": "oldest", "links": self.links}).encode()
+
+  def _decode(self, body):
+    meta = {}
+    return list(iter_hits(io.BytesIO(body), meta)), meta
+
+  def test_streamed_hits_match_full_decode(self):
+    for backend in ("ijson", None):
+      with self.subTest(backend=backend):
+        if backend and json_stream.ijson is None:
+          self.skipTest("ijson is not installed")
+        with patch.object(json_stream, "ijson", json_stream.ijson if backend else None):
+          hits, meta = self._decode(self.body)
+        self.assertEqual(hits, self.hits)
+        self.assertEqual(meta, {"total": 12, "links": self.links})
+
+  def test_response_without_links(self):
+    body = json.dumps({"hits": {"hits": self.hits, "total": {"value": 5}}}).encode()
+    hits, meta = self._decode(body)
+    self.assertEqual(len(hits), 5)
+    self.assertEqual(meta["links"], {})
+
+  def test_empty_page(self):
+    body = json.dumps({"hits": {"hits": [], "total": 0}, "links": {"self": "x"}}).encode()
+    self.assertEqual(self._decode(body), ([], {"total": 0, "links": {"self": "x"}}))
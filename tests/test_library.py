@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from benchmarks.mock_server import MockInvenioServer
+from utils import Cache, Client, Harvester
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_ALL = f"""
+import importlib.util, logging, os, sys
+sys.path.insert(0, {ROOT!r})
+import utils, utils.library
+for script in ("zenodo", "fetch_records"):
+  spec = importlib.util.spec_from_file_location(script, os.path.join({ROOT!r}, "scripts", script + ".py"))
+  spec.loader.exec_module(importlib.util.module_from_spec(spec))
+print(len(logging.getLogger().handlers), sorted(os.listdir(".")))
+"""
+
+
+class TestLibrary(unittest.TestCase):
+
+  def test_imports_have_no_side_effects(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      result = subprocess.run([sys.executable, "-c", IMPORT_ALL], cwd=tmpdir, capture_output=True, text=True,
+                              env=dict(os.environ, ZENODO_ACCESS_TOKEN="secret"))
+      self.assertEqual(result.returncode, 0, result.stderr)
+      # No logging handlers installed, no logs/ directory or other files created
+      self.assertEqual(result.stdout.strip(), "0 []")
+    # Explicit settings only: the token of the environment is not picked up
+    with patch.dict(os.environ, {"ZENODO_ACCESS_TOKEN": "secret"}):
+      self.assertIsNone(Client("http://localhost:1/api").api.access_token)
+
+  def test_iterators_and_streamed_harvest(self):
+    with tempfile.TemporaryDirectory() as tmpdir, MockInvenioServer(num_records=9, file_size=16) as server:
+      client = Client.from_config({"base_url": server.base_url, "retry_attempts": 0})
+      records = client.iter_records("cfconventions", size=4)
+      self.assertEqual(next(records)["id"], server.ordered_ids[0])
+      self.assertEqual(len(list(records)), 8)
+
+      # Stopping the iteration stops the harvest, which resumes from its journal
+      cache = Cache(os.path.join(tmpdir, "cache"))
+      harvester = Harvester(client, cache, [{"community": "cfconventions"}], size=4, download_files=False,
+                            stage_workers={"download": 1}, queue_size=1)
+      for count, (record_id, entry) in enumerate(harvester, 1):
+        self.assertEqual(entry["revision_id"], server.records[record_id]["revision_id"])
+        if count == 2:
+          break
+      self.assertTrue(2 <= len(cache.cache.journal.replay()[1]) < 9)
+      report = harvester.run()
+      self.assertEqual(report["stored"] + report["resumed"], 9)
+
+      self.assertEqual(len(cache), 9)
+      self.assertEqual([record["id"] for record in cache.iter_records()], sorted(server.ordered_ids))
+      self.assertEqual(next(cache.iter_metadata())[1]["title"], cache.record(sorted(server.ordered_ids)[0])["metadata"]["title"])
+      # The records stored after the resume are new to the cache
+      self.assertEqual(len(list(cache.iter_changes())), report["stored"])
+      # A new harvest yields nothing: every record is unchanged
+      harvester = Harvester(client, cache, [{"community": "cfconventions"}], size=4, download_files=False)
+      self.assertEqual(list(harvester), [])
+      self.assertEqual(harvester.report["unchanged"], 9)
@@ -0,0 +1,123 @@
+import copy
+import json
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.links import LinkChecker, check_cache_links, identifier_url, record_links
+from utils.record_cache import RecordCache
+
+with open("tests/records/14270689.json", "r") as f:
+  RECORD = json.load(f)
+
+
+class LinkServer(ThreadingHTTPServer):
+  """Local stand-in for the linked sites, recording the requests and the concurrency per host."""
+
+  def __init__(self):
+    super().__init__(("127.0.0.1", 0), LinkHandler)
+    self.requests = []
+    self.in_flight = {}
+    self.max_in_flight = {}
+    self.lock = threading.Lock()
+    threading.Thread(target=self.serve_forever, daemon=True).start()
+
+  def url(self, path, host="127.0.0.1"):
+    return f"http://{host}:{self.server_address[1]}{path}"
+
+
+class LinkHandler(BaseHTTPRequestHandler):
+
+  def log_message(self, *args):
+    pass
+
+  def do_HEAD(self):
+    self.respond(head=True)
+
+  def do_GET(self):
+    self.respond(head=False)
+
+  def respond(self, head):
+    server, host = self.server, self.headers["Host"].split(":")[0]
+    with server.lock:
+      server.requests.append((self.command, self.path))
+      server.in_flight[host] = server.in_flight.get(host, 0) + 1
+      server.max_in_flight[host] = max(server.max_in_flight.get(host, 0), server.in_flight[host])
+    time.sleep(0.02)
+    # Leave before responding: the client may send its next request as soon as it has the response
+    with server.lock:
+      server.in_flight[host] -= 1
+    path = self.path.split("?")[0]
+    if path == "/moved":
+      self.send_response(301)
+      self.send_header("Location", "/ok")
+    elif path == "/get-only" and head:
+      self.send_response(405)
+    else:
+      self.send_response(404 if path == "/gone" else 200)
+    self.send_header("Content-Length", "0")
+    self.end_headers()
+
+
+def make_record(record_id, urls):
+  record = copy.deepcopy(RECORD)
+  record["id"] = record_id
+  record["pids"] = {}
+  record["links"] = {"self_html": urls[0], "self": "http://127.0.0.1:1/api/not-checked"}
+  record["metadata"]["related_identifiers"] = [{"identifier": url, "scheme": "url"} for url in urls[1:]]
+  return record
+
+
+class TestLinks(unittest.TestCase):
+
+  def setUp(self):
+    self.server = LinkServer()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def test_checks_with_per_host_limits(self):
+    self.assertEqual(identifier_url("doi", "doi:10.5281/zenodo.1"), "https://doi.org/10.5281/zenodo.1")
+    self.assertEqual(identifier_url("arxiv", "arXiv:2401.00001"), "https://arxiv.org/abs/2401.00001")
+    self.assertIsNone(identifier_url("isbn", "978-3-16-148410-0"))
+    # The DOI and the landing pages, deduplicated (the API links are not checked)
+    links = record_links(RECORD)
+    self.assertEqual(links["https://doi.org/10.5281/zenodo.14270689"], ["pids.doi", "links.doi"])
+    self.assertEqual(len(links), 5)
+
+    urls = [self.server.url(f"/ok?{i}", host) for i in range(8) for host in ("127.0.0.1", "localhost")]
+    urls += [self.server.url("/gone"), self.server.url("/get-only"), self.server.url("/moved"), "http://127.0.0.1:1/refused"]
+    results = LinkChecker(workers=8, per_host=2, rate_per_host=None, timeout=5).check(urls)
+
+    self.assertTrue(all(results[url]["ok"] for url in urls[:16]))
+    self.assertEqual(self.server.max_in_flight, {"127.0.0.1": 2, "localhost": 2})
+    self.assertEqual((results[urls[16]]["ok"], results[urls[16]]["status"]), (False, 404))
+    self.assertEqual(results[urls[17]]["status"], 200)
+    self.assertIn(("GET", "/get-only"), self.server.requests)
+    self.assertEqual(results[urls[18]]["final_url"], self.server.url("/ok"))
+    self.assertIsNone(results[urls[19]]["status"])
+    self.assertIn("ConnectionError", results[urls[19]]["error"])
+
+  def test_repeated_runs_only_check_stale_or_failing_links(self):
+    ok, gone = self.server.url("/ok"), self.server.url("/gone")
+    with tempfile.TemporaryDirectory() as tmpdir:
+      cache = RecordCache(tmpdir)
+      cache.store(make_record("1", [ok, gone]))
+      cache.store(make_record("2", [self.server.url("/moved"), ok]))
+      checker = LinkChecker(workers=4, rate_per_host=20)
+
+      report = check_cache_links(cache, checker, now=1000)
+      self.assertEqual((report["links"], report["checked"], report["cached"]), (3, 3, 0))
+      self.assertEqual(report["broken"], [{"url": gone, "status": 404, "error": None,
+                                           "records": [{"record_id": "1", "field": "metadata.related_identifiers"}]}])
+
+      requests = len(self.server.requests)
+      report = check_cache_links(cache, checker, ttl=3600)
+      self.assertEqual((report["checked"], report["cached"], len(report["broken"])), (1, 2, 1))
+      self.assertEqual(self.server.requests[requests:], [("HEAD", "/gone"), ("GET", "/gone")])
+
+      report = check_cache_links(cache, checker, ttl=3600, now=time.time() + 7200)
+      self.assertEqual(report["checked"], 3)
@@ -0,0 +1,73 @@
+import json
+import logging
+import logging.handlers
+import os
+import tempfile
+import unittest
+
+from utils.logging_utils import ProgressLog, setup_logging, stop_logging
+
+
+class TestLoggingUtils(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.root = logging.getLogger()
+    self.saved = (list(self.root.handlers), self.root.level)
+    self.config_path = os.path.join(self.tmpdir.name, "logging_config.json")
+    with open(self.config_path, "w") as f:
+      json.dump({
+        "version": 1,
+        "disable_existing_loggers": False,
+        "formatters": {"plain": {"format": "%(name)s %(message)s"}},
+        "handlers": {"file": {"class": "logging.FileHandler", "formatter": "plain", "filename": "unused.log"}},
+        "root": {"handlers": ["file"], "level": "INFO"},
+      }, f)
+    self.log_file = os.path.join(self.tmpdir.name, "logs", "test.log")
+
+  def tearDown(self):
+    stop_logging()
+    for handler in list(self.root.handlers):
+      self.root.removeHandler(handler)
+      handler.close()
+    handlers, level = self.saved
+    for handler in handlers:
+      self.root.addHandler(handler)
+    self.root.setLevel(level)
+    self.tmpdir.cleanup()
+
+  def read_log(self):
+    with open(self.log_file) as f:
+      return f.read().splitlines()
+
+  def test_records_are_queued_to_the_configured_handlers(self):
+    listener = setup_logging(self.log_file, self.config_path)
+    self.assertEqual([type(handler) for handler in self.root.handlers], [logging.handlers.QueueHandler])
+    self.assertEqual([type(handler) for handler in listener.handlers], [logging.FileHandler])
+
+    logging.getLogger("harvest").info("queued %s", "message")
+    logging.getLogger("harvest").debug("below the root level")
+    stop_logging()
+    self.assertEqual(self.read_log(), ["harvest queued message"])
+
+  def test_forked_process_logs_to_the_handlers(self):
+    setup_logging(self.log_file, self.config_path)
+    pid = os.fork()
+    if pid == 0:
+      logging.getLogger("worker").info("from the child")
+      os._exit(0)
+    os.waitpid(pid, 0)
+    stop_logging()
+    self.assertEqual(self.read_log(), ["worker from the child"])
+
+  def test_progress_log_aggregates_counts(self):
+    logger = logging.getLogger("progress")
+    progress = ProgressLog(logger, "Harvest progress", rate="stored", interval=3600)
+    with self.assertNoLogs(logger):
+      for _ in range(3):
+        progress.add(stored=1, bytes=2_000_000)
+    self.assertRegex(progress.line(), r"^Harvest progress: 3 stored, 6\.0 MB in \d+ s \(\d+\.\d stored/s\)$")
+
+    with self.assertLogs(logger) as logs:
+      ProgressLog(logger, "Harvest progress", interval=0).add(unchanged=1)
+    self.assertIn("Harvest progress: 1 unchanged", logs.output[0])
@@ -0,0 +1,94 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import timedelta
+
+import requests
+
+from utils.metrics import (
+  RequestMetrics,
+  PrometheusExporter,
+  JSONLinesExporter,
+  build_exporters,
+  endpoint_name,
+  format_summary
+)
+
+class TestMetrics(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.metrics = RequestMetrics(base_url="https://zenodo.org/api")
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def make_response(self, method, url, status=200, body=b"{}", elapsed=0.2):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.elapsed = timedelta(seconds=elapsed)
+    response.request = requests.Request(method, url).prepare()
+    return response
+
+  def test_endpoint_name(self):
+    self.assertEqual(endpoint_name("get", "https://zenodo.org/api/records?communities=cf&page=1", "https://zenodo.org/api"), "GET records")
+    self.assertEqual(endpoint_name("GET", "https://zenodo.org/api/records/14270689", "https://zenodo.org/api"), "GET records/{id}")
+    self.assertEqual(
+      endpoint_name("GET", "https://zenodo.org/api/records/14270689/files/IPCC_Atlas.pdf/content", "https://zenodo.org/api"),
+      "GET records/{id}/files/{key}/content"
+    )
+
+  def test_response_hook(self):
+    self.metrics.response_hook(self.make_response("GET", "https://zenodo.org/api/records/1", body=b"x" * 100))
+    self.metrics.response_hook(self.make_response("GET", "https://zenodo.org/api/records/2", status=404, elapsed=3.0))
+    stats = self.metrics.snapshot()["endpoints"]["GET records/{id}"]
+    self.assertEqual(stats["count"], 2)
+    self.assertEqual(stats["bytes_in"], 102)
+    self.assertEqual(stats["status_codes"], {"200": 1, "404": 1})
+    self.assertEqual(stats["buckets"]["0.25"], 1)
+    self.assertEqual(stats["buckets"]["5.0"], 1)
+    self.assertEqual(stats["latency_max"], 3.0)
+
+  def test_cache_hit_rate(self):
+    self.metrics.record_cache_lookup(True)
+    self.metrics.record_cache_lookup(True)
+    self.metrics.record_cache_lookup(False)
+    caches = self.metrics.snapshot()["caches"]
+    self.assertEqual(caches["records"]["hit"], 2)
+    self.assertAlmostEqual(caches["records"]["hit_rate"], 2 / 3)
+
+  def test_prometheus_exporter(self):
+    self.metrics.observe("GET records", 0.3, 200, bytes_in=10, retries=1)
+    path = os.path.join(self.tmpdir.name, "metrics.prom")
+    PrometheusExporter(path).export(self.metrics.snapshot())
+    with open(path) as f:
+      text = f.read()
+    self.assertIn('cf_zenodo_request_duration_seconds_bucket{endpoint="GET records",le="0.5"} 1', text)
+    self.assertIn('cf_zenodo_request_duration_seconds_bucket{endpoint="GET records",le="+Inf"} 1', text)
+    self.assertIn('cf_zenodo_request_retries_total{endpoint="GET records"} 1', text)
+    self.assertIn('cf_zenodo_responses_total{endpoint="GET records",status="200"} 1', text)
+
+  def test_jsonl_exporter(self):
+    path = os.path.join(self.tmpdir.name, "metrics.jsonl")
+    exporter = JSONLinesExporter(path)
+    self.metrics.observe("GET records", 0.3, 200)
+    exporter.export(self.metrics.snapshot())
+    exporter.export(self.metrics.snapshot())
+    with open(path) as f:
+      lines = [json.loads(line) for line in f]
+    self.assertEqual(len(lines), 2)
+    self.assertEqual(lines[0]["endpoints"]["GET records"]["count"], 1)
+
+  def test_build_exporters_skips_unknown(self):
+    exporters = build_exporters({"jsonl": os.path.join(self.tmpdir.name, "m.jsonl"), "statsd": "localhost"})
+    self.assertEqual(len(exporters), 1)
+    self.assertIsInstance(exporters[0], JSONLinesExporter)
+
+  def test_format_summary(self):
+    self.metrics.observe("GET records", 0.3, 200, bytes_in=2048)
+    summary = format_summary(self.metrics.snapshot())
+    self.assertIn("GET records", summary)
+    self.assertIn("2.0 KB", summary)
+    self.assertIn("200:1", summary)
@@ -0,0 +1,52 @@
+import threading
+import time
+import unittest
+
+from utils.metrics import RequestMetrics, format_summary
+from utils.pipeline import Pipeline, Stage
+
+class TestPipeline(unittest.TestCase):
+
+  def test_items_flow_through_stages(self):
+    results = []
+    lock = threading.Lock()
+
+    def collect(item):
+      with lock:
+        results.append(item)
+
+    pipeline = Pipeline([
+      Stage("split", lambda n: range(n), workers=2),
+      Stage("square", lambda n: [n * n], workers=3, queue_size=4),
+      Stage("collect", collect),
+    ])
+    pipeline.run([3, 4, 5])
+    self.assertEqual(sorted(results), sorted(n * n for m in (3, 4, 5) for n in range(m)))
+    stats = pipeline.stats()
+    self.assertEqual(stats["split"]["items_out"], 12)
+    self.assertEqual(stats["square"]["items_in"], 12)
+    self.assertLessEqual(stats["square"]["max_queue"], 4)
+
+  def test_slow_stage_is_the_bottleneck(self):
+    metrics = RequestMetrics()
+    pipeline = Pipeline([
+      Stage("fast", lambda n: [n], workers=2),
+      Stage("slow", lambda n: time.sleep(0.01), queue_size=2),
+    ], metrics=metrics)
+    pipeline.run(range(20))
+    self.assertEqual(pipeline.bottleneck(), "slow")
+    self.assertGreater(pipeline.stats()["fast"]["blocked_seconds"], 0)
+    self.assertIn("slow *", format_summary(metrics.snapshot()))
+
+  def test_failure_stops_upstream_and_drains_downstream(self):
+    stored = []
+
+    def produce(n):
+      if n == 3:
+        raise IOError("connection lost")
+      yield n
+
+    pipeline = Pipeline([Stage("produce", produce), Stage("store", lambda n: stored.append(n))])
+    with self.assertRaises(IOError):
+      pipeline.run(range(10))
+    self.assertEqual(stored, [0, 1, 2])
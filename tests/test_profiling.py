@@ -0,0 +1,86 @@
+import cProfile
+import glob
+import json
+import os
+import pstats
+import tempfile
+import threading
+import unittest
+
+from utils import json_stream, record_cache, rules
+from utils.profiling import classify, phase_breakdown, profile_command
+from utils.record_cache import RecordCache, project_metadata
+
+class TestProfiling(unittest.TestCase):
+
+  def setUp(self):
+    with open("tests/records/14270689.json") as f:
+      self.record = json.load(f)
+    self.template = {"metadata": {"title": True, "creators": [{"person_or_org": True}], "subjects": [{"subject": True}]}}
+
+  def test_classify_matches_whole_names(self):
+    json_dir = os.path.dirname(json.__file__)
+    self.assertEqual(classify(json_stream.__file__, "iter_hits"), "decode")
+    self.assertEqual(classify(os.path.join(json_dir, "decoder.py"), "raw_decode"), "decode")
+    self.assertEqual(classify(os.path.join(json_dir, "encoder.py"), "iterencode"), "write")
+    self.assertEqual(classify(record_cache.__file__, "project"), "projection")
+    self.assertEqual(classify(record_cache.__file__, "project_metadata"), "processing")
+    # `_select` is not the `select` module
+    self.assertEqual(classify(rules.__file__, "_select"), "processing")
+    self.assertEqual(classify("~", "<method 'poll' of 'select.poll' objects>"), "network")
+    self.assertEqual(classify("~", "<method 'recv_into' of '_socket.socket' objects>"), "network")
+    self.assertEqual(classify("~", "<built-in method time.sleep>"), "network")
+    self.assertEqual(classify("~", "<method 'acquire' of '_thread.lock' objects>"), "wait")
+    self.assertEqual(classify("~", "<built-in method posix.fsync>"), "write")
+    self.assertEqual(classify("~", "<method 'join' of 'str' objects>"), "other")
+
+  def test_phase_breakdown_counts_projection_callees(self):
+    tmpdir = tempfile.TemporaryDirectory()
+    self.addCleanup(tmpdir.cleanup)
+    cache = RecordCache(tmpdir.name, template=self.template)
+    body = json.dumps(self.record).encode()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    for _ in range(300):
+      cache.project(json_stream.loads(body))
+      project_metadata(self.record, self.template)
+    profiler.disable()
+    stats = pstats.Stats(profiler)
+
+    phases = phase_breakdown(stats)
+    projection_functions = sum(
+      tottime for (filename, _, func), (_, _, tottime, _, _) in stats.stats.items()
+      if filename == record_cache.__file__ and func in ("project", "project_metadata", "<listcomp>")
+    )
+    # Only the calls of `project_metadata` made by `RecordCache.project` count as projection
+    self.assertGreater(phases["projection"], 0.25 * projection_functions)
+    self.assertLess(phases["projection"], 0.75 * projection_functions)
+    self.assertGreater(phases["decode"], 0)
+    self.assertAlmostEqual(sum(phases.values()), sum(row[2] for row in stats.stats.values()), places=6)
+
+  def test_profile_command_writes_reports_with_threads(self):
+    body = json.dumps({"hits": {"hits": [self.record] * 50, "total": 50}}).encode()
+
+    def decode_in_thread():
+      for _ in range(20):
+        json_stream.loads(body)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      with profile_command("test", os.path.join(tmpdir, "cf_zenodo.log")):
+        thread = threading.Thread(target=decode_in_thread)
+        thread.start()
+        thread.join()
+
+      pstats_path, = glob.glob(os.path.join(tmpdir, "profile-test-*.pstats"))
+      report_path, = glob.glob(os.path.join(tmpdir, "profile-test-*.txt"))
+      functions = {func for _, _, func in pstats.Stats(pstats_path).stats}
+      with open(report_path) as f:
+        report = f.read()
+
+    self.assertIn("decode_in_thread", functions)
+    self.assertIn("Time by phase", report)
+    self.assertIn("decode", report)
+    self.assertIn("Peak traced memory", report)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,103 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from benchmarks.mock_server import MockInvenioServer
+from utils.publish import draft_dependencies, publish_drafts, publish_order
+from utils.uploads import upload_batch
+from utils.zenodo_api import ZenodoAPI
+
+
+class TestPublish(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.server = MockInvenioServer(num_records=1)
+    self.server.start()
+    self.api = ZenodoAPI(base_url=self.server.base_url, access_token="test_token", retry_attempts=0)
+
+    # The conventions (v1 and v2 of one concept), and two documents citing v2
+    for name in ("conventions-1", "conventions-2", "conformance", "examples"):
+      folder = os.path.join(self.tmpdir.name, name)
+      os.makedirs(os.path.join(folder, "files"))
+      with open(os.path.join(folder, "metadata.json"), "w") as f:
+        json.dump({"metadata": {"title": name}}, f)
+      with open(os.path.join(folder, "files", f"{name}.pdf"), "wb") as f:
+        f.write(name.encode())
+    self.drafts = upload_batch(self.api, self.tmpdir.name)["drafts"]
+    conventions = [self.server.drafts[self.drafts[f"conventions-{n}"]] for n in (1, 2)]
+    for index, draft in enumerate(conventions, 1):
+      draft.update(parent={"id": "concept"}, versions={"index": index})
+    for name in ("conformance", "examples"):
+      self.server.drafts[self.drafts[name]]["metadata"]["related_identifiers"] = [
+        {"identifier": f"10.5281/zenodo.{conventions[1]['id']}", "relation_type": {"id": "issupplementto"}}
+      ]
+
+  def tearDown(self):
+    self.server.stop()
+    self.tmpdir.cleanup()
+
+  def test_publish_order_follows_lineage_and_references(self):
+    drafts = {
+      "1": {"parent": {"id": "c"}, "versions": {"index": 2}},
+      "2": {"parent": {"id": "c"}, "versions": {"index": 1}},
+      "3": {"metadata": {"related_identifiers": [{"identifier": "https://zenodo.org/records/1"}]}},
+      "4": {"metadata": {"related_identifiers": [{"identifier": "10.5281/zenodo.11"}]}},
+    }
+    dependencies = draft_dependencies(drafts)
+    self.assertEqual(dependencies, {"1": {"2"}, "2": set(), "3": {"1"}, "4": set()})
+    self.assertEqual(publish_order(dependencies), (["2", "4", "1", "3"], []))
+    self.assertEqual(publish_order({"1": {"2"}, "2": {"1"}, "3": set()}), (["3"], ["1", "2"]))
+
+  def test_only_zenodo_identifiers_are_dependencies(self):
+    unrelated = [
+      "https://github.com/cf-convention/cf-conventions/issues/2",
+      "https://example.org/records/2",
+      "10.1000/journal.2",
+      "arXiv:1234.2",
+    ]
+    related = ["https://doi.org/10.5281/zenodo.2", "https://sandbox.zenodo.org/api/records/3/", "https://zenodo.org/uploads/4"]
+    drafts = {
+      "1": {"metadata": {"related_identifiers": [{"identifier": identifier} for identifier in unrelated]}},
+      "2": {}, "3": {}, "4": {},
+      "5": {"metadata": {"related_identifiers": [{"identifier": identifier} for identifier in related]}},
+    }
+    dependencies = draft_dependencies(drafts, hosts=("zenodo.org", "sandbox.zenodo.org"))
+    self.assertEqual(dependencies["1"], set())
+    self.assertEqual(dependencies["5"], {"2", "3", "4"})
+    self.assertEqual(draft_dependencies(drafts)["5"], {"2", "4"})
+
+  def test_publish_drafts_in_dependency_order(self):
+    publish = self.api.publish_draft
+    published = []
+
+    def recording_publish(draft_id):
+      result = publish(draft_id)
+      published.append(draft_id)
+      return result
+
+    with patch.object(self.api, "publish_draft", side_effect=recording_publish):
+      report = publish_drafts(self.api, list(self.drafts.values()), workers=4)
+
+    self.assertEqual((report["invalid"], report["failed"], report["unpublished"]), ({}, {}, []))
+    self.assertEqual(sorted(report["published"]), sorted(self.drafts.values()))
+    self.assertEqual(published[:2], [self.drafts["conventions-1"], self.drafts["conventions-2"]])
+    self.assertTrue(all(self.server.records[draft_id]["is_published"] for draft_id in self.drafts.values()))
+
+  def test_validation_failure_publishes_nothing(self):
+    self.server.draft_files[(self.drafts["examples"], "examples.pdf")]["status"] = "pending"
+    report = publish_drafts(self.api, list(self.drafts.values()), validator=lambda metadata: [])
+    self.assertEqual(report["invalid"], {self.drafts["examples"]: ["file examples.pdf is not committed"]})
+    self.assertEqual((report["published"], len(report["unpublished"])), ([], 4))
+    self.assertFalse(any(draft_id in self.server.records for draft_id in self.drafts.values()))
+
+  def test_publish_stops_at_first_failure(self):
+    publish = self.api.publish_draft
+    failing = self.drafts["conventions-2"]
+    with patch.object(self.api, "publish_draft", side_effect=lambda draft_id: None if draft_id == failing else publish(draft_id)):
+      report = publish_drafts(self.api, list(self.drafts.values()))
+    self.assertEqual(report["published"], [self.drafts["conventions-1"]])
+    self.assertEqual(list(report["failed"]), [failing])
+    self.assertEqual(sorted(report["unpublished"]), sorted([failing, self.drafts["conformance"], self.drafts["examples"]]))
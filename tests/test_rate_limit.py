@@ -0,0 +1,38 @@
+import threading
+import time
+import unittest
+
+from utils.rate_limit import RateLimiter
+
+class TestRateLimiter(unittest.TestCase):
+
+  def test_disabled_without_budget(self):
+    self.assertIsNone(RateLimiter.per_minute(None))
+    self.assertIsNone(RateLimiter.per_minute(0))
+
+  def test_burst_then_refill(self):
+    limiter = RateLimiter(rate=50, burst=5)
+    start = time.monotonic()
+    for _ in range(5):
+      self.assertEqual(limiter.acquire(), 0.0)
+    limiter.acquire()
+    self.assertGreaterEqual(time.monotonic() - start, 0.015)
+
+  def test_budget_shared_by_threads(self):
+    limiter = RateLimiter(rate=100, burst=1)
+    start = time.monotonic()
+    threads = [threading.Thread(target=lambda: [limiter.acquire() for _ in range(5)]) for _ in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    # 20 requests at 100/s with a single token of burst take at least 190 ms
+    self.assertGreaterEqual(time.monotonic() - start, 0.18)
+
+  def test_reserve_returns_delays_without_waiting(self):
+    limiter = RateLimiter(rate=10, burst=2)
+    delays = [limiter.reserve() for _ in range(4)]
+    self.assertEqual(delays[:2], [0.0, 0.0])
+    # Reservations queue up: the 3rd and 4th tokens are refilled 0.1 s apart
+    self.assertAlmostEqual(delays[2], 0.1, delta=0.01)
+    self.assertAlmostEqual(delays[3], 0.2, delta=0.01)
@@ -0,0 +1,210 @@
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock, patch
+
+from benchmarks.mock_server import MockInvenioServer
+from utils.compression import CODECS, MIN_DICT_SAMPLES, load_codec, zstandard
+from utils.downloads import pending_files
+from utils.harvest import harvest_community, harvest_sources
+from utils.record_cache import RecordCache, atomic_write, project_metadata
+from utils.zenodo_api import ZenodoAPI
+
+class TestRecordCache(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    with open("config/metadata_template.json") as f:
+      self.template = json.load(f)
+    with open("tests/records/14270689.json") as f:
+      self.record = json.load(f)
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def test_project_metadata(self):
+    metadata = project_metadata(self.record, self.template)
+    self.assertEqual(set(metadata), {"access", "files", "metadata", "custom_fields"})
+    self.assertEqual(metadata["files"], {"enabled": True})
+    self.assertEqual(metadata["metadata"]["resource_type"], {"id": self.record["metadata"]["resource_type"]["id"]})
+    creator = metadata["metadata"]["creators"][0]
+    self.assertEqual(set(creator["person_or_org"]) - {"family_name", "given_name", "type", "identifiers"}, set())
+    self.assertNotIn("links", metadata)
+
+  def test_atomic_write_keeps_previous_file_on_error(self):
+    path = os.path.join(self.tmpdir.name, "metadata.json")
+    atomic_write(path, "original")
+    with patch("utils.record_cache.os.replace", side_effect=OSError("disk full")):
+      with self.assertRaises(OSError):
+        atomic_write(path, "partial")
+    with open(path) as f:
+      self.assertEqual(f.read(), "original")
+    self.assertEqual(os.listdir(self.tmpdir.name), ["metadata.json"])
+
+  def test_store_and_is_current(self):
+    cache = RecordCache(self.tmpdir.name, self.template)
+    self.assertFalse(cache.is_current(self.record))
+    cache.store(self.record)
+    self.assertTrue(cache.is_current(self.record))
+    self.assertEqual(cache.load_record(self.record["id"])["id"], self.record["id"])
+    self.assertEqual(cache.load_metadata(self.record["id"]), project_metadata(self.record, self.template))
+
+    changed = dict(self.record, revision_id=self.record["revision_id"] + 1)
+    self.assertFalse(cache.is_current(changed))
+
+  def test_compressed_records_are_transparent(self):
+    for compression in ("gzip", "deflate", "zstd"):
+      with self.subTest(compression=compression):
+        if compression == "zstd" and zstandard is None:
+          self.skipTest("zstandard is not installed")
+        cache = RecordCache(os.path.join(self.tmpdir.name, compression), self.template, compression=compression)
+        cache.prepare_codec([self.record])
+        cache.store(self.record)
+        cache.save_index()
+        path, codec = cache.find_record_file(self.record["id"])
+        self.assertEqual(codec, compression)
+        self.assertTrue(path.endswith(CODECS[compression].suffix))
+        self.assertLess(os.path.getsize(path), len(json.dumps(self.record)))
+
+        # Readers do not need to know the codec the record was stored with
+        reader = RecordCache(cache.output_dir)
+        self.assertEqual(reader.load_record(self.record["id"]), self.record)
+        self.assertTrue(reader.is_current(self.record))
+
+  def test_dictionary_is_trained_from_a_batch_only(self):
+    for compression in ("deflate", "zstd"):
+      with self.subTest(compression=compression):
+        if compression == "zstd" and zstandard is None:
+          self.skipTest("zstandard is not installed")
+        cache = RecordCache(os.path.join(self.tmpdir.name, compression), self.template, compression=compression)
+        dictionary_path = os.path.join(cache.output_dir, CODECS[compression].dictionary_file)
+        # A record stored outside a harvest (e.g. by `show`) does not train the shared dictionary
+        cache.store(self.record)
+        cache.prepare_codec([self.record] * (MIN_DICT_SAMPLES - 1))
+        self.assertFalse(os.path.exists(dictionary_path))
+
+        batch = [dict(self.record, id=str(i)) for i in range(MIN_DICT_SAMPLES)]
+        cache.prepare_codec(batch)
+        self.assertTrue(os.path.exists(dictionary_path))
+        cache.store(batch[0])
+
+        reader = RecordCache(cache.output_dir)
+        self.assertEqual(reader.load_record(self.record["id"]), self.record)
+        self.assertEqual(reader.load_record("0"), batch[0])
+
+  @unittest.skipIf(zstandard is None, "zstandard is not installed")
+  def test_zstd_codec_is_shared_by_threads(self):
+    data = [json.dumps(dict(self.record, id=str(i))).encode() for i in range(MIN_DICT_SAMPLES)]
+    codec = load_codec("zstd", self.tmpdir.name, data)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+      roundtrips = list(executor.map(lambda item: codec.decompress(codec.compress(item)), data * 4))
+    self.assertEqual(roundtrips, data * 4)
+
+  def test_changing_compression_replaces_stored_copy(self):
+    RecordCache(self.tmpdir.name).store(self.record)
+    cache = RecordCache(self.tmpdir.name, compression="gzip")
+    cache.store(self.record)
+    self.assertEqual(sorted(os.listdir(cache.record_dir(self.record["id"]))), ["metadata.json", "record.json.gz"])
+
+  def test_unsafe_file_keys_are_skipped(self):
+    cache = RecordCache(self.tmpdir.name)
+    unsafe = ["..", ".", "", "/etc/passwd", "../index.json", "a/../../b"]
+    files = {key: {"checksum": "md5:0", "size": 4} for key in unsafe + ["data.nc"]}
+    for key in unsafe:
+      with self.assertRaises(ValueError):
+        cache.file_path("1", key)
+
+    def download_file(record_id, key, path):
+      with open(path, "wb") as f:
+        f.write(b"data")
+      return 4
+    api = Mock(download_file=Mock(side_effect=download_file))
+    with self.assertLogs("record_cache", "WARNING") as logs:
+      cache.download_files(api, "1", files)
+    self.assertEqual([call.args[1] for call in api.download_file.call_args_list], ["data.nc"])
+    self.assertEqual(len(logs.output), len(unsafe))
+    self.assertEqual(os.listdir(os.path.join(cache.record_dir("1"), "files")), ["data.nc"])
+
+    cache.index["2"] = {"files": files}
+    with self.assertLogs("downloads", "WARNING"):
+      self.assertEqual([file["key"] for file in pending_files(cache, ["2"])], ["data.nc"])
+
+
+class TestHarvest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.server = MockInvenioServer(num_records=30, file_size=1024)
+    cls.server.start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.stop()
+
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.api = ZenodoAPI(base_url=self.server.base_url, access_token="test_token", retry_attempts=0)
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def test_harvest_resumes_after_interruption(self):
+    search = self.api.open_search_records
+    calls = []
+
+    def failing_search(community_id, page=1, size=1000, sort=None, query=None):
+      calls.append(page)
+      if page == 2 and calls.count(2) == 1:
+        raise IOError("connection lost")
+      return search(community_id, page=page, size=size, sort=sort, query=query)
+
+    cache = RecordCache(self.tmpdir.name)
+    with patch.object(self.api, "open_search_records", side_effect=failing_search):
+      with self.assertRaises(IOError):
+        harvest_community(self.api, cache, "cfconventions", size=10)
+      self.assertTrue(cache.journal.exists())
+      self.assertFalse(os.path.exists(cache.index_path))
+
+      cache = RecordCache(self.tmpdir.name)
+      counts = harvest_community(self.api, cache, "cfconventions", size=10)
+
+    self.assertEqual(calls, [1, 2, 2, 3])
+    self.assertEqual(counts, {"stored": 20, "unchanged": 0, "duplicates": 0, "invalid": 0, "resumed": 10})
+    self.assertEqual(len(cache.index), 30)
+    self.assertFalse(cache.journal.exists())
+    for record_id in cache.index:
+      self.assertTrue(os.path.exists(cache.metadata_path(record_id)))
+
+    counts = harvest_community(self.api, RecordCache(self.tmpdir.name), "cfconventions", size=10)
+    self.assertEqual(counts, {"stored": 0, "unchanged": 30, "duplicates": 0, "invalid": 0, "resumed": 0})
+
+  def test_harvest_sources_stores_shared_records_once(self):
+    server = MockInvenioServer(num_records=40, file_size=512, communities=("a", "b"))
+    with server:
+      api = ZenodoAPI(base_url=server.base_url, access_token="test_token", retry_attempts=0)
+      cache = RecordCache(self.tmpdir.name)
+      sources = [{"community": "a"}, {"community": "b"}, {"name": "cf", "query": "conventions (1"}]
+      counts = harvest_sources(api, cache, sources, size=7, workers=3)
+
+    listed = sum(len(server.community_records(c)) for c in ("a", "b")) + len(server.community_records(None, "conventions (1"))
+    self.assertEqual(len(cache.index), 40)
+    self.assertEqual(counts["stored"], 40)
+    self.assertEqual(counts["duplicates"], listed - 40)
+    self.assertFalse(cache.journal.exists())
+
+  def test_harvest_pipeline_validates_and_records_stages(self):
+    with open("config/metadata_template.json") as f:
+      template = json.load(f)
+    validator = lambda metadata: ["metadata/title: rejected"] if metadata["metadata"]["title"].endswith("(3)") else []
+    cache = RecordCache(self.tmpdir.name, template)
+    counts = harvest_sources(self.api, cache, [{"community": "cfconventions"}], size=7, validator=validator,
+                             stage_workers={"project": 2, "store": 3}, queue_size=4)
+    self.assertEqual(counts["stored"], 30)
+    self.assertEqual(counts["invalid"], 1)
+    stages = self.api.metrics.snapshot()["stages"]
+    self.assertEqual(list(stages), ["fetch", "decode", "project", "validate", "store", "download"])
+    self.assertEqual(stages["fetch"]["items_out"], 5)
+    self.assertEqual(stages["download"]["items_in"], 30)
+    self.assertEqual(stages["store"]["workers"], 3)
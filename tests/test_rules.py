@@ -0,0 +1,72 @@
+import json
+import tempfile
+import unittest
+
+from benchmarks.mock_server import MockInvenioServer
+from utils.harvest import harvest_sources
+from utils.record_cache import RecordCache
+from utils.rules import apply_rules, compile_rules, parse_path, transform_cache, update_records
+from utils.zenodo_api import ZenodoAPI
+
+with open("config/metadata_template.json", "r") as f:
+  TEMPLATE = json.load(f)
+
+RULES = {"rules": [
+  {"name": "publisher", "path": "$.metadata.publisher", "match": {"equals": "Zenodo"}, "set": "CF Conventions"},
+  {"name": "subject", "when": {"path": "$.metadata.title", "regex": r"\(1\)$"},
+   "path": "$.metadata.subjects", "append": {"subject": "Selected"}},
+  {"name": "orcid", "path": "$.metadata.creators[*].person_or_org.identifiers[*]",
+   "match": {"equals": {"identifier": "0000-0000-0000-0000", "scheme": "orcid"}}, "remove": True},
+]}
+
+
+class TestRules(unittest.TestCase):
+
+  def test_paths_and_actions(self):
+    self.assertEqual(parse_path("$.metadata['meeting:meeting'].creators[0].name")[1:], ("meeting:meeting", "creators", 0, "name"))
+    for invalid in ("metadata.title", "$", "$.metadata..title", "$[x]"):
+      with self.assertRaises(ValueError):
+        parse_path(invalid)
+    with self.assertRaises(ValueError):
+      compile_rules([{"path": "$.a", "set": 1, "remove": True}])
+    with self.assertRaises(ValueError):
+      compile_rules([{"path": "$.a", "match": {"like": "x"}, "set": 1}])
+
+    rules = compile_rules([
+      {"name": "missing", "path": "$.metadata.publisher", "match": {"exists": False}, "set": "CF"},
+      {"name": "names", "path": "$.metadata.creators[*].name", "match": {"regex": "^Univ"}, "set": "University"},
+      {"name": "drop", "path": "$.metadata.subjects[*]", "match": {"in": ["", "tbd"]}, "remove": True},
+      {"name": "new-list", "path": "$.metadata.keywords", "append": "cf"},
+    ])
+    document = {"metadata": {"creators": [{"name": "Univ."}, {"name": "Other"}], "subjects": ["", "a", "tbd", "b"]}}
+    self.assertEqual(apply_rules(document, rules), ["missing", "names", "drop", "new-list"])
+    self.assertEqual(document["metadata"], {
+      "creators": [{"name": "University"}, {"name": "Other"}], "subjects": ["a", "b"], "publisher": "CF", "keywords": ["cf"],
+    })
+    # Rules are idempotent
+    self.assertEqual(apply_rules(document, rules), [])
+
+  def test_transform_cache_updates_changed_records(self):
+    with tempfile.TemporaryDirectory() as tmpdir, MockInvenioServer(num_records=6, file_size=16) as server:
+      api = ZenodoAPI(base_url=server.base_url, access_token="test_token", retry_attempts=0)
+      # Only the records published by Zenodo need a new publisher
+      for index, record_id in enumerate(server.ordered_ids):
+        server.records[record_id]["metadata"]["publisher"] = "CF Conventions" if index == 0 else "Zenodo"
+      cache = RecordCache(tmpdir, TEMPLATE)
+      harvest_sources(api, cache, [{"community": "cfconventions"}], size=10, download_files=False)
+
+      report = transform_cache(cache, compile_rules(RULES))
+      self.assertEqual(report["records"], 6)
+      self.assertEqual(report["rules"], {"publisher": 5, "subject": 1, "orcid": 0})
+      self.assertEqual(sorted(report["changed"]), sorted(server.ordered_ids[1:]))
+
+      revision = server.records[server.ordered_ids[1]]["revision_id"]
+      result = update_records(api, report["changed"], workers=3)
+      self.assertEqual((sorted(result["updated"]), result["failed"]), (sorted(server.ordered_ids[1:]), []))
+      updated = server.records[server.ordered_ids[1]]
+      self.assertEqual((updated["metadata"]["publisher"], updated["revision_id"]), ("CF Conventions", revision + 1))
+      self.assertIn({"subject": "Selected"}, updated["metadata"]["subjects"])
+
+      # After a harvest of the updated records, nothing is left to change
+      harvest_sources(api, cache, [{"community": "cfconventions"}], size=10, download_files=False)
+      self.assertEqual(transform_cache(cache, compile_rules(RULES))["changed"], {})
@@ -0,0 +1,134 @@
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from benchmarks.mock_server import MockInvenioServer
+from utils.record_cache import RecordCache
+from utils.shards import ShardCoordinator, _file_lock, harvest_sharded, plan_partitions
+from utils.zenodo_api import ZenodoAPI
+
+class TestShards(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.server = MockInvenioServer(num_records=100, file_size=512)
+    cls.server.start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.stop()
+
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.api_settings = {"base_url": self.server.base_url, "access_token": "test_token", "retry_attempts": 0}
+    self.api = ZenodoAPI(**self.api_settings)
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def test_partitions_are_disjoint_and_complete(self):
+    partitions = plan_partitions(self.api, {"community": "cfconventions"}, partition_size=15)
+    self.assertGreaterEqual(len(partitions), 7)
+    listed = [record["id"] for partition in partitions
+              for record in self.server.community_records("cfconventions", partition["query"])]
+    self.assertEqual(sorted(listed), sorted(self.server.ordered_ids))
+    for partition in partitions:
+      self.assertLessEqual(partition["estimated"], 30)
+
+  def test_sharded_harvest_merges_into_one_cache(self):
+    cache = RecordCache(self.tmpdir.name)
+    counts = harvest_sharded(
+      self.api, cache, [{"community": "cfconventions"}], self.api_settings,
+      size=10, partition_size=25, processes=2
+    )
+    self.assertEqual(counts["stored"], 100)
+    self.assertEqual(sorted(cache.index), sorted(self.server.ordered_ids))
+    self.assertEqual(sorted(RecordCache(self.tmpdir.name).index), sorted(self.server.ordered_ids))
+    self.assertEqual(sorted(os.listdir(self.tmpdir.name)), ["index.json", "records", "stats.sqlite"])
+    # The shard workers snapshot the statistics of their partitions into the shared store
+    self.assertEqual(len(cache.stats.latest()["record_id"]), 100)
+
+  def test_abandoned_partition_is_reclaimed(self):
+    coordinator = ShardCoordinator(self.tmpdir.name)
+    partition = {"id": "p0000", "source": "cfconventions", "community": "cfconventions", "query": None,
+                 "estimated": 100, "status": "running", "worker": f"{socket.gethostname()}:999999999",
+                 "claimed": 0, "counts": None}
+    with open(coordinator.path, "w") as f:
+      json.dump({"params": {}, "partition_size": 100, "partitions": [partition]}, f)
+    coordinator.lease_seconds = 10 ** 12
+    claimed, _ = coordinator.claim()
+    self.assertEqual(claimed["worker"], f"{socket.gethostname()}:{os.getpid()}")
+    self.assertIsNone(coordinator.claim())
+
+  def test_lock_is_kept_while_held(self):
+    path = os.path.join(self.tmpdir.name, "shards.lock")
+    events = []
+
+    def contender():
+      with _file_lock(path, timeout=0.2):
+        events.append("contender")
+
+    with _file_lock(path, timeout=0.2):
+      thread = threading.Thread(target=contender)
+      thread.start()
+      # Longer than the timeout: the heartbeat keeps the lock from looking stale
+      time.sleep(0.6)
+      events.append("holder")
+    thread.join()
+    self.assertEqual(events, ["holder", "contender"])
+    self.assertFalse(os.path.exists(path))
+
+  def test_stale_lock_is_broken_and_foreign_lock_kept(self):
+    path = os.path.join(self.tmpdir.name, "shards.lock")
+    with open(path, "w") as f:
+      f.write("crashed-host:1:0\n")
+    os.utime(path, (time.time() - 120, time.time() - 120))
+    with _file_lock(path, timeout=60):
+      # The lock is taken over by another worker (e.g. after a long pause of this one)
+      with open(path, "w") as f:
+        f.write("other-host:2:0\n")
+    with open(path) as f:
+      self.assertEqual(f.read(), "other-host:2:0\n")
+
+  def test_live_partition_is_renewed_and_reclaimed_completion_ignored(self):
+    coordinator = ShardCoordinator(self.tmpdir.name, lease_seconds=1)
+    partition = {"id": "p0000", "source": "cfconventions", "community": "cfconventions", "query": None,
+                 "estimated": 100, "status": "pending", "worker": None, "claimed": None, "claim": None, "counts": None}
+    with open(coordinator.path, "w") as f:
+      json.dump({"params": {}, "partition_size": 100, "partitions": [partition]}, f)
+    claimed, _ = coordinator.claim()
+
+    # A live worker on this host keeps its partition, whatever the age of its lease
+    state = coordinator.load()
+    state["partitions"][0]["claimed"] = 0
+    coordinator._save(state)
+    self.assertIsNone(coordinator.claim())
+    self.assertTrue(coordinator.renew("p0000", claimed["claim"]))
+    self.assertGreater(coordinator.load()["partitions"][0]["claimed"], 0)
+
+    # Reclaimed by a worker on another host: the first worker can neither renew nor complete it
+    state = coordinator.load()
+    state["partitions"][0].update({"worker": "other-host:1", "claim": "other"})
+    coordinator._save(state)
+    self.assertFalse(coordinator.renew("p0000", claimed["claim"]))
+    self.assertFalse(coordinator.complete("p0000", claimed["claim"], {"stored": 1}))
+    self.assertEqual(coordinator.load()["partitions"][0]["status"], "running")
+    self.assertTrue(coordinator.exists())
+
+  def test_overlapping_sources_are_stored_once(self):
+    server = MockInvenioServer(num_records=40, file_size=512, communities=("a", "b"))
+    with server:
+      api_settings = dict(self.api_settings, base_url=server.base_url)
+      cache = RecordCache(self.tmpdir.name)
+      counts = harvest_sharded(
+        ZenodoAPI(**api_settings), cache, [{"community": "a"}, {"community": "b"}], api_settings,
+        size=10, partition_size=10, processes=2
+      )
+    listed = sum(len(server.community_records(community)) for community in ("a", "b"))
+    self.assertEqual(counts["stored"], 40)
+    self.assertEqual(counts["duplicates"], listed - 40)
+    self.assertEqual(len(cache.index), 40)
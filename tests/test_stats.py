@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from benchmarks.mock_server import MockInvenioServer
+from utils.harvest import harvest_sources
+from utils.record_cache import RecordCache
+from utils.stats import COLUMNS, StatsStore
+from utils.zenodo_api import ZenodoAPI
+
+
+def row(downloads, views=0):
+  return tuple(downloads if column.endswith("downloads") else views if column.endswith("views") else 0
+               for column in COLUMNS)
+
+
+class TestStats(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.store = StatsStore(os.path.join(self.tmpdir.name, "stats.sqlite"))
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def test_snapshots_deduplicate_and_answer_trends(self):
+    self.assertEqual(len(self.store.latest()["record_id"]), 0)
+    self.assertEqual(self.store.snapshot({"1": row(10), "2": row(5)}, time=100), {"written": 2, "unchanged": 0})
+    self.assertEqual(self.store.snapshot({"1": row(10), "2": row(8)}, time=200), {"written": 1, "unchanged": 1})
+    self.assertEqual(self.store.snapshot({"1": row(15), "2": row(8), "3": row(1)}, time=300), {"written": 2, "unchanged": 1})
+
+    history = self.store.history("2", columns=("downloads",))
+    self.assertEqual((list(history["time"]), list(history["downloads"])), ([100, 200], [5, 8]))
+
+    series = self.store.community_series("downloads")
+    self.assertEqual((list(series["time"]), list(series["downloads"])), ([100, 200, 300], [15, 18, 24]))
+
+    latest = self.store.latest(at=250, columns=("downloads",))
+    self.assertEqual((list(latest["record_id"]), list(latest["time"]), list(latest["downloads"])), ([1, 2], [100, 200], [10, 8]))
+
+    growth = self.store.growth("downloads", since=150)
+    self.assertEqual({name: list(column) for name, column in growth.items()},
+                     {"record_id": [1, 2, 3], "start": [10, 5, 0], "end": [15, 8, 1], "delta": [5, 3, 1]})
+    self.assertEqual(list(self.store.growth("downloads", since=150, until=250, limit=1)["record_id"]), [2])
+    with self.assertRaises(ValueError):
+      self.store.growth("downloads; DROP TABLE snapshots")
+
+  def test_non_numeric_record_ids_are_skipped(self):
+    with self.assertLogs("stats", "WARNING") as logs:
+      counts = self.store.snapshot({"1": row(10), "abcd-1234": row(5)}, time=100)
+    self.assertEqual(counts, {"written": 1, "unchanged": 0})
+    self.assertIn("abcd-1234", logs.output[0])
+    self.assertEqual(list(self.store.latest()["record_id"]), [1])
+    self.assertEqual(len(self.store.history("abcd-1234")["time"]), 0)
+
+  def test_harvest_snapshots_unchanged_records(self):
+    with MockInvenioServer(num_records=6, file_size=16) as server:
+      api = ZenodoAPI(base_url=server.base_url, access_token="test_token", retry_attempts=0)
+      harvest = lambda: harvest_sources(api, RecordCache(self.tmpdir.name), [{"community": "cfconventions"}],
+                                        size=10, download_files=False)
+      with patch("utils.stats._time.time", return_value=1000):
+        harvest()
+      # New downloads without a new revision: the record is unchanged but its statistics are not
+      record_id = server.ordered_ids[2]
+      server.records[record_id]["stats"]["this_version"]["downloads"] += 7
+      with patch("utils.stats._time.time", return_value=2000):
+        self.assertEqual(harvest()["unchanged"], 6)
+
+    store = RecordCache(self.tmpdir.name).stats
+    self.assertEqual(len(store.latest()["record_id"]), 6)
+    self.assertEqual(list(store.history(record_id)["time"]), [1000, 2000])
+    self.assertEqual(list(store.growth(since=1500)["delta"]), [7, 0, 0, 0, 0, 0])
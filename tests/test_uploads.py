@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from benchmarks.mock_server import MockInvenioServer
+from utils.uploads import JOURNAL_FILE, UploadJournal, upload_batch
+from utils.zenodo_api import ZenodoAPI
+
+
+class TestUploads(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.server = MockInvenioServer(num_records=1, throttle_every=7)
+    self.server.start()
+    self.api = ZenodoAPI(base_url=self.server.base_url, access_token="test_token", retry_attempts=3)
+    self.contents = {}
+    for i in range(4):
+      folder = os.path.join(self.tmpdir.name, f"talk-{i}")
+      os.makedirs(os.path.join(folder, "files"))
+      with open(os.path.join(folder, "metadata.json"), "w") as f:
+        json.dump({"metadata": {"title": f"Talk {i}"}, "custom_fields": {"meeting:meeting": {"acronym": "CF2024"}}}, f)
+      for key in ("slides.pdf", "abstract.txt"):
+        content = os.urandom(200 * 1024 if key == "slides.pdf" else 100) + f"{i}".encode()
+        with open(os.path.join(folder, "files", key), "wb") as f:
+          f.write(content)
+        self.contents[(f"talk-{i}", key)] = content
+
+  def tearDown(self):
+    self.server.stop()
+    self.tmpdir.cleanup()
+
+  def assert_uploaded(self, drafts):
+    for (folder, key), content in self.contents.items():
+      entry = self.server.draft_files[(drafts[folder], key)]
+      self.assertEqual((entry["status"], entry["content"]), ("completed", content))
+
+  def test_upload_batch_creates_drafts_and_streams_files(self):
+    report = upload_batch(self.api, self.tmpdir.name, workers=3)
+    self.assertEqual(report["failed"], [])
+    self.assertEqual((report["created"], report["uploaded"], report["skipped"]), (4, 8, 0))
+    self.assertEqual(report["bytes"], sum(len(content) for content in self.contents.values()))
+    self.assertEqual(self.server.drafts[report["drafts"]["talk-2"]]["metadata"]["title"], "Talk 2")
+    # Throttled uploads are retried with the whole file
+    self.assert_uploaded(report["drafts"])
+    upload = self.api.metrics.snapshot()["endpoints"]["PUT records/{id}/draft/files/{key}/content"]
+    self.assertGreaterEqual(upload["bytes_out"], report["bytes"])
+
+  def test_upload_batch_resumes_interrupted_upload(self):
+    upload = self.api.upload_file_content
+    calls = []
+
+    def failing_upload(record_id, key, path):
+      calls.append(key)
+      return None if len(calls) == 3 else upload(record_id, key, path)
+
+    with patch.object(self.api, "upload_file_content", side_effect=failing_upload):
+      report = upload_batch(self.api, self.tmpdir.name, workers=1, stage_workers={"draft": 1})
+    self.assertEqual(report["failed"], ["talk-1"])
+    self.assertEqual(report["uploaded"], 7)
+
+    # A file changed since it was committed is replaced
+    with open(os.path.join(self.tmpdir.name, "talk-0", "files", "abstract.txt"), "wb") as f:
+      f.write(b"revised abstract")
+    self.contents[("talk-0", "abstract.txt")] = b"revised abstract"
+
+    report = upload_batch(self.api, self.tmpdir.name, workers=2)
+    self.assertEqual(report["failed"], [])
+    self.assertEqual((report["created"], report["uploaded"], report["skipped"]), (0, 2, 6))
+    self.assertEqual(len(self.server.drafts), 4)
+    self.assert_uploaded(report["drafts"])
+    uploads = UploadJournal(os.path.join(self.tmpdir.name, JOURNAL_FILE)).replay()
+    self.assertEqual({folder: upload["draft_id"] for folder, upload in uploads.items()}, report["drafts"])
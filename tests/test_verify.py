@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+
+from benchmarks.mock_server import MockInvenioServer
+from utils.harvest import harvest_sources
+from utils.record_cache import RecordCache
+from utils.verify import hash_file, repair_cache, verify_cache
+from utils.zenodo_api import ZenodoAPI
+
+
+class TestVerify(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.server = MockInvenioServer(num_records=6, file_size=3000)
+    cls.server.start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.stop()
+
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.api = ZenodoAPI(base_url=self.server.base_url, access_token="test_token", retry_attempts=0)
+    with open("config/metadata_template.json") as f:
+      self.template = json.load(f)
+    harvest_sources(self.api, RecordCache(self.tmpdir.name, self.template), [{"community": "cfconventions"}], size=10)
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def test_hash_file(self):
+    path = os.path.join(self.tmpdir.name, "data.bin")
+    data = os.urandom(5000)
+    with open(path, "wb") as f:
+      f.write(data)
+    self.assertEqual(hash_file(path, "md5", read_size=1024), (hashlib.md5(data).hexdigest(), 5000))
+
+  def test_verify_and_repair_broken_records(self):
+    report = verify_cache(self.tmpdir.name, processes=2)
+    self.assertEqual(report["problems"], [])
+    self.assertEqual(report["records"], 6)
+    self.assertGreater(report["bytes"], 6 * 3000)
+
+    cache = RecordCache(self.tmpdir.name)
+    ids = sorted(cache.index)
+    truncated = cache.file_path(ids[0], next(iter(cache.index[ids[0]]["files"])))
+    with open(truncated, "r+b") as f:
+      f.truncate(100)
+    corrupted = cache.file_path(ids[1], next(iter(cache.index[ids[1]]["files"])))
+    with open(corrupted, "r+b") as f:
+      f.seek(-1, os.SEEK_END)
+      f.write(b"x")
+    os.remove(cache.metadata_path(ids[2]))
+    with open(cache.file_path(ids[3], ".data.nc.tmp"), "wb") as f:
+      f.write(b"partial")
+    os.makedirs(cache.record_dir("99999"))
+
+    report = verify_cache(self.tmpdir.name, processes=2)
+    found = sorted((p["record_id"], p["problem"]) for p in report["problems"])
+    self.assertEqual(found, sorted([
+      (ids[0], "size"), (ids[1], "checksum"), (ids[2], "metadata"), (ids[3], "extra_file"), ("99999", "orphan"),
+    ]))
+
+    requests = self.server.request_count
+    result = repair_cache(self.api, self.tmpdir.name, report["problems"], self.template)
+    self.assertEqual(sorted(result["repaired"]), sorted(ids[:4]))
+    self.assertEqual(result["removed"], ["99999"])
+    # Only the broken records and files are fetched again
+    self.assertEqual(self.server.request_count - requests, 3 + 1 + 2)
+    self.assertEqual(verify_cache(self.tmpdir.name, processes=2)["problems"], [])
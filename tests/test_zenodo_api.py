@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+from benchmarks.mock_server import MockInvenioServer
+from utils.zenodo_api import ZenodoAPI
+
+class TestZenodoAPI(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.server = MockInvenioServer(num_records=25, file_size=4096, throttle_every=4)
+    cls.server.start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.stop()
+
+  def setUp(self):
+    self.api = ZenodoAPI(base_url=self.server.base_url, access_token="test_token")
+
+  def test_fetch_records_pages(self):
+    first = self.api.fetch_records("cfconventions", page=1, size=10)
+    last = self.api.fetch_records("cfconventions", page=3, size=10)
+    self.assertEqual(len(first), 10)
+    self.assertEqual(len(last), 5)
+    self.assertEqual(first[0]["id"], "20000000")
+
+  def test_iter_search_records_streams_pages(self):
+    meta = {}
+    streamed = list(self.api.iter_search_records("cfconventions", page=2, size=10, meta=meta))
+    self.assertEqual(streamed, self.api.fetch_records("cfconventions", page=2, size=10))
+    self.assertEqual(meta["total"], 25)
+    self.assertIn("next", meta["links"])
+
+  def test_fetch_record_not_found(self):
+    self.assertIsNone(self.api.fetch_record("1"))
+
+  def test_download_file(self):
+    record = self.server.records["20000001"]
+    key = next(iter(record["files"]["entries"]))
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = os.path.join(tmpdir, key)
+      size = self.api.download_file("20000001", key, path)
+      self.assertEqual(size, 4096)
+      self.assertEqual(os.path.getsize(path), 4096)
+
+  def test_throttled_requests_are_retried(self):
+    for record_id in ("20000002", "20000003", "20000004", "20000005"):
+      self.assertIsNotNone(self.api.publish_record(record_id))
+    stats = self.api.metrics.snapshot()["endpoints"]["POST records/{id}/actions/publish"]
+    self.assertEqual(stats["count"], 4)
+    self.assertGreaterEqual(stats["retries"], 1)
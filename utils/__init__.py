@@ -3,9 +3,21 @@
 
 """
 Utilities for the cf-zenodo project.
+
+The library interface (`Client`, `Cache`, `Harvester`, see `utils.library`)
+is importable from the package; importing it has no side effects.
 """
 import logging
 
-# Initialize a default logger for the utilities
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
-logger = logging.getLogger("utils")
\ No newline at end of file
+# Logging is configured by the scripts (see `utils.logging_utils.setup_logging`), not on import
+logger = logging.getLogger("utils")
+
+__all__ = ["Cache", "Client", "Harvester"]
+
+
+def __getattr__(name):
+  # The library classes are imported on first use, so that `import utils` stays cheap
+  if name in __all__:
+    from utils import library
+    return getattr(library, name)
+  raise AttributeError(f"module 'utils' has no attribute {name!r}")
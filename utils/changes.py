@@ -0,0 +1,204 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Change feed of the record cache.
+
+During a harvest, every stored record is compared with its previous index
+entry (revision, metadata hash and file checksums, never the cached record
+itself) and the differences are appended to `changes.jsonl`:
+
+  new_record   A record of a concept (parent) not cached before
+  new_version  A new version of a cached concept
+  metadata     The projected metadata changed (metadata_sha256)
+  files        Files were added, removed or changed (checksums)
+  revision     A new revision without metadata or file changes
+
+The feed is append-only and in chronological order, so `read(since)` seeks
+to the first change after `since` without scanning the whole file.
+"""
+
+import json
+import os
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+
+CHANGE_TYPES = ("new_record", "new_version", "metadata", "files", "revision")
+
+_RELATIVE = re.compile(r"^(\d+)([mhdw])$")
+_UNITS = {"m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+
+
+def utc_now():
+  """Return the current UTC time as an ISO 8601 string (seconds precision)."""
+  return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def parse_since(value, now=None):
+  """
+  Parse a `--since` value: an ISO date or datetime (UTC if no offset), or a relative age (`30m`, `12h`, `7d`, `2w`).
+
+  Returns:
+    datetime: The timezone-aware lower bound.
+
+  Raises:
+    ValueError: If the value cannot be parsed.
+  """
+  match = _RELATIVE.match(value.strip())
+  if match:
+    now = now or datetime.now(timezone.utc)
+    return now - timedelta(**{_UNITS[match.group(2)]: int(match.group(1))})
+  since = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+  return since if since.tzinfo else since.replace(tzinfo=timezone.utc)
+
+
+def describe_change(record_id, previous, entry, known_parents):
+  """
+  Compare the new index entry of a record with the previous one.
+
+  Args:
+    record_id (str): The record ID.
+    previous (dict): The previous index entry (None if the record was not cached).
+    entry (dict): The new index entry.
+    known_parents (set): Parent (concept) IDs of the cached records.
+
+  Returns:
+    dict: The change (without timestamp), or None if the entry did not change.
+  """
+  change = {
+    "record_id": str(record_id),
+    "parent_id": entry.get("parent_id"),
+    "revision_id": entry.get("revision_id"),
+    "metadata_sha256": entry.get("metadata_sha256"),
+  }
+  if previous is None:
+    change["types"] = ["new_version" if entry.get("parent_id") in known_parents else "new_record"]
+    change["files"] = {"added": sorted(entry.get("files", {})), "removed": [], "changed": []}
+    return change
+
+  if previous.get("revision_id") == entry.get("revision_id") and previous.get("updated") == entry.get("updated"):
+    return None
+
+  types = []
+  if previous.get("metadata_sha256") != entry.get("metadata_sha256"):
+    types.append("metadata")
+  old_files, new_files = previous.get("files", {}), entry.get("files", {})
+  files = {
+    "added": sorted(set(new_files) - set(old_files)),
+    "removed": sorted(set(old_files) - set(new_files)),
+    "changed": sorted(key for key in set(old_files) & set(new_files)
+                      if old_files[key].get("checksum") != new_files[key].get("checksum")),
+  }
+  if any(files.values()):
+    types.append("files")
+  change.update({
+    "types": types or ["revision"],
+    "previous_revision_id": previous.get("revision_id"),
+    "previous_metadata_sha256": previous.get("metadata_sha256"),
+    "files": files,
+  })
+  return change
+
+
+def format_change(change):
+  """Return a one-line description of a change."""
+  line = f"{change['time']}  {change['record_id']:>10}  {','.join(change['types']):<16}"
+  if change.get("previous_revision_id") is not None:
+    line += f"  revision {change['previous_revision_id']} -> {change['revision_id']}"
+  else:
+    line += f"  revision {change['revision_id']} (parent {change.get('parent_id')})"
+  files = change.get("files") or {}
+  summary = ", ".join(f"{len(files[kind])} {kind}" for kind in ("added", "removed", "changed") if files.get(kind))
+  return f"{line}  files: {summary}" if summary else line
+
+
+class ChangeFeed:
+  """
+  Append-only JSON lines feed of record changes (`changes.jsonl` in the cache directory).
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._lock = threading.Lock()
+
+  def exists(self):
+    return os.path.exists(self.path)
+
+  def append(self, change, run=None):
+    """
+    Append a change, stamped with the current time and the harvest run.
+
+    Args:
+      change (dict): Output of `describe_change`.
+      run (str, optional): Identifier of the harvest run (its start time).
+    """
+    line = json.dumps(dict(change, time=utc_now(), run=run)) + "\n"
+    with self._lock:
+      os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+      # A single O_APPEND write keeps lines whole when several processes append (sharded harvests)
+      fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+      try:
+        os.write(fd, line.encode())
+        os.fsync(fd)
+      finally:
+        os.close(fd)
+
+  def read(self, since=None):
+    """
+    Iterate over the changes recorded at or after `since`.
+
+    A change appended twice (a record re-stored after a crash) is returned once.
+
+    Args:
+      since (datetime, optional): Lower bound (all changes if None).
+
+    Yields:
+      dict: The changes, oldest first.
+    """
+    if not self.exists():
+      return
+    seen = set()
+    with open(self.path, "rb") as f:
+      if since is not None:
+        f.seek(self._offset(f, since))
+      for line in f:
+        try:
+          change = json.loads(line)
+        except ValueError:
+          continue
+        if since is not None and _change_time(change) < since:
+          continue
+        key = (change["record_id"], change.get("revision_id"), tuple(change["types"]))
+        if key in seen:
+          continue
+        seen.add(key)
+        yield change
+
+  def _offset(self, f, since):
+    """Binary search the offset of a line starting at or before the first change after `since`."""
+    low, high = 0, os.fstat(f.fileno()).st_size
+    while high - low > 4096:
+      middle = (low + high) // 2
+      f.seek(middle)
+      f.readline()
+      line = f.readline()
+      try:
+        before = _change_time(json.loads(line)) < since
+      except ValueError:
+        before = False
+      if before:
+        low = middle
+      else:
+        high = middle
+    return low if low == 0 else _line_start(f, low)
+
+
+def _line_start(f, offset):
+  f.seek(offset)
+  f.readline()
+  return f.tell()
+
+
+def _change_time(change):
+  return datetime.fromisoformat(change["time"])
@@ -0,0 +1,379 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Rendering of cached records as citations: BibTeX, CSL-JSON, DataCite XML and CFF.
+
+Rendered citations are cached in the record cache:
+
+  citations/{format}/{record_id}.{ext}   Rendered citation of a record
+  citations/{format}/manifest.json       Revision each citation was rendered from
+
+A citation is rendered again only when the index entry of its record has
+another revision (or the renderer changed), so regenerating the
+bibliography of a whole community only reads and renders the changed records.
+"""
+
+import html
+import json
+import logging
+import os
+import re
+import unicodedata
+import xml.etree.ElementTree as ET
+
+from utils.record_cache import atomic_write, atomic_write_json
+
+logger = logging.getLogger("citations")
+
+# Bump when the output of a renderer changes, to invalidate the rendered citations
+RENDERER_VERSION = 1
+
+DATACITE_NAMESPACE = "http://datacite.org/schema/kernel-4"
+DATACITE_SCHEMA = "http://schema.datacite.org/meta/kernel-4.5/metadata.xsd"
+
+# InvenioRDM resource types (prefix match, most specific first) in each format
+BIBTEX_TYPES = {
+  "publication-article": "article", "publication-book": "book", "publication-section": "incollection",
+  "publication-conferencepaper": "inproceedings", "publication-report": "techreport",
+  "publication-thesis": "phdthesis", "publication-technicalnote": "techreport",
+}
+CSL_TYPES = {
+  "publication-article": "article-journal", "publication-book": "book", "publication-section": "chapter",
+  "publication-conferencepaper": "paper-conference", "publication-report": "report",
+  "publication-thesis": "thesis", "publication": "document", "presentation": "speech", "poster": "graphic",
+  "dataset": "dataset", "software": "software", "image": "graphic", "video": "motion_picture",
+}
+DATACITE_TYPES = {
+  "publication": "Text", "presentation": "Text", "poster": "Text", "lesson": "Text", "dataset": "Dataset",
+  "software": "Software", "image": "Image", "video": "Audiovisual", "event": "Event", "workflow": "Workflow",
+  "model": "Model", "physicalobject": "PhysicalObject",
+}
+
+# SPDX identifiers accepted by CFF, by lowercase InvenioRDM rights ID
+CFF_LICENSES = {spdx.lower(): spdx for spdx in (
+  "CC-BY-4.0", "CC-BY-SA-4.0", "CC-BY-NC-4.0", "CC-BY-ND-4.0", "CC0-1.0", "MIT", "Apache-2.0",
+  "BSD-2-Clause", "BSD-3-Clause", "GPL-3.0-only", "GPL-3.0-or-later", "LGPL-3.0-only", "MPL-2.0",
+)}
+
+
+def _lookup(types, resource_type, default):
+  for prefix in sorted(types, key=len, reverse=True):
+    if resource_type == prefix or resource_type.startswith(prefix + "-"):
+      return types[prefix]
+  return default
+
+
+def citation_fields(record):
+  """
+  Extract the fields used by the renderers from a record.
+
+  Returns:
+    dict: `id`, `title`, `creators` (with `family`, `given`, `name`, `orcid`, `affiliations`,
+      `personal`), `date` ([year, month, day] parts), `doi`, `concept_doi`, `publisher`,
+      `resource_type`, `version`, `keywords`, `license`, `description` and `url`.
+  """
+  metadata = record.get("metadata", {})
+  creators = []
+  for creator in metadata.get("creators", []):
+    person = creator.get("person_or_org", {})
+    orcid = next((i["identifier"] for i in person.get("identifiers", []) if i.get("scheme") == "orcid"), None)
+    creators.append({
+      "personal": person.get("type", "personal") == "personal",
+      "family": person.get("family_name"),
+      "given": person.get("given_name"),
+      "name": person.get("name") or ", ".join(filter(None, (person.get("family_name"), person.get("given_name")))),
+      "orcid": orcid,
+      "affiliations": [a.get("name") for a in creator.get("affiliations", []) if a.get("name")],
+    })
+  date = [int(part) for part in re.findall(r"\d+", (metadata.get("publication_date") or "").split("/")[0])[:3]]
+  doi = record.get("pids", {}).get("doi", {}).get("identifier")
+  rights = metadata.get("rights") or [{}]
+  description = metadata.get("description")
+  return {
+    "id": str(record.get("id")),
+    "title": metadata.get("title", ""),
+    "creators": creators,
+    "date": date,
+    "doi": doi,
+    "concept_doi": record.get("parent", {}).get("pids", {}).get("doi", {}).get("identifier"),
+    "publisher": metadata.get("publisher"),
+    "resource_type": metadata.get("resource_type", {}).get("id", ""),
+    "version": metadata.get("version"),
+    "keywords": [s["subject"] for s in metadata.get("subjects", []) if s.get("subject")],
+    "license": rights[0].get("id"),
+    "description": html.unescape(re.sub(r"<[^>]+>", "", description)).strip() if description else None,
+    "url": record.get("links", {}).get("self_html") or (f"https://doi.org/{doi}" if doi else None),
+  }
+
+
+# BibTeX
+
+_BIBTEX_ESCAPES = {"\\": r"\textbackslash{}", "&": r"\&", "%": r"\%", "$": r"\$", "#": r"\#", "_": r"\_",
+                   "{": r"\{", "}": r"\}", "~": r"\textasciitilde{}", "^": r"\textasciicircum{}"}
+
+
+def _bibtex_escape(text):
+  return "".join(_BIBTEX_ESCAPES.get(char, char) for char in str(text))
+
+
+def render_bibtex(record):
+  """Render a record as a BibTeX entry."""
+  fields = citation_fields(record)
+  first = fields["creators"][0] if fields["creators"] else {}
+  # ASCII citation key, e.g. gutierrezllorente2024_14270689
+  key_name = unicodedata.normalize("NFKD", first.get("family") or first.get("name") or "")
+  key_name = re.sub(r"[^A-Za-z]", "", key_name) or "zenodo"
+  year = fields["date"][0] if fields["date"] else ""
+  authors = " and ".join(
+    _bibtex_escape(f"{c['family']}, {c['given']}" if c["personal"] and c["family"] and c["given"] else c["name"])
+    if c["personal"] else "{" + _bibtex_escape(c["name"]) + "}"
+    for c in fields["creators"]
+  )
+  entry = [
+    ("author", authors),
+    ("title", "{" + _bibtex_escape(fields["title"]) + "}"),
+    ("year", year),
+    ("month", fields["date"][1] if len(fields["date"]) > 1 else None),
+    ("publisher", fields["publisher"] and _bibtex_escape(fields["publisher"])),
+    ("version", fields["version"] and _bibtex_escape(fields["version"])),
+    ("doi", fields["doi"]),
+    ("url", fields["url"]),
+    ("keywords", ", ".join(_bibtex_escape(k) for k in fields["keywords"]) or None),
+  ]
+  body = ",\n".join(f"  {name} = {{{value}}}" for name, value in entry if value not in (None, ""))
+  return f"@{_lookup(BIBTEX_TYPES, fields['resource_type'], 'misc')}{{{key_name.lower()}{year}_{fields['id']},\n{body}\n}}\n"
+
+
+# CSL-JSON
+
+def csl_item(record):
+  """Return a record as a CSL-JSON item (dict)."""
+  fields = citation_fields(record)
+  item = {
+    "id": fields["id"],
+    "type": _lookup(CSL_TYPES, fields["resource_type"], "document"),
+    "title": fields["title"],
+    "author": [
+      {"family": c["family"], "given": c["given"]} if c["personal"] and c["family"] else {"literal": c["name"]}
+      for c in fields["creators"]
+    ],
+  }
+  if fields["date"]:
+    item["issued"] = {"date-parts": [fields["date"]]}
+  for key, value in (("DOI", fields["doi"]), ("URL", fields["url"]), ("publisher", fields["publisher"]),
+                     ("version", fields["version"]), ("abstract", fields["description"])):
+    if value:
+      item[key] = value
+  if fields["keywords"]:
+    item["keyword"] = ", ".join(fields["keywords"])
+  return item
+
+
+def render_csl(record):
+  """Render a record as a CSL-JSON item."""
+  return json.dumps(csl_item(record), indent=2, ensure_ascii=False) + "\n"
+
+
+# DataCite XML
+
+def datacite_element(record):
+  """Return a record as a DataCite (kernel 4) `resource` element."""
+  fields = citation_fields(record)
+  ns = f"{{{DATACITE_NAMESPACE}}}"
+  resource = ET.Element(f"{ns}resource")
+  resource.set("{http://www.w3.org/2001/XMLSchema-instance}schemaLocation", f"{DATACITE_NAMESPACE} {DATACITE_SCHEMA}")
+
+  def add(parent, tag, text=None, **attributes):
+    element = ET.SubElement(parent, f"{ns}{tag}", {k: v for k, v in attributes.items() if v})
+    if text is not None:
+      element.text = str(text)
+    return element
+
+  if fields["doi"]:
+    add(resource, "identifier", fields["doi"], identifierType="DOI")
+  creators = add(resource, "creators")
+  for c in fields["creators"]:
+    creator = add(creators, "creator")
+    add(creator, "creatorName", c["name"], nameType="Personal" if c["personal"] else "Organizational")
+    if c["personal"] and c["given"]:
+      add(creator, "givenName", c["given"])
+    if c["personal"] and c["family"]:
+      add(creator, "familyName", c["family"])
+    if c["orcid"]:
+      add(creator, "nameIdentifier", c["orcid"], nameIdentifierScheme="ORCID", schemeURI="https://orcid.org")
+    for affiliation in c["affiliations"]:
+      add(creator, "affiliation", affiliation)
+  add(add(resource, "titles"), "title", fields["title"])
+  add(resource, "publisher", fields["publisher"] or "Zenodo")
+  if fields["date"]:
+    add(resource, "publicationYear", fields["date"][0])
+  add(resource, "resourceType", fields["resource_type"],
+      resourceTypeGeneral=_lookup(DATACITE_TYPES, fields["resource_type"], "Other"))
+  if fields["keywords"]:
+    subjects = add(resource, "subjects")
+    for keyword in fields["keywords"]:
+      add(subjects, "subject", keyword)
+  if fields["date"]:
+    add(add(resource, "dates"), "date", "-".join(f"{part:02d}" for part in fields["date"]), dateType="Issued")
+  if fields["concept_doi"]:
+    related = add(resource, "relatedIdentifiers")
+    add(related, "relatedIdentifier", fields["concept_doi"], relatedIdentifierType="DOI", relationType="IsVersionOf")
+  if fields["version"]:
+    add(resource, "version", fields["version"])
+  if fields["license"]:
+    add(add(resource, "rightsList"), "rights", fields["license"], rightsIdentifier=fields["license"])
+  if fields["description"]:
+    add(add(resource, "descriptions"), "description", fields["description"], descriptionType="Abstract")
+  return resource
+
+
+def render_datacite(record):
+  """Render a record as a DataCite XML document."""
+  ET.register_namespace("", DATACITE_NAMESPACE)
+  ET.register_namespace("xsi", "http://www.w3.org/2001/XMLSchema-instance")
+  element = datacite_element(record)
+  ET.indent(element)
+  return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(element, encoding="unicode") + "\n"
+
+
+# Citation File Format
+
+def _yaml(value):
+  # JSON strings are valid YAML double-quoted scalars
+  return json.dumps(value, ensure_ascii=False) if isinstance(value, str) else str(value)
+
+
+def render_cff(record):
+  """Render a record as a CITATION.cff (Citation File Format 1.2.0) document."""
+  fields = citation_fields(record)
+  lines = [
+    "cff-version: 1.2.0",
+    'message: "If you use this work, please cite it using the following metadata."',
+    f"title: {_yaml(fields['title'])}",
+    f"type: {'software' if fields['resource_type'] == 'software' else 'dataset'}",
+    "authors:",
+  ]
+  for c in fields["creators"]:
+    if c["personal"] and c["family"]:
+      person = [("family-names", c["family"]), ("given-names", c["given"]),
+                ("orcid", c["orcid"] and f"https://orcid.org/{c['orcid']}"),
+                ("affiliation", "; ".join(c["affiliations"]) or None)]
+    else:
+      person = [("name", c["name"])]
+    person = [(key, value) for key, value in person if value]
+    lines.append(f"  - {person[0][0]}: {_yaml(person[0][1])}")
+    lines.extend(f"    {key}: {_yaml(value)}" for key, value in person[1:])
+  if fields["doi"]:
+    lines.append(f"doi: {_yaml(fields['doi'])}")
+  if len(fields["date"]) == 3:
+    lines.append(f"date-released: {_yaml('-'.join(f'{part:02d}' for part in fields['date']))}")
+  for key, value in (("version", fields["version"]), ("url", fields["url"]),
+                     ("license", CFF_LICENSES.get((fields["license"] or "").lower())),
+                     ("abstract", fields["description"])):
+    if value:
+      lines.append(f"{key}: {_yaml(value)}")
+  if fields["keywords"]:
+    lines.append("keywords:")
+    lines.extend(f"  - {_yaml(keyword)}" for keyword in fields["keywords"])
+  return "\n".join(lines) + "\n"
+
+
+# Renderer of each format, its file extension and how rendered citations are combined
+FORMATS = {
+  "bibtex": (render_bibtex, ".bib"),
+  "csl": (render_csl, ".json"),
+  "datacite": (render_datacite, ".xml"),
+  "cff": (render_cff, ".cff"),
+}
+
+
+def combine_citations(fmt, citations):
+  """
+  Combine rendered citations into one document.
+
+  BibTeX entries are concatenated, CSL-JSON items form an array, DataCite
+  resources are wrapped in a `resources` element and CFF documents form a
+  YAML stream.
+  """
+  if fmt == "bibtex":
+    return "\n".join(citations)
+  if fmt == "csl":
+    return "[\n" + ",\n".join(citation.rstrip("\n") for citation in citations) + "\n]\n"
+  if fmt == "datacite":
+    bodies = [citation.split("?>", 1)[1].strip() for citation in citations]
+    return '<?xml version="1.0" encoding="UTF-8"?>\n<resources>\n' + "\n".join(bodies) + "\n</resources>\n"
+  return "".join(f"---\n{citation}" for citation in citations)
+
+
+class CitationCache:
+  """
+  Rendered citations of the cached records, kept up to date by revision.
+  """
+
+  def __init__(self, cache):
+    """
+    Initialize the citation cache.
+
+    Args:
+      cache (RecordCache): The record cache holding the records and their index.
+    """
+    self.cache = cache
+    self.root = os.path.join(cache.output_dir, "citations")
+
+  def path(self, fmt, record_id):
+    return os.path.join(self.root, fmt, f"{record_id}{FORMATS[fmt][1]}")
+
+  def _manifest_path(self, fmt):
+    return os.path.join(self.root, fmt, "manifest.json")
+
+  def _load_manifest(self, fmt):
+    path = self._manifest_path(fmt)
+    if os.path.exists(path):
+      with open(path, "r") as f:
+        manifest = json.load(f)
+      if manifest.get("renderer") == RENDERER_VERSION:
+        return manifest["records"]
+    return {}
+
+  def render(self, fmt, record_ids=None):
+    """
+    Return the citations of cached records, rendering those whose record changed.
+
+    Args:
+      fmt (str): The format (see `FORMATS`).
+      record_ids (list, optional): The records (all the cached records by default).
+
+    Returns:
+      tuple: (list of rendered citations, in order; number of records rendered again).
+
+    Raises:
+      ValueError: If the format is unknown.
+      KeyError: If a record is not cached.
+    """
+    if fmt not in FORMATS:
+      raise ValueError(f"Unknown citation format '{fmt}'. Available: {', '.join(FORMATS)}")
+    renderer = FORMATS[fmt][0]
+    record_ids = [str(record_id) for record_id in (record_ids or sorted(self.cache.index))]
+    manifest = self._load_manifest(fmt)
+    citations = []
+    rendered = 0
+    for record_id in record_ids:
+      entry = self.cache.index[record_id]
+      revision = f"{entry.get('revision_id')}:{entry.get('updated')}"
+      path = self.path(fmt, record_id)
+      if manifest.get(record_id) == revision and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+          citations.append(f.read())
+        continue
+      citation = renderer(self.cache.load_record(record_id))
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      atomic_write(path, citation.encode("utf-8"))
+      manifest[record_id] = revision
+      citations.append(citation)
+      rendered += 1
+
+    if rendered:
+      atomic_write_json(self._manifest_path(fmt), {"renderer": RENDERER_VERSION, "records": manifest}, indent=None)
+    logger.info(f"Rendered {rendered} of {len(record_ids)} {fmt} citations ({len(record_ids) - rendered} cached)")
+    return citations, rendered
@@ -0,0 +1,182 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Compression codecs for cached record JSON.
+
+Zenodo records repeat the same structure (links, thumbnails, access and `ui`
+blocks) in every record, so a dictionary shared across records improves the
+compression of small documents considerably:
+
+  zstd     Zstandard with a dictionary trained on cached records (needs `zstandard`)
+  deflate  zlib with a preset dictionary built from cached records (standard library)
+  gzip     Plain gzip without dictionary (readable with `zcat`)
+
+The dictionary is created once per cache and never replaced, since records
+compressed with it cannot be read without it. It is only trained from a batch
+of at least `MIN_DICT_SAMPLES` records (a harvest result page): records
+written before that (e.g. by `show` into a new cache) are compressed without
+dictionary, and stay readable once one exists.
+"""
+
+import gzip
+import logging
+import os
+import threading
+import zlib
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+logger = logging.getLogger("compression")
+
+# Size of the trained zstd dictionary and maximum zlib preset dictionary size
+ZSTD_DICT_SIZE = 64 * 1024
+ZLIB_DICT_SIZE = 32 * 1024
+
+ZSTD_LEVEL = 10
+
+# Minimum number of records a dictionary is trained from
+MIN_DICT_SAMPLES = 100
+
+
+class PlainCodec:
+  """Uncompressed JSON."""
+
+  name = "none"
+  suffix = ""
+  dictionary_file = None
+
+  def __init__(self, dictionary=None):
+    self.dictionary = dictionary
+
+  @classmethod
+  def train(cls, samples):
+    return None
+
+  def compress(self, data):
+    return data
+
+  def decompress(self, data):
+    return data
+
+
+class GzipCodec(PlainCodec):
+  """Plain gzip, without dictionary."""
+
+  name = "gzip"
+  suffix = ".gz"
+
+  def compress(self, data):
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+  def decompress(self, data):
+    return gzip.decompress(data)
+
+
+class DeflateCodec(PlainCodec):
+  """zlib streams with a preset dictionary shared by all records."""
+
+  name = "deflate"
+  suffix = ".zz"
+  dictionary_file = "dictionary.zlib"
+
+  @classmethod
+  def train(cls, samples):
+    # zlib matches against the end of the preset dictionary first, so the
+    # samples are concatenated and the last bytes kept.
+    return b"".join(samples)[-ZLIB_DICT_SIZE:]
+
+  def compress(self, data):
+    compressor = zlib.compressobj(level=6, zdict=self.dictionary) if self.dictionary else zlib.compressobj(level=6)
+    return compressor.compress(data) + compressor.flush()
+
+  def decompress(self, data):
+    decompressor = zlib.decompressobj(zdict=self.dictionary) if self.dictionary else zlib.decompressobj()
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+class ZstdCodec(PlainCodec):
+  """Zstandard frames with a trained dictionary shared by all records."""
+
+  name = "zstd"
+  suffix = ".zst"
+  dictionary_file = "dictionary.zstd"
+
+  def __init__(self, dictionary=None):
+    if zstandard is None:
+      raise ImportError("The 'zstandard' package is required for zstd cache compression (pip install zstandard).")
+    super().__init__(dictionary)
+    self._zdict = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+    if self._zdict is not None:
+      # Built once here, then only read by the compressors of every thread
+      self._zdict.precompute_compress(level=ZSTD_LEVEL)
+    self._contexts = threading.local()
+
+  def _context(self):
+    # zstandard (de)compressors cannot be used by several threads at once (the
+    # store stage of a harvest writes records concurrently): one per thread.
+    contexts = self._contexts
+    if not hasattr(contexts, "compressor"):
+      contexts.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=self._zdict)
+      contexts.decompressor = zstandard.ZstdDecompressor(dict_data=self._zdict)
+    return contexts
+
+  @classmethod
+  def train(cls, samples):
+    if zstandard is None:
+      raise ImportError("The 'zstandard' package is required for zstd cache compression (pip install zstandard).")
+    try:
+      return zstandard.train_dictionary(ZSTD_DICT_SIZE, samples).as_bytes()
+    except zstandard.ZstdError:
+      # Too few samples to train: use their raw content as the dictionary
+      return b"".join(samples)[-ZSTD_DICT_SIZE:]
+
+  def compress(self, data):
+    return self._context().compressor.compress(data)
+
+  def decompress(self, data):
+    return self._context().decompressor.decompress(data)
+
+
+CODECS = {codec.name: codec for codec in (PlainCodec, GzipCodec, DeflateCodec, ZstdCodec)}
+
+
+def load_codec(name, directory, samples=None):
+  """
+  Return the codec `name` with the cache dictionary stored in `directory`.
+
+  If the codec uses a dictionary and none exists yet, it is trained from
+  `samples` and saved; with fewer than `MIN_DICT_SAMPLES` samples the codec
+  works without dictionary and none is saved.
+
+  Args:
+    name (str): Codec name (`none`, `gzip`, `deflate`, `zstd`).
+    directory (str): Cache directory holding the dictionary.
+    samples (list, optional): Serialized records used to train a new dictionary.
+
+  Returns:
+    PlainCodec: The codec instance.
+  """
+  if name not in CODECS:
+    raise ValueError(f"Unknown cache compression '{name}'. Available: {', '.join(CODECS)}")
+  codec_class = CODECS[name]
+  if codec_class.dictionary_file is None:
+    return codec_class()
+
+  path = os.path.join(directory, codec_class.dictionary_file)
+  if os.path.exists(path):
+    with open(path, "rb") as f:
+      return codec_class(f.read())
+
+  if not samples or len(samples) < MIN_DICT_SAMPLES:
+    return codec_class()
+
+  dictionary = codec_class.train(samples)
+  # Imported here to avoid a circular import (record_cache uses this module)
+  from utils.record_cache import atomic_write
+  atomic_write(path, dictionary)
+  logger.info(f"Trained {name} dictionary ({len(dictionary)} bytes) from {len(samples)} records: {path}")
+  return codec_class(dictionary)
@@ -5,11 +5,16 @@ import os
 import json
 import logging
 
+from utils.logging_utils import DEFAULT_LOGGING_CONFIG, setup_logging
+
 logger = logging.getLogger("utils")
 
 # Sensitive fields that should be masked in configuration logs
 SENSITIVE_FIELDS = ["access_token", "api_key", "secret_key"]
 
+# Log file used when the fetch settings do not define `log_file`
+DEFAULT_LOG_FILE = "./logs/fetch_records.log"
+
 def load_env_file(env_file=".env"):
     """Load environment variables from a .env file."""
     if not os.path.exists(env_file):
@@ -108,7 +113,8 @@ def load_metadata_template(template_path):
     return template
 
 
-def initialize_workspace(config_path="config/zenodo_config.json", fetch_path="config/default_settings.json"):
+def initialize_workspace(config_path="config/zenodo_config.json", fetch_path="config/default_settings.json",
+                         logging_path=DEFAULT_LOGGING_CONFIG):
     """Initialize the workspace, load environment variables, load configurations, and validate."""
     # Load environment variables
     load_env_file()
@@ -117,26 +123,14 @@ def initialize_workspace(config_path="config/zenodo_config.json", fetch_path="co
     zenodo_config = load_zenodo_config(config_path)
     fetch_settings = load_fetch_settings(fetch_path)
 
+    # Set up queued logging to the terminal and the log file
+    log_file_path = fetch_settings.get("log_file", DEFAULT_LOG_FILE)
+    setup_logging(log_file_path, logging_path)
+    logger.info(f"Logging to {log_file_path}")
+
     # Validate configuration
     validate_and_warn_config(zenodo_config, required_keys=["base_url", "community_id"])
 
-    # Create log directory if it does not exist
-    log_file_path = fetch_settings.get("log_file", "./logs/fetch_records.log")
-    log_dir = os.path.dirname(log_file_path)
-    if log_dir:
-        os.makedirs(log_dir, exist_ok=True)
-        logger.info(f"Log directory created or already exists: {log_dir}")
-
-    # Set up logging handlers
-    logging.basicConfig(
-        level=logging.INFO, 
-        format="%(asctime)s - %(levelname)s - %(message)s",
-        handlers=[
-            logging.FileHandler(log_file_path, mode='a'),
-            logging.StreamHandler()
-        ]
-    )
-
     # Load metadata template
     template_path = fetch_settings.get("template_path", "config/metadata_template.json")
     metadata_template = load_metadata_template(template_path)
@@ -0,0 +1,330 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Detection of duplicate and near-duplicate records in the cache.
+
+Comparing every pair of records is quadratic, so candidates are found by
+blocking: only records sharing a blocking key are compared.
+
+  files        A file checksum (the same content uploaded twice)
+  identifiers  A DOI, or a related identifier declaring identity (`isidenticalto`, ...)
+  title        The normalized title (lowercase, no accents, punctuation or stopwords)
+  creators     The set of creator family names
+  lsh          A band of the MinHash signature of the title (character shingles)
+
+Records sharing a file or an identifier are linked directly. Other
+candidates are linked when the Jaccard similarity of their title shingles
+reaches the threshold and they share a creator. MinHash/LSH (`BANDS` bands
+of `ROWS` rows) finds the titles similar above roughly (1/BANDS)^(1/ROWS)
+without comparing all titles. Blocks larger than `MAX_BLOCK` records (e.g.
+a logo attached to every talk) are skipped as uninformative.
+
+Versions of a concept (the same `parent_id`) are not duplicates: linked
+records form clusters, and only the clusters spanning several concepts are
+reported for review.
+"""
+
+import functools
+import hashlib
+import logging
+import random
+import re
+import time
+import unicodedata
+
+logger = logging.getLogger("dedup")
+
+BANDS = 16
+ROWS = 4
+
+# Jaccard similarity of title shingles above which candidates are duplicates
+THRESHOLD = 0.8
+
+MAX_BLOCK = 100
+
+SHINGLE_SIZE = 4
+
+STOPWORDS = frozenset(("a", "an", "and", "at", "by", "for", "from", "in", "of", "on", "or", "the", "to", "with"))
+
+# Relation types of related identifiers naming the same work
+IDENTITY_RELATIONS = frozenset(("isidenticalto", "isvariantformof", "isoriginalformof"))
+
+# MD5 of an empty file
+EMPTY_CHECKSUM = "md5:d41d8cd98f00b204e9800998ecf8427e"
+
+_NON_WORD = re.compile(r"[\W_]+")
+_DOI = re.compile(r"^(?:https?://(?:dx\.)?doi\.org/|doi:)", re.IGNORECASE)
+
+
+def _ascii(text):
+  return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+
+
+def normalize_title(title):
+  """Return the normalized title: lowercase ASCII words, without punctuation and stopwords."""
+  words = _NON_WORD.sub(" ", _ascii(title or "").lower()).split()
+  return " ".join(word for word in words if word not in STOPWORDS)
+
+
+def shingles(text, size=SHINGLE_SIZE):
+  """Return the set of character shingles of a text (the text itself if shorter)."""
+  if len(text) <= size:
+    return {text} if text else set()
+  return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+SIGNATURE_SIZE = BANDS * ROWS
+
+# Fixed order in which an empty signature bin borrows the value of another bin (densification)
+_PROBES = [random.Random(position).sample(range(SIGNATURE_SIZE), SIGNATURE_SIZE) for position in range(SIGNATURE_SIZE)]
+
+
+@functools.lru_cache(maxsize=1 << 17)
+def _hash(item):
+  return int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), "little")
+
+
+def minhash(items):
+  """
+  Return the MinHash signature (`SIGNATURE_SIZE` values) of a set of strings.
+
+  One permutation hashing: each item is hashed once, into the bin given by the
+  low bits of its hash, and every bin keeps its minimum. Empty bins take the
+  value of the first non-empty bin in a fixed probe order, so that equal
+  positions of two signatures stay comparable (densification).
+  """
+  signature = [None] * SIGNATURE_SIZE
+  for item in items:
+    value = _hash(item)
+    position = value % SIGNATURE_SIZE
+    if signature[position] is None or value < signature[position]:
+      signature[position] = value
+  if not items:
+    return [0] * SIGNATURE_SIZE
+  return [
+    value if value is not None else next(signature[probe] for probe in _PROBES[position] if signature[probe] is not None)
+    for position, value in enumerate(signature)
+  ]
+
+
+def jaccard(first, second):
+  if not first and not second:
+    return 1.0
+  common = len(first & second)
+  return common / (len(first) + len(second) - common)
+
+
+def _identifier(value):
+  return _DOI.sub("", str(value).strip()).lower().rstrip("/")
+
+
+def record_features(record_id, record, entry):
+  """
+  Extract the blocking and comparison features of a cached record.
+
+  Args:
+    record_id (str): The record ID.
+    record (dict): The cached record.
+    entry (dict): Its index entry.
+
+  Returns:
+    dict: `id`, `parent_id`, `title`, `norm_title`, `creators` (family names), `identifiers`,
+      `checksums` and, for the report, `doi` and `publication_date`.
+  """
+  metadata = record.get("metadata", {})
+  creators = set()
+  for creator in metadata.get("creators", []):
+    person = creator.get("person_or_org", {})
+    name = person.get("family_name") or person.get("name") or ""
+    name = normalize_title(name.split(",")[0])
+    if name:
+      creators.add(name)
+  doi = record.get("pids", {}).get("doi", {}).get("identifier")
+  identifiers = {_identifier(doi)} if doi else set()
+  for related in metadata.get("related_identifiers", []):
+    if (related.get("relation_type") or {}).get("id") in IDENTITY_RELATIONS and related.get("identifier"):
+      identifiers.add(_identifier(related["identifier"]))
+  return {
+    "id": record_id,
+    "parent_id": entry.get("parent_id"),
+    "title": metadata.get("title", ""),
+    "norm_title": normalize_title(metadata.get("title", "")),
+    "creators": creators,
+    "identifiers": identifiers,
+    "checksums": {
+      file_entry["checksum"] for file_entry in entry.get("files", {}).values()
+      if file_entry.get("checksum") and file_entry.get("checksum") != EMPTY_CHECKSUM
+    },
+    "doi": doi,
+    "publication_date": metadata.get("publication_date"),
+  }
+
+
+class _Clusters:
+  """
+  Union-find of linked records, with the evidence of the links that joined them.
+
+  Links between records already in the same cluster are not kept, so the
+  links of a cluster are a spanning tree explaining why its records are
+  grouped.
+  """
+
+  def __init__(self, features):
+    self.features = features
+    self.parent = {record_id: record_id for record_id in features}
+    self.links = []
+
+  def find(self, record_id):
+    root = record_id
+    while self.parent[root] != root:
+      root = self.parent[root]
+    while self.parent[record_id] != root:
+      self.parent[record_id], record_id = root, self.parent[record_id]
+    return root
+
+  def link(self, first, second, reason, score=1.0):
+    first_root, second_root = self.find(first), self.find(second)
+    if first_root == second_root:
+      return
+    if self.features[first]["parent_id"] != self.features[second]["parent_id"]:
+      self.links.append((first, second, reason, score))
+    self.parent[first_root] = second_root
+
+  def clusters(self):
+    """Return the clusters spanning several concepts, largest first."""
+    members = {}
+    for record_id in self.features:
+      members.setdefault(self.find(record_id), []).append(record_id)
+    links = {}
+    for first, second, reason, score in self.links:
+      links.setdefault(self.find(first), []).append(
+        {"records": sorted((first, second)), "reason": reason, "score": round(score, 3)}
+      )
+    clusters = []
+    for root, record_ids in members.items():
+      if len({self.features[record_id]["parent_id"] for record_id in record_ids}) < 2:
+        continue
+      clusters.append({
+        "records": [
+          {key: self.features[record_id][key] for key in ("id", "parent_id", "title", "doi", "publication_date")}
+          for record_id in sorted(record_ids)
+        ],
+        "reasons": sorted({link["reason"] for link in links.get(root, [])}),
+        "links": links.get(root, []),
+      })
+    clusters.sort(key=lambda cluster: (-len(cluster["records"]), cluster["records"][0]["id"]))
+    return clusters
+
+
+def _blocks(features, key):
+  blocks = {}
+  for record_id, feature in features.items():
+    for value in key(feature):
+      blocks.setdefault(value, []).append(record_id)
+  return blocks
+
+
+def find_duplicates(features, threshold=THRESHOLD, max_block=MAX_BLOCK):
+  """
+  Cluster duplicate and near-duplicate records.
+
+  Args:
+    features (dict): The features of the records by ID (see `record_features`).
+    threshold (float, optional): Minimum Jaccard similarity of the title shingles of near-duplicates.
+    max_block (int, optional): Blocks with more records are skipped.
+
+  Returns:
+    dict: The `clusters` of duplicates (records, reasons and links), counts of `records`,
+      `candidates` compared and `skipped_blocks`, and `seconds`.
+  """
+  started = time.perf_counter()
+  clusters = _Clusters(features)
+  skipped = 0
+
+  # Exact evidence: the same file content or identifier
+  for reason, key in (("files", lambda f: f["checksums"]), ("identifiers", lambda f: f["identifiers"])):
+    for block in _blocks(features, key).values():
+      if len(block) > max_block:
+        skipped += 1
+        continue
+      for other in block[1:]:
+        clusters.link(block[0], other, reason)
+
+  # Near-duplicate titles: candidates from the title, creators and LSH blocks
+  titles = _blocks(features, lambda f: [f["norm_title"]] if f["norm_title"] else [])
+  title_shingles = {title: shingles(title) for title in titles}
+  candidates = set()
+  for title in titles:
+    candidates.add((title, title))
+  for block in _blocks(features, lambda f: [" ".join(sorted(f["creators"]))] if f["creators"] else []).values():
+    if len(block) > max_block:
+      skipped += 1
+      continue
+    block_titles = sorted({features[record_id]["norm_title"] for record_id in block} - {""})
+    candidates.update((a, b) for i, a in enumerate(block_titles) for b in block_titles[i + 1:])
+  buckets = {}
+  for title, items in title_shingles.items():
+    signature = minhash(items)
+    for band in range(BANDS):
+      buckets.setdefault((band, tuple(signature[band * ROWS:(band + 1) * ROWS])), []).append(title)
+  for bucket in buckets.values():
+    if len(bucket) > max_block:
+      skipped += 1
+      continue
+    bucket = sorted(bucket)
+    candidates.update((a, b) for i, a in enumerate(bucket) for b in bucket[i + 1:])
+
+  compared = 0
+  for first_title, second_title in candidates:
+    score = jaccard(title_shingles[first_title], title_shingles[second_title])
+    if score < threshold:
+      continue
+    first_block, second_block = titles[first_title], titles[second_title]
+    if len(first_block) > max_block or len(second_block) > max_block:
+      skipped += 1
+      continue
+    for first in first_block:
+      for second in second_block:
+        if first >= second and first_title == second_title:
+          continue
+        compared += 1
+        a, b = features[first], features[second]
+        if a["parent_id"] == b["parent_id"]:
+          continue
+        if a["creators"] and b["creators"] and not a["creators"] & b["creators"]:
+          continue
+        clusters.link(first, second, "title", score)
+
+  report = {
+    "clusters": clusters.clusters(),
+    "records": len(features),
+    "candidates": compared,
+    "skipped_blocks": skipped,
+    "seconds": time.perf_counter() - started,
+  }
+  logger.info(
+    f"Found {len(report['clusters'])} clusters of duplicates among {report['records']} records in "
+    f"{report['seconds']:.2f} s ({report['candidates']} candidate pairs compared, {skipped} oversized blocks skipped)"
+  )
+  return report
+
+
+def analyze_cache(cache, threshold=THRESHOLD, max_block=MAX_BLOCK):
+  """
+  Find the duplicate records of a cache.
+
+  Args:
+    cache (RecordCache): The cache.
+    threshold (float, optional): Minimum title similarity of near-duplicates.
+    max_block (int, optional): Blocks with more records are skipped.
+
+  Returns:
+    dict: See `find_duplicates`.
+  """
+  features = {}
+  for record_id, entry in cache.index.items():
+    record = cache.load_record(record_id)
+    if record is not None:
+      features[record_id] = record_features(record_id, record, entry)
+  return find_duplicates(features, threshold, max_block)
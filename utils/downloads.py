@@ -0,0 +1,229 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Scheduled download of the files missing from the cache.
+
+A harvest run with `download_files` disabled (or interrupted) leaves the
+files of the cached records to download. The scheduler lists them from the
+index (a file is missing when its cached copy does not exist or has another
+size), orders them by priority and downloads them within the limits of a run:
+
+  order      `smallest` (most files for the bytes), `newest` (most recently
+             updated records first, then smallest) or `index` (record ID order)
+  budget     Total bytes downloaded by a run: files that do not fit are
+             deferred to the next run, smaller ones still fill the budget
+  workers    Downloads in flight, at most `per_host` to each host (Zenodo serves
+             every file from the API host, so in practice at most `per_host`)
+  bandwidth  Global cap of the download rate, shared with every other
+             download of the client (see `ZenodoAPI(bandwidth_limit=...)`)
+
+Files are written atomically through `RecordCache.download_files`, so an
+interrupted run leaves no partial file and the next run picks up the rest.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+from utils.logging_utils import ProgressLog
+from utils.record_cache import safe_file_key
+
+logger = logging.getLogger("downloads")
+
+ORDERS = ("smallest", "newest", "index")
+
+_SIZE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)(i?)b?\s*$", re.IGNORECASE)
+
+
+def parse_size(value):
+  """
+  Parse a size in bytes: a number with an optional unit (`500k`, `10MB`, `1.5GiB`).
+
+  Units are decimal (k = 1000) unless binary (`Ki`, `Mi`, ...).
+
+  Raises:
+    ValueError: If the size is not valid.
+  """
+  if isinstance(value, (int, float)):
+    return int(value)
+  match = _SIZE.match(str(value))
+  if match is None:
+    raise ValueError(f"Invalid size '{value}': use a number of bytes with an optional unit (e.g. 500k, 10MB, 1.5GiB)")
+  number, unit, binary = match.groups()
+  base = 1024 if binary else 1000
+  return int(float(number) * base ** " kmgt".index(unit.lower() or " "))
+
+
+def pending_files(cache, record_ids=None):
+  """
+  List the files of the cached records that are missing from the cache.
+
+  Args:
+    cache (RecordCache): The cache.
+    record_ids (iterable, optional): The records to consider (all the cached records by default).
+
+  Returns:
+    list: The missing files: dicts with `record_id`, `key`, `size`, `checksum` and `updated` (of the record).
+  """
+  files = []
+  for record_id in (record_ids if record_ids is not None else sorted(cache.index)):
+    entry = cache.index.get(str(record_id))
+    if entry is None:
+      continue
+    for key, file_entry in entry.get("files", {}).items():
+      if not safe_file_key(key):
+        logger.warning(f"Skipping file {key!r} of record {record_id}: unsafe file key")
+        continue
+      path = cache.file_path(record_id, key)
+      if os.path.exists(path) and os.path.getsize(path) == file_entry.get("size"):
+        continue
+      files.append({
+        "record_id": str(record_id),
+        "key": key,
+        "size": file_entry.get("size") or 0,
+        "checksum": file_entry.get("checksum"),
+        "updated": entry.get("updated") or "",
+      })
+  return files
+
+
+def plan_downloads(files, order="smallest", budget=None):
+  """
+  Order the files to download by priority and select those fitting in the byte budget.
+
+  Args:
+    files (list): The missing files (see `pending_files`).
+    order (str, optional): `smallest`, `newest` or `index`.
+    budget (int, optional): Maximum total bytes (unlimited by default).
+
+  Returns:
+    tuple: (selected, deferred) lists of files, in priority order.
+
+  Raises:
+    ValueError: If the order is unknown.
+  """
+  if order == "smallest":
+    files = sorted(files, key=lambda f: (f["size"], f["record_id"], f["key"]))
+  elif order == "newest":
+    # Stable sorts: newest records first, smallest files first within a record update time
+    files = sorted(files, key=lambda f: (f["size"], f["record_id"], f["key"]))
+    files.sort(key=lambda f: f["updated"], reverse=True)
+  elif order != "index":
+    raise ValueError(f"Unknown download order '{order}'. Available: {', '.join(ORDERS)}")
+  if budget is None:
+    return list(files), []
+  selected, deferred, total = [], [], 0
+  for file in files:
+    if total + file["size"] <= budget:
+      selected.append(file)
+      total += file["size"]
+    else:
+      deferred.append(file)
+  return selected, deferred
+
+
+class DownloadScheduler:
+  """
+  Downloads of missing cache files by priority, with concurrency limits and a byte budget.
+  """
+
+  def __init__(self, api, cache, workers=4, per_host=4, order="smallest", budget=None):
+    """
+    Initialize the scheduler.
+
+    Args:
+      api (ZenodoAPI): The API client (its `bandwidth_limit` caps the download rate).
+      cache (RecordCache): The cache.
+      workers (int, optional): Maximum number of downloads in flight.
+      per_host (int, optional): Maximum number of downloads in flight from each host.
+      order (str, optional): Priority order (see `ORDERS`).
+      budget (int, optional): Maximum total bytes downloaded by a run (unlimited by default).
+
+    Raises:
+      ValueError: If the order is unknown.
+    """
+    if order not in ORDERS:
+      raise ValueError(f"Unknown download order '{order}'. Available: {', '.join(ORDERS)}")
+    self.api = api
+    self.cache = cache
+    self.workers = max(1, int(workers))
+    self.per_host = max(1, int(per_host))
+    self.order = order
+    self.budget = budget
+    self._hosts = {}
+    self._lock = threading.Lock()
+
+  def plan(self, record_ids=None):
+    """
+    Plan a run: the missing files selected for download and those deferred, in priority order.
+    """
+    return plan_downloads(pending_files(self.cache, record_ids), self.order, self.budget)
+
+  def _host(self, file):
+    return urlsplit(self.api.url(f"records/{file['record_id']}/files/{quote(file['key'])}/content")).netloc
+
+  def _host_slots(self, file):
+    host = self._host(file)
+    with self._lock:
+      if host not in self._hosts:
+        self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+      return self._hosts[host]
+
+  def _download(self, file, progress):
+    with self._host_slots(file):
+      try:
+        entry = {file["key"]: {"checksum": file["checksum"], "size": file["size"]}}
+        self.cache.download_files(self.api, file["record_id"], entry)
+      except Exception as e:
+        logger.error(f"Failed to download {file['key']} of record {file['record_id']}: {e}")
+        progress.add(failed=1)
+        return False
+    progress.add(files=1, bytes=file["size"])
+    return True
+
+  def run(self, record_ids=None):
+    """
+    Download the missing files selected by the plan, highest priority first.
+
+    Args:
+      record_ids (iterable, optional): The records whose files are downloaded (all by default).
+
+    Returns:
+      dict: Counts of `downloaded` files and `bytes`, the `failed` files, the `deferred` files
+        and bytes (over budget), and `seconds`.
+    """
+    started = time.perf_counter()
+    selected, deferred = self.plan(record_ids)
+    # More threads than the hosts allow in flight would only wait for a host slot
+    hosts = {self._host(file) for file in selected}
+    workers = max(1, min(self.workers, self.per_host * len(hosts)))
+    if workers < self.workers:
+      logger.info(
+        f"Downloading with {workers} of {self.workers} workers: at most {self.per_host} downloads in flight "
+        f"to each of {len(hosts)} host(s) (per_host)"
+      )
+    progress = ProgressLog(logger, "Downloads", rate="files")
+    # The pool starts the downloads in submission (priority) order
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+      results = list(executor.map(lambda file: self._download(file, progress), selected))
+
+    downloaded = [file for file, ok in zip(selected, results) if ok]
+    report = {
+      "downloaded": len(downloaded),
+      "bytes": sum(file["size"] for file in downloaded),
+      "failed": [{"record_id": file["record_id"], "key": file["key"]} for file, ok in zip(selected, results) if not ok],
+      "deferred": len(deferred),
+      "deferred_bytes": sum(file["size"] for file in deferred),
+      "seconds": time.perf_counter() - started,
+    }
+    logger.info(
+      f"Downloaded {report['downloaded']} files ({report['bytes'] / 1e6:.1f} MB) in {report['seconds']:.2f} s "
+      f"({report['bytes'] / 1e6 / max(report['seconds'], 1e-9):.1f} MB/s), {len(report['failed'])} failed, "
+      f"{report['deferred']} deferred over the budget ({report['deferred_bytes'] / 1e6:.1f} MB)"
+    )
+    return report
@@ -0,0 +1,257 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Export of the record cache to a static mirror.
+
+Two layouts are supported:
+
+  static  records/{record_id}/metadata.json and records/{record_id}/files/,
+          plus index.json and index.html listing the records
+  bagit   bags/{record_id}/, one BagIt bag per record (data/metadata.json,
+          data/files/, MD5 payload and tag manifests), plus index.json
+
+Files are hardlinked from the cache rather than copied (falling back to a
+copy across file systems), and a file shared by several records (e.g.
+versions) is exported once: its other copies are hardlinks to the same
+inode. The exported entries are kept in `export.json`, so a re-export only
+rebuilds the records whose index entry changed and removes the records no
+longer cached. The cache replaces files atomically (a new inode), so
+hardlinked exports are never modified by a harvest, but editing an exported
+file in place would modify the cache: the mirror is meant to be read-only.
+"""
+
+import errno
+import hashlib
+import html
+import json
+import logging
+import os
+import shutil
+import time
+from urllib.parse import quote
+
+from utils.record_cache import RecordCache, atomic_write, atomic_write_json, safe_file_key
+from utils.verify import hash_file
+
+logger = logging.getLogger("export")
+
+LAYOUTS = ("static", "bagit")
+
+STATE_FILE = "export.json"
+
+BAGIT_VERSION = "1.0"
+
+
+def export_cache(output_dir, export_dir, layout="static", link=True):
+  """
+  Export the cached records (projected metadata and downloaded files) to a directory.
+
+  Args:
+    output_dir (str): Root directory of the cache.
+    export_dir (str): Directory of the export (created if needed).
+    layout (str, optional): `static` or `bagit`.
+    link (bool, optional): Hardlink the files (copy them if False).
+
+  Returns:
+    dict: Counts of `exported`, `unchanged` and `removed` records, of `linked`, `copied` and
+      `deduplicated` files, of `missing_files` (not downloaded in the cache) and `skipped_files`
+      (unsafe file keys, see `safe_file_key`), and `seconds`.
+
+  Raises:
+    ValueError: If the layout is unknown or the export directory holds another layout.
+  """
+  if layout not in LAYOUTS:
+    raise ValueError(f"Unknown export layout '{layout}'. Available: {', '.join(LAYOUTS)}")
+  started = time.perf_counter()
+  cache = RecordCache(output_dir)
+  state_path = os.path.join(export_dir, STATE_FILE)
+  state = {"layout": layout, "records": {}}
+  if os.path.exists(state_path):
+    with open(state_path, "r") as f:
+      state = json.load(f)
+    if state["layout"] != layout:
+      raise ValueError(f"{export_dir} holds a '{state['layout']}' export; export the '{layout}' layout to another directory")
+
+  os.makedirs(export_dir, exist_ok=True)
+  exporter = _Exporter(cache, export_dir, layout, link)
+  previous = state["records"]
+  # Files of the records left untouched can be linked by the exported records
+  for record_id, entry in previous.items():
+    if cache.index.get(record_id) == entry:
+      exporter.remember_files(record_id, entry)
+
+  for record_id in sorted(set(previous) - set(cache.index)):
+    shutil.rmtree(exporter.record_dir(record_id), ignore_errors=True)
+    exporter.counts["removed"] += 1
+  exported = {}
+  for record_id, entry in sorted(cache.index.items()):
+    if previous.get(record_id) == entry and os.path.isdir(exporter.record_dir(record_id)):
+      exporter.counts["unchanged"] += 1
+      exported[record_id] = entry
+    elif exporter.export_record(record_id, entry):
+      exported[record_id] = entry
+    else:
+      # Exported again once its missing files are downloaded
+      exported[record_id] = dict(entry, incomplete=True)
+
+  exporter.write_index()
+  atomic_write_json(state_path, {"layout": layout, "records": exported}, indent=None)
+
+  report = dict(exporter.counts, seconds=time.perf_counter() - started)
+  logger.info(
+    f"Exported {report['exported']} records to {export_dir} ({layout}) in {report['seconds']:.2f} s: "
+    f"{report['unchanged']} unchanged, {report['removed']} removed; {report['linked']} files linked, "
+    f"{report['copied']} copied, {report['deduplicated']} deduplicated, {report['missing_files']} missing, "
+    f"{report['skipped_files']} skipped"
+  )
+  return report
+
+
+class _Exporter:
+  """Writes the records of a cache in an export layout."""
+
+  def __init__(self, cache, export_dir, layout, link):
+    self.cache = cache
+    self.export_dir = export_dir
+    self.layout = layout
+    self.link = link
+    # Exported path of each file content, by checksum
+    self.contents = {}
+    self.counts = {"exported": 0, "unchanged": 0, "removed": 0, "linked": 0, "copied": 0,
+                   "deduplicated": 0, "missing_files": 0, "skipped_files": 0}
+
+  def record_dir(self, record_id):
+    return os.path.join(self.export_dir, "records" if self.layout == "static" else "bags", str(record_id))
+
+  def payload_dir(self, record_dir):
+    return record_dir if self.layout == "static" else os.path.join(record_dir, "data")
+
+  def remember_files(self, record_id, entry):
+    payload = self.payload_dir(self.record_dir(record_id))
+    for key, file_entry in entry.get("files", {}).items():
+      path = os.path.join(payload, "files", key)
+      if file_entry.get("checksum") and os.path.exists(path):
+        self.contents.setdefault(file_entry["checksum"], path)
+
+  def export_record(self, record_id, entry):
+    """
+    Rebuild the export of a record in a temporary directory, then swap it in.
+
+    Returns:
+      bool: True if every file of the record was exported.
+    """
+    target = self.record_dir(record_id)
+    tmp_dir = os.path.join(os.path.dirname(target), f".{record_id}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    payload = self.payload_dir(tmp_dir)
+    os.makedirs(os.path.join(payload, "files"))
+
+    self._place(self.cache.metadata_path(record_id), os.path.join(payload, "metadata.json"))
+    exported_files = {}
+    for key, file_entry in sorted(entry.get("files", {}).items()):
+      if not safe_file_key(key):
+        logger.warning(f"Skipping file {key!r} of record {record_id}: unsafe file key")
+        self.counts["skipped_files"] += 1
+        continue
+      shared = self.contents.get(file_entry.get("checksum"))
+      source = self.cache.file_path(record_id, key)
+      if shared is not None and os.path.exists(shared):
+        source = shared
+        self.counts["deduplicated"] += 1
+      elif not os.path.exists(source):
+        self.counts["missing_files"] += 1
+        continue
+      self._place(source, os.path.join(payload, "files", key))
+      exported_files[key] = file_entry
+
+    if self.layout == "bagit":
+      self._write_bag(tmp_dir, record_id, entry, exported_files)
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp_dir, target)
+    for key, file_entry in exported_files.items():
+      if file_entry.get("checksum"):
+        self.contents.setdefault(file_entry["checksum"], os.path.join(self.payload_dir(target), "files", key))
+    self.counts["exported"] += 1
+    return len(exported_files) == len(entry.get("files", {}))
+
+  def _place(self, source, destination):
+    """Hardlink `source` to `destination`, copying it if links are disabled or not possible."""
+    if self.link:
+      try:
+        os.link(source, destination)
+        self.counts["linked"] += 1
+        return
+      except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+          raise
+        logger.debug(f"Cannot hardlink {source} ({e.strerror}): copying it")
+    shutil.copy2(source, destination)
+    self.counts["copied"] += 1
+
+  def _write_bag(self, bag_dir, record_id, entry, files):
+    """Write the BagIt declaration, bag-info and manifests of a record bag."""
+    with open(os.path.join(bag_dir, "data", "metadata.json"), "rb") as f:
+      metadata = f.read()
+    payload = [(f"md5:{hashlib.md5(metadata).hexdigest()}", "data/metadata.json", len(metadata))]
+    for key, file_entry in files.items():
+      size = os.path.getsize(os.path.join(bag_dir, "data", "files", key))
+      payload.append((file_entry.get("checksum") or "", f"data/files/{key}", size))
+    if any(not checksum.startswith("md5:") for checksum, _, _ in payload):
+      # Checksums of other algorithms are recomputed as MD5 for the manifest
+      payload = [(f"md5:{hash_file(os.path.join(bag_dir, path))[0]}" if not checksum.startswith("md5:") else checksum, path, size)
+                 for checksum, path, size in payload]
+
+    tags = {
+      "bagit.txt": f"BagIt-Version: {BAGIT_VERSION}\nTag-File-Character-Encoding: UTF-8\n",
+      "bag-info.txt": (
+        f"External-Identifier: {record_id}\n"
+        f"Payload-Oxum: {sum(size for _, _, size in payload)}.{len(payload)}\n"
+        f"Bagging-Date: {time.strftime('%Y-%m-%d')}\n"
+        f"Internal-Sender-Identifier: revision {entry.get('revision_id')}\n"
+      ),
+      "manifest-md5.txt": "".join(f"{checksum[4:]}  {path}\n" for checksum, path, _ in payload),
+    }
+    for name, text in tags.items():
+      atomic_write(os.path.join(bag_dir, name), text.encode())
+    atomic_write(os.path.join(bag_dir, "tagmanifest-md5.txt"), "".join(
+      f"{hashlib.md5(text.encode()).hexdigest()}  {name}\n" for name, text in tags.items()
+    ).encode())
+
+  def write_index(self):
+    """Write index.json (and, for the static layout, index.html) listing the exported records."""
+    records = []
+    for record_id, entry in sorted(self.cache.index.items()):
+      metadata = self.cache.load_metadata(record_id) or {}
+      fields = metadata.get("metadata", metadata)
+      records.append({
+        "id": record_id,
+        "title": fields.get("title"),
+        "publication_date": fields.get("publication_date"),
+        "revision_id": entry.get("revision_id"),
+        "path": os.path.relpath(self.record_dir(record_id), self.export_dir),
+        "files": sorted(entry.get("files", {})),
+      })
+    atomic_write_json(os.path.join(self.export_dir, "index.json"), records)
+    if self.layout == "static":
+      atomic_write(os.path.join(self.export_dir, "index.html"), _render_html(records).encode())
+
+
+def _render_html(records):
+  rows = []
+  for record in records:
+    files = ", ".join(
+      f'<a href="{html.escape(record["path"])}/files/{html.escape(quote(key))}">{html.escape(key)}</a>' for key in record["files"]
+    )
+    rows.append(
+      f'<tr><td><a href="{html.escape(record["path"])}/metadata.json">{html.escape(record["id"])}</a></td>'
+      f'<td>{html.escape(str(record["title"] or ""))}</td><td>{html.escape(str(record["publication_date"] or ""))}</td>'
+      f"<td>{files}</td></tr>"
+    )
+  return (
+    "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>CF records</title></head><body>\n"
+    f"<h1>CF records ({len(records)})</h1>\n<table>\n"
+    "<tr><th>Record</th><th>Title</th><th>Publication date</th><th>Files</th></tr>\n"
+    + "\n".join(rows) + "\n</table>\n</body></html>\n"
+  )
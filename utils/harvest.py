@@ -0,0 +1,383 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Harvesting of Zenodo community records into the local cache.
+
+A harvest runs as a pipeline of stages connected by bounded queues (see
+`utils.pipeline`), each with its own number of worker threads:
+
+  fetch     Request the result pages of each source (network)
+  decode    Decode the records of a page as its response is received, skipping
+            duplicates and unchanged records
+  project   Project the metadata with the metadata template
+  validate  Validate the projected metadata against a JSON schema (optional)
+  store     Write the record and its metadata to the cache
+  download  Download the record files, then index and journal the record
+
+Once the cache holds a first harvest, the download stage compares the new
+index entry of every stored record with the previous one and appends the
+differences to the change feed of the cache (see `utils.changes`). The
+statistics of every listed record, changed or not, are snapshotted into the
+stats store of the cache at the end of the harvest (see `utils.stats`).
+
+Records are not logged one by one: the stored, unchanged and invalid
+records are counted into a progress line logged periodically (see
+`utils.logging_utils.ProgressLog`).
+"""
+
+import json
+import logging
+import threading
+
+from utils.changes import describe_change, utc_now
+from utils.logging_utils import ProgressLog
+from utils.pipeline import POLL_INTERVAL, QUEUE_SIZE, Pipeline, Stage
+from utils.stats import stats_row
+
+logger = logging.getLogger("harvest")
+
+# Default number of worker threads of each harvest stage (`fetch` defaults to the `workers` argument)
+STAGE_WORKERS = {"fetch": 4, "decode": 1, "project": 1, "validate": 1, "store": 2, "download": 4}
+
+# Records are listed oldest first so that records published during a harvest
+# are appended to the last pages and the completed pages stay valid on resume.
+HARVEST_SORT = "oldest"
+
+
+def source_name(source):
+  """Return the name identifying a harvest source (its `name`, community or query)."""
+  return source.get("name") or source.get("community") or source.get("query")
+
+
+def build_sources(communities=(), queries=()):
+  """Build harvest sources from lists of community IDs and search queries."""
+  return [{"community": community} for community in communities] + [{"query": query} for query in queries]
+
+
+def load_harvest_spec(path):
+  """
+  Load a harvest spec: a list of communities and/or saved queries harvested together.
+
+  Example:
+    {"workers": 4, "sources": [{"community": "cfconventions"}, {"name": "cf-tools", "query": "title:netcdf"}]}
+
+  Args:
+    path (str): Path of the JSON spec.
+
+  Returns:
+    dict: The spec.
+
+  Raises:
+    ValueError: If the spec has no sources or a source has neither a community nor a query.
+  """
+  with open(path, "r") as f:
+    spec = json.load(f)
+  sources = spec.get("sources")
+  if not sources:
+    raise ValueError(f"Harvest spec {path} does not define any sources")
+  for source in sources:
+    if not source.get("community") and not source.get("query"):
+      raise ValueError(f"Harvest source {source} in {path} needs a 'community' or a 'query'")
+  names = [source_name(source) for source in sources]
+  if len(set(names)) != len(names):
+    raise ValueError(f"Harvest sources in {path} must have unique names")
+  logger.info(f"Loaded harvest spec from {path} ({len(sources)} sources)")
+  return spec
+
+
+def harvest_community(api, cache, community_id, size=1000, download_files=True):
+  """
+  Fetch every record of a community into the cache, resuming an interrupted harvest.
+
+  See `harvest_sources`.
+
+  Args:
+    api (ZenodoAPI): The API client.
+    cache (RecordCache): The cache to fill.
+    community_id (str): The Zenodo community ID.
+    size (int, optional): The number of records per page.
+    download_files (bool, optional): Download the record files.
+
+  Returns:
+    dict: Counts of `stored`, `unchanged`, `duplicates` and `resumed` records.
+  """
+  return harvest_sources(api, cache, [{"community": community_id}], size=size, download_files=download_files, workers=1)
+
+
+def harvest_sources(api, cache, sources, size=1000, download_files=True, workers=4,
+                    stage_workers=None, queue_size=QUEUE_SIZE, validator=None, on_record=None):
+  """
+  Fetch the records of several communities/queries into the cache.
+
+  The sources are listed concurrently by the `fetch` stage, sharing the client
+  (and therefore its connection pool and rate-limit budget), and the records
+  flow through the pipeline stages described in the module documentation. A
+  record listed by several sources (e.g. belonging to two communities) is
+  stored once. The statistics of each stage are recorded in the client metrics.
+
+  Each record is written atomically and journaled once its files are
+  downloaded. If a previous harvest was interrupted, the journaled records are
+  restored into the index and not fetched or downloaded again, and the
+  completed pages of each source are skipped. The journal is removed once the
+  index is saved at the end of the harvest.
+
+  Args:
+    api (ZenodoAPI): The API client.
+    cache (RecordCache): The cache to fill.
+    sources (list): Sources, each with a `community` and/or a `query` (and an optional `name`).
+    size (int, optional): The number of records per page.
+    download_files (bool, optional): Download the record files.
+    workers (int, optional): Number of sources listed concurrently.
+    stage_workers (dict, optional): Number of worker threads by stage name (see `STAGE_WORKERS`).
+    queue_size (int, optional): Capacity of the queue in front of each stage.
+    validator (callable, optional): Returns the validation errors of projected metadata
+      (see `utils.validation.load_validator`); records failing validation are stored and reported.
+    on_record (callable, optional): Called with the ID and index entry of every stored record,
+      from the download workers; an exception it raises stops the harvest (resumable).
+
+  Returns:
+    dict: Counts of `stored`, `unchanged`, `duplicates`, `invalid` and `resumed` records.
+  """
+  params = {"sources": sources, "size": size, "sort": HARVEST_SORT, "download_files": download_files}
+  journal = cache.journal
+  # A first harvest has nothing to compare with: the change feed starts with the next one
+  track_changes = bool(cache.index)
+
+  previous_params, completed, pages = journal.replay()
+  if previous_params is not None:
+    logger.info(f"Resuming interrupted harvest: {len(completed)} records already stored, {sum(pages.values())} pages completed")
+    cache.index.update(completed)
+  if previous_params != params:
+    # Completed pages only match when listing with the same parameters
+    pages = {}
+    journal.start(params)
+
+  state = _HarvestState(completed, journal)
+  if track_changes:
+    state.track_changes(cache)
+  harvest = _Harvest(api, cache, size, download_files, validator, state, on_record)
+  counts = dict(STAGE_WORKERS, fetch=workers, **(stage_workers or {}))
+  pipeline = Pipeline([
+    Stage("fetch", harvest.fetch, min(counts["fetch"], len(sources)), queue_size),
+    Stage("decode", harvest.decode, counts["decode"], 2),
+    Stage("project", harvest.project, counts["project"], queue_size),
+    Stage("validate", harvest.validate, counts["validate"], queue_size),
+    Stage("store", harvest.store, counts["store"], queue_size),
+    Stage("download", harvest.download, counts["download"], queue_size),
+  ], metrics=api.metrics)
+  harvest.pipeline = pipeline
+
+  try:
+    pipeline.run((source, pages.get(source_name(source), 0)) for source in sources)
+    cache.save_index()
+    if state.stats:
+      cache.stats.snapshot(state.stats)
+    journal.remove()
+  finally:
+    journal.close()
+
+  counts = dict(state.counts, resumed=len(completed))
+  logger.info(
+    f"Harvest of {len(sources)} source(s) complete: {counts['stored']} stored, {counts['unchanged']} unchanged, "
+    f"{counts['duplicates']} duplicates skipped, {counts['invalid']} failed validation, "
+    f"{counts['resumed']} resumed from the journal (bottleneck: {pipeline.bottleneck()} stage)"
+  )
+  return counts
+
+
+class _HarvestState:
+  """State shared by the threads of a harvest."""
+
+  def __init__(self, completed, journal):
+    self.completed = completed
+    self.claimed = set(completed)
+    self.counts = {"stored": 0, "unchanged": 0, "duplicates": 0, "invalid": 0}
+    self.journal = journal
+    self.lock = threading.Lock()
+    # Per source: {page: [records in flight, all records listed]} and the next page to journal
+    self._pages = {}
+    self._next_page = {}
+    self.changes = None
+    self.run = None
+    self.parents = set()
+    self.progress = ProgressLog(logger, "Harvest progress", rate="stored")
+    # Statistics of the listed records, by ID
+    self.stats = {}
+
+  def track_changes(self, cache):
+    """Append the changes of the stored records to the change feed of `cache`."""
+    self.changes = cache.changes
+    self.run = utc_now()
+    self.parents = {entry.get("parent_id") for entry in cache.index.values()}
+
+  def record_change(self, record_id, previous, entry):
+    if self.changes is None:
+      return
+    with self.lock:
+      # The first version of a new concept stored in this harvest is the new record
+      change = describe_change(record_id, previous, entry, self.parents)
+      self.parents.add(entry.get("parent_id"))
+    if change is not None:
+      self.changes.append(change, run=self.run)
+
+  def add_stats(self, record):
+    row = stats_row(record)
+    if row is not None:
+      with self.lock:
+        self.stats[str(record["id"])] = row
+
+  def claim(self, record_id):
+    """Return True if `record_id` was not seen yet in this harvest (and claim it)."""
+    with self.lock:
+      if record_id in self.claimed:
+        if record_id not in self.completed:
+          self.counts["duplicates"] += 1
+        return False
+      self.claimed.add(record_id)
+      return True
+
+  def count(self, key):
+    with self.lock:
+      self.counts[key] += 1
+    self.progress.add(**{key: 1})
+
+  def page_started(self, name, page):
+    with self.lock:
+      self._pages.setdefault(name, {})[page] = [0, False]
+      self._next_page.setdefault(name, page)
+
+  def record_started(self, name, page):
+    with self.lock:
+      self._pages[name][page][0] += 1
+
+  def page_listed(self, name, page):
+    with self.lock:
+      self._pages[name][page][1] = True
+      self._journal_pages(name)
+
+  def record_done(self, name, page):
+    with self.lock:
+      self._pages[name][page][0] -= 1
+      self._journal_pages(name)
+
+  def _journal_pages(self, name):
+    # Pages are journaled in order, once all their records are stored, so
+    # that a resumed harvest never skips a page with unfinished records.
+    pages = self._pages[name]
+    page = self._next_page[name]
+    while page in pages and pages[page][1] and pages[page][0] == 0:
+      self.journal.page(page, source=name)
+      del pages[page]
+      page += 1
+    self._next_page[name] = page
+
+
+class _Harvest:
+  """The stage functions of a harvest pipeline."""
+
+  def __init__(self, api, cache, size, download_files, validator, state, on_record=None):
+    self.api = api
+    self.cache = cache
+    self.size = size
+    self.download_files = download_files
+    self.validator = validator
+    self.state = state
+    self.on_record = on_record
+    self.pipeline = None
+
+  def fetch(self, item):
+    """
+    List the pages of a source after its last completed page.
+
+    Each page is handed to `decode` as an open streamed response. Whether
+    there is a next page is known from the `links` and `total` at the end of
+    the response, so the next page is requested once `decode` has read it.
+    """
+    source, last_page = item
+    name = source_name(source)
+    page = last_page + 1
+    while not self.pipeline.stopped:
+      response = self.api.open_search_records(
+        source.get("community"), page=page, size=self.size, sort=HARVEST_SORT, query=source.get("query")
+      )
+      listing = {"response": response, "meta": {}, "read": threading.Event()}
+      try:
+        self.state.page_started(name, page)
+        yield name, page, listing
+        while not listing["read"].wait(POLL_INTERVAL):
+          if self.pipeline.stopped:
+            return
+      finally:
+        # A response dropped by a stopped pipeline is never read
+        if not listing["read"].is_set():
+          response.close()
+      if not listing.get("complete"):
+        return
+      meta = listing["meta"]
+      total = meta.get("total")
+      if meta["links"]:
+        if "next" not in meta["links"]:
+          break
+      elif total is None or page * self.size >= total:
+        break
+      page += 1
+
+  def decode(self, item):
+    """Decode the records of a page from its response stream, forwarding those that are new or changed."""
+    name, page, listing = item
+    listed = 0
+    response, meta = listing["response"], listing["meta"]
+    try:
+      records = self.cache.prepare_codec(self.api.iter_response_hits(response, meta))
+      for record in records:
+        listed += 1
+        self.state.add_stats(record)
+        if not self.state.claim(str(record["id"])):
+          continue
+        if not self.cache.claim_record(record["id"]):
+          # Stored by another partition of a sharded harvest (overlapping sources)
+          self.state.count("duplicates")
+          continue
+        if self.cache.is_current(record):
+          self.state.count("unchanged")
+          continue
+        self.state.record_started(name, page)
+        yield {"source": name, "page": page, "record": record}
+      listing["complete"] = True
+    finally:
+      response.close()
+      listing["read"].set()
+    self.state.page_listed(name, page)
+    logger.debug(f"Harvested page {page} of {name} ({listed} records)")
+
+  def project(self, item):
+    item["metadata"] = self.cache.project(item["record"])
+    yield item
+
+  def validate(self, item):
+    if self.validator is not None:
+      errors = self.validator(item["metadata"])
+      if errors:
+        self.state.count("invalid")
+        logger.warning(f"Record {item['record']['id']} metadata is not valid: {'; '.join(errors)}")
+    yield item
+
+  def store(self, item):
+    item["entry"] = self.cache.write(item["record"], item["metadata"])
+    yield item
+
+  def download(self, item):
+    record_id = str(item["record"]["id"])
+    entry = item["entry"]
+    if self.download_files:
+      self.cache.download_files(self.api, record_id, entry["files"])
+    # Appended before the record is journaled: a crash in between repeats the change, never loses it
+    self.state.record_change(record_id, self.cache.index.get(record_id), entry)
+    self.cache.index[record_id] = entry
+    self.state.journal.record(record_id, entry)
+    self.state.count("stored")
+    self.state.record_done(item["source"], item["page"])
+    if self.on_record is not None:
+      self.on_record(record_id, entry)
+    return ()
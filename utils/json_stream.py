@@ -0,0 +1,109 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+JSON decoding of API responses.
+
+Search responses carry up to 1000 full records (tens of MB). Instead of
+decoding the whole body before the first record can be stored, `iter_hits`
+decodes the hits one by one from the response stream with `ijson`, keeping a
+single record in memory. The search pages of a harvest (the decode stage
+reads the open response, see `ZenodoAPI.iter_response_hits`) and of
+`ZenodoAPI.iter_search_records` are streamed this way. Every other response
+is read whole and decoded by `loads`, with `orjson` when it is installed.
+Both packages are optional: without `ijson`, `iter_hits` reads the full body
+and decodes it with `loads`.
+"""
+
+import json
+import re
+
+try:
+  import ijson
+except ImportError:
+  ijson = None
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+HITS_PREFIX = "hits.hits.item"
+
+
+def loads(data):
+  """Decode a JSON document (bytes or str), with orjson when available."""
+  if orjson is not None:
+    return orjson.loads(data)
+  return json.loads(data)
+
+
+def iter_hits(stream, meta=None):
+  """
+  Decode the records of a search response one by one.
+
+  Args:
+    stream (file-like): Binary stream of the response body.
+    meta (dict, optional): Filled with `total` (hits.total) and `links` of the
+      response when the iteration ends (`links` is left empty if the
+      response has none).
+
+  Yields:
+    dict: The records of `hits.hits`, in order.
+  """
+  meta = meta if meta is not None else {}
+  meta["links"] = {}
+  if ijson is None:
+    response = loads(stream.read())
+    total = response.get("hits", {}).get("total")
+    meta["total"] = total.get("value") if isinstance(total, dict) else total
+    meta["links"] = response.get("links", {})
+    yield from response.get("hits", {}).get("hits", [])
+    return
+
+  # The hits are built by ijson's C backend; `total` and `links` follow them at
+  # the end of InvenioRDM search responses and are parsed from the last bytes read.
+  stream = _TailReader(stream)
+  yield from ijson.items(stream, HITS_PREFIX, use_float=True)
+  while stream.read(CHUNK_SIZE):
+    pass
+  meta.update(_parse_tail(stream.tail))
+
+
+CHUNK_SIZE = 64 * 1024
+TAIL_SIZE = 64 * 1024
+
+_TOTAL = re.compile(rb'"total"\s*:\s*(?:\{\s*"value"\s*:\s*)?(\d+)')
+_LINKS = re.compile(rb'"links"\s*:\s*')
+
+
+class _TailReader:
+  """File-like wrapper keeping the last bytes read from a stream."""
+
+  def __init__(self, stream):
+    self.stream = stream
+    self.tail = b""
+
+  def read(self, size=-1):
+    data = self.stream.read(size)
+    self.tail = (self.tail + data)[-TAIL_SIZE:]
+    return data
+
+
+def _parse_tail(tail):
+  """Parse `hits.total` and the top-level `links` from the end of a search response."""
+  meta = {}
+  totals = list(_TOTAL.finditer(tail))
+  if totals:
+    meta["total"] = int(totals[-1].group(1))
+  links = list(_LINKS.finditer(tail))
+  if links:
+    text = tail[links[-1].end():].decode("utf-8", "replace")
+    try:
+      value, end = json.JSONDecoder().raw_decode(text)
+    except ValueError:
+      value, end = None, 0
+    # The `links` of the last record are followed by the end of the hits array
+    if isinstance(value, dict) and "]" not in text[end:]:
+      meta["links"] = value
+  return meta
@@ -0,0 +1,284 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Library interface for using cf-zenodo from other Python programs.
+
+The objects take their configuration as arguments: nothing is read from
+`config/`, `.env` or the environment, no file is touched on import and
+logging is left to the application (the modules log to their own loggers,
+`harvest`, `zenodo_api`, ..., without configuring any handler). The CLI
+scripts, on the other hand, load the workspace settings and set up queued
+logging when they run (see `utils.config_utils.initialize_workspace`).
+
+  client = Client("https://zenodo.org/api", access_token=token)
+  cache = Cache("./records", template=template)
+  harvester = Harvester(client, cache, [{"community": "cfconventions"}], download_files=False)
+  for record_id, entry in harvester:
+    ...
+
+Listings are iterators: records are fetched, read from the cache or
+harvested as they are consumed. A harvest drives its own pipeline threads;
+iterating over a `Harvester` runs it in a background thread and yields the
+records as they are stored, and `Harvester.run` is a blocking call that
+services can hand to their thread pool or event loop
+(`loop.run_in_executor(None, harvester.run)`).
+"""
+
+import queue
+import threading
+
+from utils.harvest import harvest_sources
+from utils.pipeline import POLL_INTERVAL, QUEUE_SIZE
+from utils.record_cache import RecordCache
+from utils.zenodo_api import ZenodoAPI
+
+DEFAULT_BASE_URL = "https://zenodo.org/api"
+
+_DONE = object()
+
+
+class HarvestClosed(Exception):
+  """Raised in the harvest workers when the consumer of a `Harvester` iteration stops early."""
+
+
+class Client:
+  """
+  Zenodo (InvenioRDM) API client built from explicit settings.
+  """
+
+  def __init__(self, base_url=DEFAULT_BASE_URL, access_token=None, retry_attempts=3,
+               rate_limit_per_minute=None, pool_size=10, metrics=None, bandwidth_limit=None):
+    """
+    Initialize the client.
+
+    Args:
+      base_url (str, optional): Base URL of the API.
+      access_token (str, optional): Access token (public endpoints only if None).
+      retry_attempts (int, optional): Number of retries of throttled or failed idempotent requests.
+      rate_limit_per_minute (int, optional): Maximum number of requests per minute (unlimited by default).
+      pool_size (int, optional): Maximum number of pooled connections per host.
+      metrics (RequestMetrics, optional): Collector recording every request.
+      bandwidth_limit (float, optional): Maximum download rate of the files, in bytes per second.
+    """
+    self.api = ZenodoAPI(
+      base_url=base_url, access_token=access_token, retry_attempts=retry_attempts, metrics=metrics,
+      rate_limit_per_minute=rate_limit_per_minute, pool_size=pool_size, env=False,
+      bandwidth_limit=bandwidth_limit,
+    )
+
+  @classmethod
+  def from_config(cls, config):
+    """Build a client from a settings dict shaped like `config/zenodo_config.json`."""
+    return cls(
+      base_url=config.get("base_url") or DEFAULT_BASE_URL,
+      access_token=config.get("access_token"),
+      retry_attempts=config.get("retry_attempts", 3),
+      rate_limit_per_minute=config.get("rate_limit_per_minute"),
+      pool_size=config.get("pool_size", 10),
+      bandwidth_limit=config.get("bandwidth_limit"),
+    )
+
+  @property
+  def metrics(self):
+    return self.api.metrics
+
+  def record(self, record_id):
+    """Return a published record, or None if it cannot be fetched."""
+    return self.api.fetch_record(record_id)
+
+  def iter_records(self, community=None, query=None, size=100, sort=None):
+    """
+    Iterate over the records of a community and/or a search query, page by page.
+
+    Records are decoded one by one from each response: only one page is
+    requested at a time and only one record is held in memory.
+
+    Args:
+      community (str, optional): The community ID (all records if omitted).
+      query (str, optional): Search query (Elasticsearch query string syntax).
+      size (int, optional): Number of records per page.
+      sort (str, optional): Sort order (e.g. `oldest`, `newest`).
+
+    Yields:
+      dict: The records.
+
+    Raises:
+      requests.RequestException: If a request fails.
+    """
+    page = 1
+    while True:
+      meta = {}
+      listed = 0
+      for record in self.api.iter_search_records(community, page=page, size=size, sort=sort, query=query, meta=meta):
+        listed += 1
+        yield record
+      links, total = meta.get("links") or {}, meta.get("total")
+      if not listed or (links and "next" not in links) or (not links and (total is None or page * size >= total)):
+        return
+      page += 1
+
+
+class Cache:
+  """
+  Read access to a local record cache.
+  """
+
+  def __init__(self, path, template=None, compression=None):
+    """
+    Open the cache (created by the first harvest if it does not exist).
+
+    Args:
+      path (str): Directory of the cache.
+      template (dict, optional): Metadata template projecting the harvested records into `metadata.json`.
+      compression (str, optional): Codec of the records stored by harvests (`none`, `gzip`, `deflate`, `zstd`).
+    """
+    self.cache = RecordCache(path, template, compression=compression)
+
+  def __len__(self):
+    return len(self.cache.index)
+
+  def __contains__(self, record_id):
+    return str(record_id) in self.cache.index
+
+  def record_ids(self):
+    """Iterate over the IDs of the cached records, in order."""
+    return iter(sorted(self.cache.index))
+
+  def record(self, record_id):
+    """Return a cached record, or None if it is not cached."""
+    return self.cache.load_record(str(record_id))
+
+  def metadata(self, record_id):
+    """Return the projected metadata of a cached record, or None if it is not cached."""
+    return self.cache.load_metadata(str(record_id))
+
+  def iter_records(self, record_ids=None):
+    """
+    Iterate over cached records, read one at a time.
+
+    Args:
+      record_ids (iterable, optional): The records to read (all the cached records by default).
+
+    Yields:
+      dict: The records (records missing from the cache are skipped).
+    """
+    for record_id in (record_ids if record_ids is not None else self.record_ids()):
+      record = self.record(record_id)
+      if record is not None:
+        yield record
+
+  def iter_metadata(self, record_ids=None):
+    """
+    Iterate over the projected metadata of cached records.
+
+    Yields:
+      tuple: (record_id, metadata).
+    """
+    for record_id in (record_ids if record_ids is not None else self.record_ids()):
+      metadata = self.metadata(record_id)
+      if metadata is not None:
+        yield str(record_id), metadata
+
+  def iter_changes(self, since=None):
+    """Iterate over the changes found by the harvests at or after `since` (see `utils.changes`)."""
+    if not self.cache.changes.exists():
+      return iter(())
+    return self.cache.changes.read(since)
+
+
+class Harvester:
+  """
+  Harvest of communities/queries into a cache.
+  """
+
+  def __init__(self, client, cache, sources, size=1000, download_files=True, workers=4,
+               stage_workers=None, queue_size=QUEUE_SIZE, validator=None):
+    """
+    Initialize the harvest (see `utils.harvest.harvest_sources`).
+
+    Args:
+      client (Client): The API client.
+      cache (Cache): The cache to fill.
+      sources (list): Sources, each with a `community` and/or a `query` (and an optional `name`).
+      size (int, optional): Number of records per page.
+      download_files (bool, optional): Download the record files.
+      workers (int, optional): Number of sources listed concurrently.
+      stage_workers (dict, optional): Number of worker threads by pipeline stage.
+      queue_size (int, optional): Capacity of the pipeline queues (and of the iteration buffer).
+      validator (callable, optional): Returns the validation errors of projected metadata.
+    """
+    self.client = client
+    self.cache = cache
+    self.sources = list(sources)
+    self.options = {
+      "size": size, "download_files": download_files, "workers": workers,
+      "stage_workers": stage_workers, "queue_size": queue_size, "validator": validator,
+    }
+    self.report = None
+
+  def run(self, on_record=None):
+    """
+    Run the harvest, blocking until it completes.
+
+    Args:
+      on_record (callable, optional): Called with the ID and index entry of every stored record.
+
+    Returns:
+      dict: Counts of `stored`, `unchanged`, `duplicates`, `invalid` and `resumed` records.
+    """
+    self.report = harvest_sources(self.client.api, self.cache.cache, self.sources, on_record=on_record, **self.options)
+    return self.report
+
+  def __iter__(self):
+    """
+    Run the harvest in a background thread, yielding the records as they are stored.
+
+    Stopping the iteration early stops the harvest; it resumes from its
+    journal the next time it runs. Once the iteration ends, the counts are
+    in `report`.
+
+    Yields:
+      tuple: (record_id, index entry) of every stored record (unchanged records are not yielded).
+
+    Raises:
+      Exception: The error that stopped the harvest.
+    """
+    stored = queue.Queue(maxsize=self.options["queue_size"])
+    closed = threading.Event()
+    outcome = {}
+
+    def put(item):
+      while not closed.is_set():
+        try:
+          stored.put(item, timeout=POLL_INTERVAL)
+          return True
+        except queue.Full:
+          pass
+      return False
+
+    def on_record(record_id, entry):
+      if not put((record_id, entry)):
+        raise HarvestClosed("The harvest iteration was closed")
+
+    def run():
+      try:
+        self.run(on_record)
+      except BaseException as e:
+        outcome["error"] = e
+      finally:
+        put(_DONE)
+
+    thread = threading.Thread(target=run, name="harvester", daemon=True)
+    thread.start()
+    try:
+      while True:
+        item = stored.get()
+        if item is _DONE:
+          break
+        yield item
+      if "error" in outcome:
+        raise outcome["error"]
+    finally:
+      closed.set()
+      thread.join()
@@ -0,0 +1,308 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Checking of the outbound links of the cached records.
+
+The links of every cached record are extracted and resolved to URLs:
+
+  pids.doi                      https://doi.org/{doi}
+  metadata.identifiers          Alternate identifiers (doi, url, arxiv, handle, ark)
+  metadata.related_identifiers  Related identifiers (same schemes)
+  links.{LINK_KEYS}             The public landing pages of the record
+
+The other `links.*` (API endpoints, drafts, access requests) need
+authentication and are not checked. URLs are deduplicated across records and
+checked concurrently by an asyncio scheduler: at most `workers` requests are
+in flight, at most `per_host` to each host, paced by a token bucket per host.
+Each check sends a HEAD request (then a GET, without reading the body, when
+HEAD is refused) with `requests` from a thread pool, following redirects.
+
+Results are kept in `links.json` in the cache directory. A repeated run only
+checks again the links that failed or whose result is older than the TTL.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.logging_utils import ProgressLog
+from utils.rate_limit import RateLimiter
+from utils.record_cache import atomic_write_json
+
+logger = logging.getLogger("links")
+
+LINKS_FILE = "links.json"
+
+# Public landing pages among the `links` of a record
+LINK_KEYS = ("self_html", "doi", "parent_html", "parent_doi", "latest_html")
+
+# URL templates of the resolvable identifier schemes
+SCHEMES = {
+  "doi": "https://doi.org/{}",
+  "url": "{}",
+  "arxiv": "https://arxiv.org/abs/{}",
+  "handle": "https://hdl.handle.net/{}",
+  "ark": "https://n2t.net/{}",
+}
+
+# Results older than this (seconds) are checked again
+TTL = 7 * 24 * 3600
+
+WORKERS = 16
+PER_HOST = 2
+RATE_PER_HOST = 5.0
+TIMEOUT = 10
+
+# Statuses answered to HEAD by servers that only implement GET
+HEAD_REFUSED = (403, 404, 405, 501)
+
+# Longest Retry-After (seconds) honoured before reporting a throttled link as failing
+MAX_RETRY_AFTER = 30
+
+USER_AGENT = "cf-zenodo-link-checker (+https://github.com/cofinoa/cf-zenodo)"
+
+
+def identifier_url(scheme, identifier):
+  """
+  Resolve an identifier to a URL.
+
+  Returns:
+    str: The URL, or None if the scheme is not resolvable.
+  """
+  identifier = str(identifier or "").strip()
+  scheme = (scheme or "").lower()
+  if not identifier or scheme not in SCHEMES:
+    return None
+  if scheme == "url":
+    return identifier if urlsplit(identifier).scheme in ("http", "https") else None
+  if identifier.lower().startswith(("http://", "https://")):
+    return identifier
+  if scheme == "doi":
+    identifier = identifier[4:] if identifier.lower().startswith("doi:") else identifier
+  elif scheme == "arxiv":
+    identifier = identifier[6:] if identifier.lower().startswith("arxiv:") else identifier
+  return SCHEMES[scheme].format(identifier)
+
+
+def record_links(record):
+  """
+  Extract the outbound links of a record.
+
+  Returns:
+    dict: The URLs, with the fields they come from ({url: [field, ...]}).
+  """
+  links = {}
+
+  def add(url, field):
+    if url:
+      fields = links.setdefault(url, [])
+      if field not in fields:
+        fields.append(field)
+
+  doi = record.get("pids", {}).get("doi", {}).get("identifier")
+  add(identifier_url("doi", doi), "pids.doi")
+  metadata = record.get("metadata", {})
+  for field in ("identifiers", "related_identifiers"):
+    for identifier in metadata.get(field) or []:
+      add(identifier_url(identifier.get("scheme"), identifier.get("identifier")), f"metadata.{field}")
+  for key in LINK_KEYS:
+    url = record.get("links", {}).get(key)
+    if isinstance(url, str) and url.startswith(("http://", "https://")):
+      add(url, f"links.{key}")
+  return links
+
+
+def cache_links(cache):
+  """
+  Extract and deduplicate the outbound links of every cached record.
+
+  Returns:
+    dict: The URLs, with the records and fields referencing them ({url: [(record_id, field), ...]}).
+  """
+  links = {}
+  for record_id in sorted(cache.index):
+    record = cache.load_record(record_id)
+    if record is None:
+      continue
+    for url, fields in record_links(record).items():
+      links.setdefault(url, []).extend((record_id, field) for field in fields)
+  return links
+
+
+class LinkResults:
+  """
+  Results of the link checks (`links.json`), by URL.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.results = {}
+    if os.path.exists(path):
+      with open(path, "r") as f:
+        self.results = json.load(f)
+
+  def is_fresh(self, url, ttl=TTL, now=None):
+    """Return whether a link was checked successfully less than `ttl` seconds ago."""
+    result = self.results.get(url)
+    return bool(result and result["ok"] and (now or time.time()) - result["checked"] < ttl)
+
+  def save(self, urls=None):
+    """
+    Atomically write the results.
+
+    Args:
+      urls (iterable, optional): The links still referenced; the results of the others are dropped.
+    """
+    if urls is not None:
+      self.results = {url: self.results[url] for url in urls if url in self.results}
+    atomic_write_json(self.path, self.results, indent=None)
+
+
+class LinkChecker:
+  """
+  Concurrent link checker with per-host concurrency and rate limits.
+  """
+
+  def __init__(self, workers=WORKERS, per_host=PER_HOST, rate_per_host=RATE_PER_HOST, timeout=TIMEOUT):
+    """
+    Initialize the checker and its connection pool.
+
+    Args:
+      workers (int, optional): Maximum number of requests in flight.
+      per_host (int, optional): Maximum number of requests in flight to each host.
+      rate_per_host (float, optional): Maximum number of requests per second to each host (None disables it).
+      timeout (float, optional): Timeout of each request, in seconds.
+    """
+    self.workers = max(1, int(workers))
+    self.per_host = max(1, int(per_host))
+    self.rate_per_host = rate_per_host
+    self.timeout = timeout
+    self.session = requests.Session()
+    self.session.headers["User-Agent"] = USER_AGENT
+    adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+
+  def check_url(self, url):
+    """
+    Check a link: HEAD, then GET (without reading the body) if HEAD is refused.
+
+    Returns:
+      dict: `status` (None if no response), `ok`, `final_url`, `error`, `retry_after` and `checked` (epoch seconds).
+    """
+    result = {"status": None, "ok": False, "final_url": None, "error": None, "retry_after": None}
+    try:
+      response = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+      if response.status_code in HEAD_REFUSED:
+        response.close()
+        response = self.session.get(url, allow_redirects=True, timeout=self.timeout, stream=True)
+      response.close()
+      result.update(status=response.status_code, ok=response.status_code < 400, final_url=response.url)
+      if response.status_code in (429, 503):
+        retry_after = response.headers.get("Retry-After", "")
+        result["retry_after"] = float(retry_after) if retry_after.isdigit() else None
+    except requests.RequestException as e:
+      result["error"] = f"{type(e).__name__}: {e}"
+    result["checked"] = time.time()
+    return result
+
+  def check(self, urls):
+    """
+    Check links concurrently.
+
+    Args:
+      urls (list): The URLs to check.
+
+    Returns:
+      dict: The results by URL (see `check_url`).
+    """
+    return asyncio.run(self._check_all(list(urls)))
+
+  async def _check_all(self, urls):
+    loop = asyncio.get_running_loop()
+    in_flight = asyncio.Semaphore(self.workers)
+    hosts = {}
+    progress = ProgressLog(logger, "Link check", rate="links")
+
+    with ThreadPoolExecutor(max_workers=self.workers) as executor:
+
+      async def check(url):
+        host = urlsplit(url).netloc.lower()
+        if host not in hosts:
+          limiter = RateLimiter(self.rate_per_host, burst=1) if self.rate_per_host else None
+          hosts[host] = (asyncio.Semaphore(self.per_host), limiter)
+        host_slots, limiter = hosts[host]
+        # A throttled host is asked again once, after its Retry-After
+        for attempt in range(2):
+          async with host_slots:
+            if limiter is not None:
+              await asyncio.sleep(limiter.reserve())
+            async with in_flight:
+              result = await loop.run_in_executor(executor, self.check_url, url)
+            if attempt == 0 and result["retry_after"] is not None and result["retry_after"] <= MAX_RETRY_AFTER:
+              await asyncio.sleep(result["retry_after"])
+              continue
+          break
+        progress.add(links=1, **{"ok" if result["ok"] else "failed": 1})
+        return result
+
+      results = await asyncio.gather(*(check(url) for url in urls))
+
+    if urls:
+      logger.info(progress.line())
+    return dict(zip(urls, results))
+
+
+def check_cache_links(cache, checker, ttl=TTL, now=None):
+  """
+  Check the outbound links of the cached records, skipping the fresh results of previous runs.
+
+  Args:
+    cache (RecordCache): The cache.
+    checker (LinkChecker): The checker.
+    ttl (float, optional): Age (seconds) after which a successful result is checked again.
+    now (float, optional): Current epoch time (defaults to the clock).
+
+  Returns:
+    dict: Counts of `links` and links `checked` (the others are `cached`), the `broken` links
+      (url, status, error and the records referencing them), and `seconds`.
+  """
+  started = time.perf_counter()
+  links = cache_links(cache)
+  store = LinkResults(os.path.join(cache.output_dir, LINKS_FILE))
+  stale = [url for url in links if not store.is_fresh(url, ttl, now)]
+  try:
+    store.results.update(checker.check(stale))
+  finally:
+    store.save(links)
+
+  broken = []
+  for url, references in links.items():
+    result = store.results.get(url)
+    if result and not result["ok"]:
+      broken.append({
+        "url": url,
+        "status": result["status"],
+        "error": result["error"],
+        "records": [{"record_id": record_id, "field": field} for record_id, field in references],
+      })
+  report = {
+    "links": len(links),
+    "checked": len(stale),
+    "cached": len(links) - len(stale),
+    "broken": broken,
+    "seconds": time.perf_counter() - started,
+  }
+  logger.info(
+    f"Checked {report['checked']} of {report['links']} links ({report['cached']} fresh in {LINKS_FILE}) "
+    f"in {report['seconds']:.2f} s: {len(broken)} broken"
+  )
+  return report
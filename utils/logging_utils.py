@@ -0,0 +1,156 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Queued logging and aggregated progress lines.
+
+`setup_logging` applies `config/logging_config.json` and moves the handlers
+of the root logger behind a queue: a log call only enqueues the record, and a
+listener thread formats it and writes it to the terminal and the log file.
+Harvest threads therefore never block on disk or terminal writes.
+
+Worker processes forked by a command (sharded harvests, verify) inherit the
+configured handlers but not the listener thread, so they write to the
+handlers directly.
+
+Per-record events are counted by a `ProgressLog`, which logs one progress
+line every `PROGRESS_INTERVAL` seconds instead of one message per record.
+
+Importing the module changes nothing: the exit and fork hooks are only
+registered by the first `setup_logging` call, so that programs using the
+library (see `utils.library`) keep their own logging configuration.
+"""
+
+import atexit
+import json
+import logging
+import logging.config
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+DEFAULT_LOGGING_CONFIG = "config/logging_config.json"
+
+# Seconds between two progress lines
+PROGRESS_INTERVAL = 10.0
+
+_listener = None
+_hooks_registered = False
+
+
+def setup_logging(log_file=None, config_path=DEFAULT_LOGGING_CONFIG):
+  """
+  Configure logging from a `logging.config.dictConfig` file, with the root handlers behind a queue.
+
+  Args:
+    log_file (str, optional): Path of the log file, overriding the `filename` of the file handlers.
+    config_path (str, optional): The logging configuration (JSON).
+
+  Returns:
+    logging.handlers.QueueListener: The listener writing the queued records (stopped at exit).
+
+  Raises:
+    FileNotFoundError: If the configuration file does not exist.
+  """
+  global _listener, _hooks_registered
+  with open(config_path, "r") as f:
+    config = json.load(f)
+  for handler in config.get("handlers", {}).values():
+    if "filename" in handler:
+      if log_file:
+        handler["filename"] = log_file
+      log_dir = os.path.dirname(handler["filename"])
+      if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+
+  stop_logging()
+  logging.config.dictConfig(config)
+  root = logging.getLogger()
+  handlers = list(root.handlers)
+  for handler in handlers:
+    root.removeHandler(handler)
+  log_queue = queue.SimpleQueue()
+  root.addHandler(logging.handlers.QueueHandler(log_queue))
+  _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+  _listener.start()
+  if not _hooks_registered:
+    atexit.register(stop_logging)
+    if hasattr(os, "register_at_fork"):
+      os.register_at_fork(after_in_child=_unqueue_in_child)
+    _hooks_registered = True
+  return _listener
+
+
+def stop_logging():
+  """Write the queued records and stop the listener (if logging was set up)."""
+  global _listener
+  if _listener is not None:
+    _listener.stop()
+    _listener = None
+
+
+def _unqueue_in_child():
+  # The listener thread does not survive a fork: log to the handlers directly
+  global _listener
+  if _listener is None:
+    return
+  root = logging.getLogger()
+  for handler in list(root.handlers):
+    if isinstance(handler, logging.handlers.QueueHandler):
+      root.removeHandler(handler)
+  for handler in _listener.handlers:
+    root.addHandler(handler)
+  _listener = None
+
+
+def _format_count(name, value):
+  return f"{value / 1e6:.1f} MB" if name == "bytes" else f"{value} {name}"
+
+
+class ProgressLog:
+  """
+  Counts per-item events and logs them as one progress line per interval.
+
+  Thread-safe: the threads of a pipeline share one progress log.
+  """
+
+  def __init__(self, logger, label, rate=None, interval=PROGRESS_INTERVAL):
+    """
+    Initialize the progress log.
+
+    Args:
+      logger (logging.Logger): Logger of the progress lines.
+      label (str): Prefix of the progress lines (e.g. `Harvest`).
+      rate (str, optional): Counter whose rate per second is logged.
+      interval (float, optional): Seconds between two progress lines.
+    """
+    self.logger = logger
+    self.label = label
+    self.rate = rate
+    self.interval = interval
+    self.counts = {}
+    self.started = time.monotonic()
+    self._next = self.started + interval
+    self._lock = threading.Lock()
+
+  def add(self, **counts):
+    """Add to the counters, logging a progress line if the interval elapsed."""
+    now = time.monotonic()
+    with self._lock:
+      for name, value in counts.items():
+        self.counts[name] = self.counts.get(name, 0) + value
+      if now < self._next:
+        return
+      self._next = now + self.interval
+      line = self.line(now)
+    self.logger.info(line)
+
+  def line(self, now=None):
+    """Return the progress line of the current counts."""
+    elapsed = (now or time.monotonic()) - self.started
+    line = f"{self.label}: {', '.join(_format_count(name, value) for name, value in self.counts.items())} in {elapsed:.0f} s"
+    if self.rate is not None and elapsed > 0:
+      line += f" ({self.counts.get(self.rate, 0) / elapsed:.1f} {self.rate}/s)"
+    return line
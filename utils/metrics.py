@@ -0,0 +1,440 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Request-level instrumentation for the Zenodo API client.
+
+`RequestMetrics` is attached to the `requests.Session` used by `ZenodoAPI` as a
+response hook, so every HTTP call is recorded without touching the API methods:
+per-endpoint latency histograms, bytes transferred, retries and status codes.
+Cache lookups are recorded explicitly by the callers that own a cache.
+
+Snapshots can be written by pluggable exporters (Prometheus text file, JSON
+lines) and rendered as a summary table at the end of a run.
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("metrics")
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, math.inf)
+
+# Path segments that identify a single resource are collapsed so that all
+# calls to the same API endpoint are aggregated together.
+_ID_SEGMENT = re.compile(r"^\d+$|^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def endpoint_name(method, url, base_url=None):
+  """
+  Build a stable endpoint label (e.g. `GET records/{id}/files/{key}/content`) from a request.
+
+  Args:
+    method (str): HTTP method.
+    url (str): Full request URL.
+    base_url (str, optional): API base URL stripped from the path.
+
+  Returns:
+    str: The endpoint label.
+  """
+  path = urlsplit(url).path
+  if base_url:
+    base_path = urlsplit(base_url).path.rstrip("/")
+    if base_path and path.startswith(base_path):
+      path = path[len(base_path):]
+
+  segments = []
+  previous = None
+  for segment in path.strip("/").split("/"):
+    if previous == "files" and segment not in ("commit", "content"):
+      segment = "{key}"
+    elif _ID_SEGMENT.match(segment):
+      segment = "{id}"
+    segments.append(segment)
+    previous = segment
+  return f"{method.upper()} {'/'.join(segments)}"
+
+
+class EndpointStats:
+  """
+  Aggregated statistics for a single endpoint.
+  """
+
+  def __init__(self):
+    self.count = 0
+    self.latency_sum = 0.0
+    self.latency_max = 0.0
+    self.buckets = [0] * len(LATENCY_BUCKETS)
+    self.bytes_in = 0
+    self.bytes_out = 0
+    self.retries = 0
+    self.status_codes = Counter()
+
+  def observe(self, elapsed, status, bytes_in, bytes_out, retries):
+    self.count += 1
+    self.latency_sum += elapsed
+    self.latency_max = max(self.latency_max, elapsed)
+    for i, bound in enumerate(LATENCY_BUCKETS):
+      if elapsed <= bound:
+        self.buckets[i] += 1
+        break
+    self.bytes_in += bytes_in
+    self.bytes_out += bytes_out
+    self.retries += retries
+    self.status_codes[str(status)] += 1
+
+  def quantile(self, q):
+    """Approximate a latency quantile from the histogram (upper bucket bound)."""
+    if not self.count:
+      return 0.0
+    rank = q * self.count
+    seen = 0
+    for bound, n in zip(LATENCY_BUCKETS, self.buckets):
+      seen += n
+      if seen >= rank:
+        return min(bound, self.latency_max)
+    return self.latency_max
+
+  def as_dict(self):
+    return {
+      "count": self.count,
+      "latency_sum": self.latency_sum,
+      "latency_max": self.latency_max,
+      "latency_p50": self.quantile(0.5),
+      "latency_p95": self.quantile(0.95),
+      "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS], self.buckets)),
+      "bytes_in": self.bytes_in,
+      "bytes_out": self.bytes_out,
+      "retries": self.retries,
+      "status_codes": dict(self.status_codes),
+    }
+
+
+class RequestMetrics:
+  """
+  Thread-safe collector of request and cache metrics.
+  """
+
+  def __init__(self, base_url=None):
+    """
+    Initialize the collector.
+
+    Args:
+      base_url (str, optional): API base URL, stripped from endpoint labels.
+    """
+    self.base_url = base_url
+    self.started = time.time()
+    self._lock = threading.Lock()
+    self._endpoints = {}
+    self._cache = Counter()
+    self._stages = {}
+
+  def observe(self, endpoint, elapsed, status, bytes_in=0, bytes_out=0, retries=0):
+    """
+    Record a completed request.
+
+    Args:
+      endpoint (str): Endpoint label (see `endpoint_name`).
+      elapsed (float): Latency in seconds.
+      status (int | str): HTTP status code, or an error label for failed requests.
+      bytes_in (int, optional): Response body size.
+      bytes_out (int, optional): Request body size.
+      retries (int, optional): Number of retries performed before this response.
+    """
+    with self._lock:
+      stats = self._endpoints.get(endpoint)
+      if stats is None:
+        stats = self._endpoints[endpoint] = EndpointStats()
+      stats.observe(elapsed, status, bytes_in, bytes_out, retries)
+
+  def add_bytes(self, endpoint, bytes_in=0, bytes_out=0):
+    """Account for body bytes streamed after the response hook ran."""
+    with self._lock:
+      stats = self._endpoints.get(endpoint)
+      if stats is None:
+        stats = self._endpoints[endpoint] = EndpointStats()
+      stats.bytes_in += bytes_in
+      stats.bytes_out += bytes_out
+
+  def record_cache_lookup(self, hit, cache="records"):
+    """Record a cache hit or miss for the given cache name."""
+    with self._lock:
+      self._cache[(cache, "hit" if hit else "miss")] += 1
+
+  def record_stage(self, stage, stats):
+    """
+    Record the statistics of a pipeline stage (see `utils.pipeline`), adding to previous runs.
+
+    Args:
+      stage (str): Stage name.
+      stats (dict): Stage statistics (`workers`, `items_in`, `items_out`, `busy_seconds`,
+        `starved_seconds`, `blocked_seconds`, `max_queue`, `queue_size`, `utilization`).
+    """
+    with self._lock:
+      previous = self._stages.get(stage)
+      if previous is None:
+        self._stages[stage] = dict(stats)
+        return
+      for key in ("items_in", "items_out", "busy_seconds", "starved_seconds", "blocked_seconds"):
+        previous[key] += stats[key]
+      previous["max_queue"] = max(previous["max_queue"], stats["max_queue"])
+      previous["utilization"] = max(previous["utilization"], stats["utilization"])
+
+  def response_hook(self, response, *args, **kwargs):
+    """
+    `requests` response hook recording the response in the collector.
+
+    Streamed bodies are not consumed; their size is taken from `Content-Length`.
+    """
+    request = response.request
+    endpoint = endpoint_name(request.method, request.url, self.base_url)
+
+    if kwargs.get("stream"):
+      bytes_in = int(response.headers.get("Content-Length") or 0)
+    else:
+      bytes_in = len(response.content or b"")
+
+    body = request.body
+    # Streamed uploads (file bodies) are sized from their Content-Length
+    bytes_out = len(body) if isinstance(body, (bytes, str)) else int(request.headers.get("Content-Length") or 0)
+
+    retries = 0
+    history = getattr(getattr(response.raw, "retries", None), "history", None)
+    if history:
+      retries = len(history)
+
+    self.observe(endpoint, response.elapsed.total_seconds(), response.status_code, bytes_in, bytes_out, retries)
+    return response
+
+  def snapshot(self):
+    """
+    Return a JSON-serializable snapshot of all metrics.
+
+    Returns:
+      dict: Endpoint statistics and cache counters.
+    """
+    with self._lock:
+      endpoints = {name: stats.as_dict() for name, stats in self._endpoints.items()}
+      stages = {name: dict(stats) for name, stats in self._stages.items()}
+      caches = {}
+      for (cache, outcome), n in self._cache.items():
+        caches.setdefault(cache, {"hit": 0, "miss": 0})[outcome] = n
+
+    for counts in caches.values():
+      total = counts["hit"] + counts["miss"]
+      counts["hit_rate"] = counts["hit"] / total if total else 0.0
+
+    return {
+      "timestamp": time.time(),
+      "elapsed": time.time() - self.started,
+      "endpoints": endpoints,
+      "caches": caches,
+      "stages": stages,
+    }
+
+
+class PrometheusExporter:
+  """
+  Write metrics in the Prometheus text exposition format (node_exporter textfile collector).
+  """
+
+  def __init__(self, path, prefix="cf_zenodo"):
+    self.path = path
+    self.prefix = prefix
+
+  def export(self, snapshot):
+    p = self.prefix
+    lines = [
+      f"# HELP {p}_request_duration_seconds Zenodo API request latency.",
+      f"# TYPE {p}_request_duration_seconds histogram",
+    ]
+    for endpoint, stats in sorted(snapshot["endpoints"].items()):
+      label = _prometheus_label(endpoint)
+      cumulative = 0
+      for bound, n in stats["buckets"].items():
+        cumulative += n
+        le = "+Inf" if bound == "inf" else bound
+        lines.append(f'{p}_request_duration_seconds_bucket{{endpoint="{label}",le="{le}"}} {cumulative}')
+      lines.append(f'{p}_request_duration_seconds_sum{{endpoint="{label}"}} {stats["latency_sum"]}')
+      lines.append(f'{p}_request_duration_seconds_count{{endpoint="{label}"}} {stats["count"]}')
+
+    for name, key, help_text in (
+      ("response_bytes_total", "bytes_in", "Bytes received from the Zenodo API."),
+      ("request_bytes_total", "bytes_out", "Bytes sent to the Zenodo API."),
+      ("request_retries_total", "retries", "Retried Zenodo API requests."),
+    ):
+      lines.append(f"# HELP {p}_{name} {help_text}")
+      lines.append(f"# TYPE {p}_{name} counter")
+      for endpoint, stats in sorted(snapshot["endpoints"].items()):
+        lines.append(f'{p}_{name}{{endpoint="{_prometheus_label(endpoint)}"}} {stats[key]}')
+
+    lines.append(f"# HELP {p}_responses_total Zenodo API responses by status code.")
+    lines.append(f"# TYPE {p}_responses_total counter")
+    for endpoint, stats in sorted(snapshot["endpoints"].items()):
+      for status, n in sorted(stats["status_codes"].items()):
+        lines.append(f'{p}_responses_total{{endpoint="{_prometheus_label(endpoint)}",status="{status}"}} {n}')
+
+    lines.append(f"# HELP {p}_cache_lookups_total Local cache lookups by outcome.")
+    lines.append(f"# TYPE {p}_cache_lookups_total counter")
+    for cache, counts in sorted(snapshot["caches"].items()):
+      for outcome in ("hit", "miss"):
+        lines.append(f'{p}_cache_lookups_total{{cache="{cache}",outcome="{outcome}"}} {counts[outcome]}')
+
+    stages = snapshot.get("stages", {})
+    for name, key, kind, help_text in (
+      ("stage_items_total", "items_in", "counter", "Items processed by each harvest pipeline stage."),
+      ("stage_busy_seconds_total", "busy_seconds", "counter", "Time spent working by each pipeline stage."),
+      ("stage_starved_seconds_total", "starved_seconds", "counter", "Time each pipeline stage waited for input."),
+      ("stage_blocked_seconds_total", "blocked_seconds", "counter", "Time each pipeline stage waited on a full downstream queue."),
+      ("stage_utilization", "utilization", "gauge", "Busy fraction of the workers of each pipeline stage."),
+    ):
+      if not stages:
+        break
+      lines.append(f"# HELP {p}_{name} {help_text}")
+      lines.append(f"# TYPE {p}_{name} {kind}")
+      for stage, stats in sorted(stages.items()):
+        lines.append(f'{p}_{name}{{stage="{_prometheus_label(stage)}"}} {stats[key]}')
+
+    # Write to a temporary file first so the collector never reads a partial file
+    tmp_path = f"{self.path}.tmp"
+    with open(tmp_path, "w") as f:
+      f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, self.path)
+
+
+class JSONLinesExporter:
+  """
+  Append one JSON snapshot per export to a JSON lines file.
+  """
+
+  def __init__(self, path):
+    self.path = path
+
+  def export(self, snapshot):
+    with open(self.path, "a") as f:
+      f.write(json.dumps(snapshot) + "\n")
+
+
+# Exporters selectable by name from the settings (see `build_exporters`)
+EXPORTERS = {
+  "prometheus": PrometheusExporter,
+  "jsonl": JSONLinesExporter,
+}
+
+
+def _prometheus_label(value):
+  return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def build_exporters(settings):
+  """
+  Instantiate the exporters configured as `{"<exporter name>": "<output path>"}`.
+
+  Args:
+    settings (dict): Mapping from exporter name to output path.
+
+  Returns:
+    list: Exporter instances exposing `export(snapshot)`.
+  """
+  exporters = []
+  for name, path in (settings or {}).items():
+    if not path:
+      continue
+    if name not in EXPORTERS:
+      logger.warning(f"Unknown metrics exporter '{name}'. Available exporters: {', '.join(EXPORTERS)}")
+      continue
+    directory = os.path.dirname(path)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    exporters.append(EXPORTERS[name](path))
+  return exporters
+
+
+def export_metrics(metrics, exporters):
+  """Export a snapshot of `metrics` with every exporter, logging (not raising) failures."""
+  snapshot = metrics.snapshot()
+  for exporter in exporters:
+    try:
+      exporter.export(snapshot)
+      logger.info(f"Metrics exported to {exporter.path}")
+    except Exception as e:
+      logger.error(f"Failed to export metrics to {exporter.path}: {e}", exc_info=True)
+  return snapshot
+
+
+def _format_bytes(n):
+  for unit in ("B", "KB", "MB", "GB"):
+    if n < 1024 or unit == "GB":
+      return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+    n /= 1024
+
+
+def _format_table(header, rows):
+  widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+  lines = ["  ".join(cell.ljust(w) for cell, w in zip(header, widths)).rstrip()]
+  lines.append("  ".join("-" * w for w in widths))
+  lines.extend("  ".join(cell.ljust(w) for cell, w in zip(row, widths)).rstrip() for row in rows)
+  return "\n".join(lines)
+
+
+def format_summary(snapshot):
+  """
+  Render a snapshot as a plain-text summary table.
+
+  Args:
+    snapshot (dict): Output of `RequestMetrics.snapshot`.
+
+  Returns:
+    str: The summary table.
+  """
+  header = ("Endpoint", "Calls", "Mean", "p50", "p95", "Max", "Received", "Sent", "Retries", "Status")
+  rows = []
+  for endpoint, s in sorted(snapshot["endpoints"].items(), key=lambda item: -item[1]["latency_sum"]):
+    mean = s["latency_sum"] / s["count"] if s["count"] else 0.0
+    statuses = " ".join(f"{code}:{n}" for code, n in sorted(s["status_codes"].items()))
+    rows.append((
+      endpoint, str(s["count"]), f"{mean:.3f}s", f"{s['latency_p50']:.3f}s", f"{s['latency_p95']:.3f}s",
+      f"{s['latency_max']:.3f}s", _format_bytes(s["bytes_in"]), _format_bytes(s["bytes_out"]),
+      str(s["retries"]), statuses,
+    ))
+
+  table = _format_table(header, rows) if rows else "No API requests recorded."
+
+  for cache, counts in sorted(snapshot["caches"].items()):
+    table += f"\nCache '{cache}': {counts['hit']} hits, {counts['miss']} misses ({counts['hit_rate']:.1%} hit rate)"
+
+  stages = snapshot.get("stages", {})
+  if stages:
+    bottleneck = max(stages, key=lambda name: stages[name]["utilization"])
+    header = ("Stage", "Workers", "Items", "Busy", "Starved", "Blocked", "Max queue", "Utilization")
+    rows = [(
+      name + (" *" if name == bottleneck else ""), str(s["workers"]), str(s["items_in"]), f"{s['busy_seconds']:.2f}s",
+      f"{s['starved_seconds']:.2f}s", f"{s['blocked_seconds']:.2f}s", f"{s['max_queue']}/{s['queue_size']}",
+      f"{s['utilization']:.0%}",
+    ) for name, s in stages.items()]
+    table += "\nPipeline stages (* bottleneck):\n" + _format_table(header, rows)
+  return table
+
+
+def report_metrics(metrics, exporter_settings=None):
+  """
+  Export the collected metrics with the configured exporters and log the summary table.
+
+  Args:
+    metrics (RequestMetrics): The collector to report.
+    exporter_settings (dict, optional): Exporter configuration (see `build_exporters`).
+
+  Returns:
+    dict: The exported snapshot.
+  """
+  snapshot = export_metrics(metrics, build_exporters(exporter_settings))
+  logger.info(f"Request summary:\n{format_summary(snapshot)}")
+  return snapshot
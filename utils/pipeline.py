@@ -0,0 +1,234 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Staged pipeline of worker threads connected by bounded queues.
+
+Each stage runs its own number of workers. A full queue blocks the upstream
+stage (backpressure), so memory stays bounded by the queue sizes, and
+network waits in one stage overlap with CPU work in the others. When a stage
+fails, it and the stages upstream stop, while the downstream stages finish
+the items already handed to them.
+
+For every stage the pipeline measures the time its workers spend working
+(busy), waiting for input (starved) and waiting for room downstream
+(blocked): the stage with the highest utilization is the bottleneck.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger("pipeline")
+
+# Default capacity of the queue in front of each stage
+QUEUE_SIZE = 64
+
+# Seconds between checks of the stop flag while waiting on a queue
+POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+
+class Stage:
+  """
+  A pipeline stage: `func(item)` returns an iterable of items for the next stage (or None).
+  """
+
+  def __init__(self, name, func, workers=1, queue_size=QUEUE_SIZE):
+    """
+    Initialize the stage.
+
+    Args:
+      name (str): Stage name (used in metrics).
+      func (callable): Called with each input item; returns (or yields) the output items.
+      workers (int, optional): Number of worker threads.
+      queue_size (int, optional): Capacity of the input queue of the stage.
+    """
+    self.name = name
+    self.func = func
+    self.workers = max(1, int(workers))
+    self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+    self.items_in = 0
+    self.items_out = 0
+    self.busy = 0.0
+    self.starved = 0.0
+    self.blocked = 0.0
+    self.max_queue = 0
+    self._lock = threading.Lock()
+    self._running = self.workers
+
+  def stats(self, elapsed):
+    """Return the stage statistics for a run of `elapsed` seconds."""
+    capacity = elapsed * self.workers
+    return {
+      "workers": self.workers,
+      "items_in": self.items_in,
+      "items_out": self.items_out,
+      "busy_seconds": self.busy,
+      "starved_seconds": self.starved,
+      "blocked_seconds": self.blocked,
+      "max_queue": self.max_queue,
+      "queue_size": self.queue.maxsize,
+      "utilization": self.busy / capacity if capacity else 0.0,
+    }
+
+
+class Pipeline:
+  """
+  Run items through a chain of stages.
+  """
+
+  def __init__(self, stages, metrics=None):
+    """
+    Initialize the pipeline.
+
+    Args:
+      stages (list): The `Stage` objects, in order.
+      metrics (RequestMetrics, optional): Collector receiving the stage statistics after a run.
+    """
+    self.stages = stages
+    self.metrics = metrics
+    self.elapsed = 0.0
+    # Stages up to this index are stopped (-1 is the feeder)
+    self._stop_level = -2
+    self._error = None
+    self._lock = threading.Lock()
+
+  @property
+  def stopped(self):
+    """True once a stage failed (stages may check it to stop long-running work early)."""
+    return self._stop_level >= -1
+
+  def _stopped(self, index):
+    return index <= self._stop_level
+
+  def _fail(self, error, index):
+    """
+    Record a failure of stage `index`: it and the upstream stages stop, while the
+    downstream stages finish the items already handed to them.
+    """
+    with self._lock:
+      if self._error is None:
+        self._error = error
+      self._stop_level = max(self._stop_level, index)
+
+  def _put(self, index, item):
+    """Put an item on the queue of stage `index + 1`, waiting for room unless stage `index` is stopped."""
+    target = self.stages[index + 1]
+    while not self._stopped(index):
+      try:
+        target.queue.put(item, timeout=POLL_INTERVAL)
+        return True
+      except queue.Full:
+        continue
+    return False
+
+  def _done(self, index):
+    """Tell the workers of stage `index + 1` that their input is exhausted."""
+    target = self.stages[index + 1]
+    for _ in range(target.workers):
+      while True:
+        try:
+          target.queue.put(_DONE, timeout=POLL_INTERVAL)
+          break
+        except queue.Full:
+          # A stopped downstream stage no longer consumes its queue
+          if self._stopped(index + 1):
+            return
+
+  def _feed(self, items):
+    try:
+      for item in items:
+        if not self._put(-1, item):
+          return
+    except BaseException as e:
+      self._fail(e, -1)
+    finally:
+      self._done(-1)
+
+  def _work(self, index):
+    stage = self.stages[index]
+    last_stage = index + 1 == len(self.stages)
+    try:
+      while not self._stopped(index):
+        waited = time.perf_counter()
+        try:
+          item = stage.queue.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+          stage_wait = time.perf_counter() - waited
+          with stage._lock:
+            stage.starved += stage_wait
+          continue
+        started = time.perf_counter()
+        with stage._lock:
+          stage.starved += started - waited
+          stage.max_queue = max(stage.max_queue, min(stage.queue.qsize() + 1, stage.queue.maxsize))
+        if item is _DONE:
+          return
+
+        blocked = 0.0
+        outputs = 0
+        for output in stage.func(item) or ():
+          outputs += 1
+          if not last_stage:
+            put_started = time.perf_counter()
+            if not self._put(index, output):
+              return
+            blocked += time.perf_counter() - put_started
+        with stage._lock:
+          stage.items_in += 1
+          stage.items_out += outputs
+          stage.blocked += blocked
+          stage.busy += time.perf_counter() - started - blocked
+    except BaseException as e:
+      self._fail(e, index)
+    finally:
+      with stage._lock:
+        stage._running -= 1
+        last_worker = stage._running == 0
+      # The last worker of a stage tells the workers of the next stage that the input is exhausted
+      if last_worker and not last_stage:
+        self._done(index)
+
+  def run(self, items):
+    """
+    Run `items` through the pipeline and wait until every stage is done.
+
+    Raises:
+      Exception: The first error raised by a stage, once the downstream stages are drained.
+    """
+    started = time.perf_counter()
+    threads = [threading.Thread(target=self._feed, args=(items,), name="pipeline-feed", daemon=True)]
+    for index, stage in enumerate(self.stages):
+      threads.extend(
+        threading.Thread(target=self._work, args=(index,), name=f"pipeline-{stage.name}-{n}", daemon=True)
+        for n in range(stage.workers)
+      )
+    for thread in threads:
+      thread.start()
+    try:
+      for thread in threads:
+        thread.join()
+    except BaseException as e:
+      # e.g. KeyboardInterrupt: stop every stage before leaving
+      self._fail(e, len(self.stages))
+      for thread in threads:
+        thread.join()
+    self.elapsed = time.perf_counter() - started
+
+    if self.metrics is not None:
+      for stage in self.stages:
+        self.metrics.record_stage(stage.name, stage.stats(self.elapsed))
+    if self._error is not None:
+      raise self._error
+
+  def stats(self):
+    """Return the statistics of every stage, by name."""
+    return {stage.name: stage.stats(self.elapsed) for stage in self.stages}
+
+  def bottleneck(self):
+    """Return the name of the stage with the highest utilization."""
+    stats = self.stats()
+    return max(stats, key=lambda name: stats[name]["utilization"]) if stats else None
@@ -0,0 +1,272 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Profiling support for the command line scripts.
+
+`profile_command` runs a command under cProfile and tracemalloc and writes,
+next to the configured log file, the raw `.pstats` dump and a text report
+attributing the time to harvest phases plus the top memory allocation sites.
+The phases are assigned by qualified module and function name:
+
+  network     Sockets, TLS, HTTP (`http.client`, `urllib3`, `requests`) and backoff sleeps
+  wait        Threads waiting on locks and queues (idle pipeline stages and pool workers)
+  decode      JSON decoding (`utils.json_stream`, `ijson`, `orjson.loads`, `json`)
+  projection  `RecordCache.project` and the functions it calls
+  write       JSON encoding of the cached files and file system calls
+  processing  Other functions of the project
+  other       Everything else
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger("profiling")
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Phases of qualified function names (`module.function`, `module.Class.method`
+# for methods of builtin types). A name matches a module, a class or a
+# function as a whole: `select` matches `select.poll` but not `utils.rules._select`.
+# Names are checked in order; retry backoff sleeps count as network wait.
+PHASE_NAMES = (
+  ("network", (
+    "socket", "_socket", "ssl", "_ssl", "select", "selectors", "http.client", "urllib3", "requests", "time.sleep",
+  )),
+  ("wait", ("_thread.lock", "_thread.RLock", "threading", "queue")),
+  ("decode", (
+    "utils.json_stream", "ijson", "orjson.loads", "json.load", "json.loads", "json.decoder", "json.scanner",
+    "_json.scanstring", "_json.Scanner",
+  )),
+  ("write", (
+    "orjson.dumps", "json.dump", "json.dumps", "json.encoder", "_json.encode_basestring",
+    "_json.encode_basestring_ascii", "_json.Encoder", "_io.BufferedWriter", "_io.TextIOWrapper", "_io.FileIO",
+    "_io._IOBase", "io.open", "posix", "shutil", "gzip", "tempfile",
+  )),
+)
+
+# Own time of this function and of the functions it calls counts as projection
+PROJECTION = "utils.record_cache.RecordCache.project"
+
+PHASES = ("network", "wait", "decode", "projection", "write", "processing", "other")
+
+_BUILTIN_FUNCTION = re.compile(r"^<built-in method ([\w.]+)>$")
+_BUILTIN_METHOD = re.compile(r"^<method '(\w+)' of '([\w.]+)' objects>$")
+
+
+def _module_name(filename):
+  """Return the dotted module name of a source file (None if it is not on the path)."""
+  if filename.startswith("<frozen "):
+    return filename[len("<frozen "):-1]
+  path = os.path.abspath(filename)
+  roots = [PROJECT_ROOT] + [os.path.abspath(entry) for entry in sys.path if entry]
+  root = max((root for root in roots if path.startswith(root + os.sep)), key=len, default=None)
+  if root is None:
+    return None
+  parts = os.path.splitext(os.path.relpath(path, root))[0].split(os.sep)
+  if parts[-1] == "__init__":
+    parts.pop()
+  return ".".join(parts)
+
+
+def qualified_name(filename, func):
+  """
+  Return the qualified name of a profiled function (`module.function`).
+
+  Args:
+    filename (str): The file of the function (`~` for builtins), from its `pstats` key.
+    func (str): The function name, from its `pstats` key.
+
+  Returns:
+    str: The name, or `func` if its module is unknown.
+  """
+  if filename == "~":
+    match = _BUILTIN_FUNCTION.match(func)
+    if match:
+      return match.group(1)
+    match = _BUILTIN_METHOD.match(func)
+    if match:
+      owner = match.group(2)
+      return f"{owner if '.' in owner else 'builtins.' + owner}.{match.group(1)}"
+    return func
+  module = _module_name(filename)
+  if module is None:
+    return func
+  if module == "utils.record_cache" and func in ("project", "RecordCache.project"):
+    return PROJECTION
+  return f"{module}.{func}"
+
+
+def _matches(name, prefix):
+  return name == prefix or name.startswith(prefix + ".")
+
+
+def classify(filename, func):
+  """Return the phase a profiled function belongs to (`other` if none matches)."""
+  name = qualified_name(filename, func)
+  if _matches(name, PROJECTION):
+    return "projection"
+  for phase, prefixes in PHASE_NAMES:
+    if any(_matches(name, prefix) for prefix in prefixes):
+      return phase
+  if filename != "~" and os.path.abspath(filename).startswith(PROJECT_ROOT + os.sep):
+    return "processing"
+  return "other"
+
+
+def projection_shares(stats):
+  """
+  Return the share of the own time of each function spent in calls under `PROJECTION`.
+
+  The own time of a function is split between its callers (`pstats`
+  records it per calling function); the share of a caller is propagated to
+  its callees, so that shared helpers only count their projection calls.
+  """
+  callees = {}
+  for func, (_, _, _, _, callers) in stats.stats.items():
+    for caller in callers:
+      callees.setdefault(caller, []).append(func)
+  shares = {func: 1.0 for func in stats.stats if qualified_name(func[0], func[2]) == PROJECTION}
+  descendants, pending = [], list(shares)
+  while pending:
+    for callee in callees.get(pending.pop(), ()):
+      if callee not in shares and callee not in descendants:
+        descendants.append(callee)
+        pending.append(callee)
+  # Recursive calls converge over the iterations
+  for _ in range(50):
+    changed = False
+    for func in descendants:
+      tottime, callers = stats.stats[func][2], stats.stats[func][4]
+      if not tottime:
+        continue
+      share = min(1.0, sum(edge[2] * shares.get(caller, 0.0) for caller, edge in callers.items()) / tottime)
+      if abs(share - shares.get(func, 0.0)) > 1e-9:
+        shares[func] = share
+        changed = True
+    if not changed:
+      break
+  return shares
+
+
+def phase_breakdown(stats):
+  """
+  Attribute profiled time to phases.
+
+  Args:
+    stats (pstats.Stats): The profile statistics.
+
+  Returns:
+    dict: Seconds spent in each phase.
+  """
+  phases = dict.fromkeys(PHASES, 0.0)
+  shares = projection_shares(stats)
+  for (filename, line, func), (_, _, tottime, _, _) in stats.stats.items():
+    share = shares.get((filename, line, func), 0.0)
+    phases["projection"] += tottime * share
+    phases[classify(filename, func)] += tottime * (1 - share)
+  return phases
+
+
+def profile_paths(label, log_file):
+  """Return the `.pstats` and report paths for a profiled run next to `log_file`."""
+  log_dir = os.path.dirname(log_file) or "."
+  os.makedirs(log_dir, exist_ok=True)
+  stem = os.path.join(log_dir, f"profile-{label}-{time.strftime('%Y%m%d-%H%M%S')}")
+  return f"{stem}.pstats", f"{stem}.txt"
+
+
+def write_report(report_path, label, wall_time, stats, memory_snapshot, peak_memory, top=25):
+  """Write the human-readable profile report."""
+  total = sum(phase_breakdown(stats).values()) or 1.0
+  with open(report_path, "w") as f:
+    f.write(f"Profile of '{label}'\n")
+    f.write(f"Wall time: {wall_time:.3f}s\n\n")
+
+    f.write("Time by phase (own time of profiled functions, summed over threads):\n")
+    for phase, seconds in sorted(phase_breakdown(stats).items(), key=lambda item: -item[1]):
+      f.write(f"  {phase:<12} {seconds:10.3f}s  {seconds / total:6.1%}\n")
+
+    f.write(f"\nPeak traced memory: {peak_memory / 1024 / 1024:.1f} MB\n")
+    f.write("Top allocation sites:\n")
+    for stat in memory_snapshot.statistics("lineno")[:10]:
+      f.write(f"  {stat}\n")
+
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats("cumulative").print_stats(top)
+    f.write(f"\nTop {top} functions by cumulative time:\n")
+    f.write(stream.getvalue())
+
+
+class _ThreadProfilers:
+  """
+  Profilers of the threads started during a profiled run (harvest stages, worker pools).
+
+  cProfile only profiles the thread that enables it: the hook installed with
+  `threading.setprofile` runs first in every new thread and enables a
+  profiler of its own there.
+  """
+
+  def __init__(self):
+    self.profilers = []
+    self.lock = threading.Lock()
+
+  def hook(self, frame, event, arg):
+    profiler = cProfile.Profile()
+    with self.lock:
+      self.profilers.append(profiler)
+    profiler.enable()
+
+
+@contextmanager
+def profile_command(label, log_file, enabled=True):
+  """
+  Profile the enclosed block and write the report next to `log_file`.
+
+  The threads started by the block are profiled too, and their statistics
+  merged (the own time of functions running concurrently adds up). The report
+  is written even if the block exits with `sys.exit()` or an error.
+
+  Args:
+    label (str): Name of the profiled command (used in the file names).
+    log_file (str): The configured log file; reports are written in its directory.
+    enabled (bool, optional): Run the block without profiling when False.
+  """
+  if not enabled:
+    yield
+    return
+
+  pstats_path, report_path = profile_paths(label, log_file)
+  profiler = cProfile.Profile()
+  threads = _ThreadProfilers()
+  tracemalloc.start()
+  started = time.perf_counter()
+  threading.setprofile(threads.hook)
+  profiler.enable()
+  try:
+    yield
+  finally:
+    profiler.disable()
+    threading.setprofile(None)
+    wall_time = time.perf_counter() - started
+    memory_snapshot = tracemalloc.take_snapshot()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = pstats.Stats(profiler)
+    with threads.lock:
+      for thread_profiler in threads.profilers:
+        stats.add(thread_profiler)
+    stats.dump_stats(pstats_path)
+    write_report(report_path, label, wall_time, stats, memory_snapshot, peak_memory)
+    logger.info(f"Profile written to {pstats_path} (report: {report_path})")
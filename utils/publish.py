@@ -0,0 +1,232 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Batch publishing of related drafts.
+
+All drafts are validated before anything is published: each must exist, not
+be published yet, pass the metadata schema and have its files committed. A
+draft is then published only after the drafts it depends on:
+
+  - the lower versions of the same concept (`parent.id`, `versions.index`);
+  - the drafts it references in `metadata.related_identifiers` (by Zenodo DOI or
+    record URL), e.g. conformance documents citing a new version of the conventions.
+
+Independent drafts are published concurrently, each as soon as its
+dependencies are published. Publishing cannot be undone, so on the first
+failure no further draft is published, and the report lists the drafts
+already published, the failed one and the drafts left unpublished.
+"""
+
+import logging
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("publish")
+
+# Top-level draft fields validated against the metadata schema
+PROJECTED_FIELDS = ("access", "files", "metadata", "custom_fields")
+
+# Zenodo DOIs (optionally as a doi.org URL) and the record paths of the API and landing pages
+ZENODO_DOI = re.compile(r"^(?:doi:|https?://(?:dx\.)?doi\.org/)?10\.5281/zenodo\.(\d+)$", re.IGNORECASE)
+RECORD_PATH = re.compile(r"^(?:/api)?/(?:records|uploads)/(\w+)$")
+
+
+def referenced_record(identifier, hosts=("zenodo.org",)):
+  """
+  Find the Zenodo record a related identifier points to.
+
+  Args:
+    identifier (str): A related identifier (DOI or URL).
+    hosts (iterable, optional): Hosts of the Zenodo API and landing pages.
+
+  Returns:
+    str: The record ID, or None if the identifier is not a Zenodo DOI or record URL.
+  """
+  identifier = str(identifier).strip().rstrip("/")
+  match = ZENODO_DOI.match(identifier)
+  if match:
+    return match.group(1)
+  parts = urlsplit(identifier)
+  if parts.scheme in ("http", "https") and (parts.hostname or "").lower() in hosts:
+    match = RECORD_PATH.match(parts.path.rstrip("/"))
+    if match:
+      return match.group(1)
+  return None
+
+
+def draft_dependencies(drafts, hosts=("zenodo.org",)):
+  """
+  Find the drafts each draft must be published after.
+
+  Args:
+    drafts (dict): The drafts by ID.
+    hosts (iterable, optional): Hosts of the Zenodo API and landing pages (see `referenced_record`).
+
+  Returns:
+    dict: By draft ID, the set of IDs of the drafts it depends on.
+  """
+  dependencies = {draft_id: set() for draft_id in drafts}
+
+  # Versions of the same concept are published in version order
+  concepts = {}
+  for draft_id, draft in drafts.items():
+    parent = (draft.get("parent") or {}).get("id")
+    if parent is not None:
+      concepts.setdefault(parent, []).append(draft_id)
+  for versions in concepts.values():
+    versions.sort(key=lambda draft_id: (drafts[draft_id].get("versions") or {}).get("index") or 0)
+    for previous, draft_id in zip(versions, versions[1:]):
+      dependencies[draft_id].add(previous)
+
+  # Drafts referenced by DOI (10.5281/zenodo.{id}) or record URL (https://{host}/records/{id})
+  hosts = {host.lower() for host in hosts}
+  for draft_id, draft in drafts.items():
+    for related in (draft.get("metadata") or {}).get("related_identifiers") or []:
+      other = referenced_record(related.get("identifier", ""), hosts)
+      if other in drafts and other != draft_id:
+        dependencies[draft_id].add(other)
+  return dependencies
+
+
+def publish_order(dependencies):
+  """
+  Order drafts so that every draft follows its dependencies.
+
+  Returns:
+    tuple: (the ordered draft IDs, the IDs of drafts in a dependency cycle).
+  """
+  remaining = {draft_id: set(deps) for draft_id, deps in dependencies.items()}
+  order = []
+  while True:
+    ready = sorted(draft_id for draft_id, deps in remaining.items() if not deps)
+    if not ready:
+      break
+    order.extend(ready)
+    for draft_id in ready:
+      del remaining[draft_id]
+    for deps in remaining.values():
+      deps.difference_update(ready)
+  return order, sorted(remaining)
+
+
+def validate_draft(draft, files, validator=None):
+  """
+  Check that a draft can be published.
+
+  Args:
+    draft (dict): The draft (None if it was not found).
+    files (dict): Its file entries by key (see `ZenodoAPI.list_draft_files`).
+    validator (callable, optional): Returns the schema errors of projected metadata.
+
+  Returns:
+    list: The error messages (empty if the draft can be published).
+  """
+  if draft is None:
+    return ["draft not found"]
+  if draft.get("is_published") or draft.get("status") == "published":
+    return ["already published"]
+  errors = []
+  if validator is not None:
+    errors.extend(validator({key: draft[key] for key in PROJECTED_FIELDS if key in draft}))
+  if (draft.get("files") or {}).get("enabled", True):
+    if files is None:
+      errors.append("files could not be listed")
+    elif not files:
+      errors.append("files are enabled but none was uploaded")
+    else:
+      errors.extend(f"file {key} is not committed" for key, entry in files.items() if entry.get("status") != "completed")
+  return errors
+
+
+def publish_drafts(api, draft_ids, workers=4, validator=None, dry_run=False):
+  """
+  Validate a batch of drafts, then publish them in dependency order.
+
+  Args:
+    api (ZenodoAPI): The API client.
+    draft_ids (list): IDs of the drafts to publish.
+    workers (int, optional): Number of drafts fetched and published concurrently.
+    validator (callable, optional): Returns the schema errors of projected metadata
+      (see `utils.validation.load_validator`).
+    dry_run (bool, optional): Validate and plan without publishing.
+
+  Returns:
+    dict: The publish `order`, the `invalid` drafts ({id: errors}), the `published` drafts,
+      the `failed` draft ({id: reason}), the `unpublished` drafts and the elapsed `seconds`.
+  """
+  started = time.perf_counter()
+  draft_ids = [str(draft_id) for draft_id in dict.fromkeys(draft_ids)]
+  report = {"order": [], "invalid": {}, "published": [], "failed": {}, "unpublished": list(draft_ids), "seconds": 0.0}
+
+  with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+    fetched = list(executor.map(lambda draft_id: (api.fetch_draft(draft_id), api.list_draft_files(draft_id)), draft_ids))
+  drafts = {}
+  for draft_id, (draft, files) in zip(draft_ids, fetched):
+    errors = validate_draft(draft, files, validator)
+    if errors:
+      report["invalid"][draft_id] = errors
+    drafts[draft_id] = draft or {}
+
+  dependencies = draft_dependencies(drafts, hosts=(urlsplit(api.base_url).hostname,))
+  report["order"], cycle = publish_order(dependencies)
+  for draft_id in cycle:
+    report["invalid"].setdefault(draft_id, []).append(f"dependency cycle with {', '.join(sorted(dependencies[draft_id]))}")
+
+  if report["invalid"]:
+    for draft_id, errors in report["invalid"].items():
+      logger.error(f"Draft {draft_id} cannot be published: {'; '.join(errors)}")
+    logger.error(f"Validation failed for {len(report['invalid'])} of {len(draft_ids)} drafts: nothing was published")
+  elif dry_run:
+    logger.info(f"[DRY RUN] All {len(draft_ids)} drafts are valid. Publish order: {', '.join(report['order'])}")
+  else:
+    _publish(api, dependencies, workers, report)
+
+  report["unpublished"] = [draft_id for draft_id in report["order"] + cycle if draft_id not in report["published"]]
+  report["seconds"] = time.perf_counter() - started
+  return report
+
+
+def _publish(api, dependencies, workers, report):
+  """Publish each draft as soon as its dependencies are published, stopping at the first failure."""
+  workers = max(1, workers)
+  rank = {draft_id: index for index, draft_id in enumerate(report["order"])}
+  waiting = {draft_id: set(deps) for draft_id, deps in dependencies.items()}
+  ready = [draft_id for draft_id, deps in waiting.items() if not deps]
+  running = {}
+
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    while ready or running:
+      if not report["failed"]:
+        ready.sort(key=rank.get)
+        while ready and len(running) < workers:
+          draft_id = ready.pop(0)
+          del waiting[draft_id]
+          running[executor.submit(api.publish_draft, draft_id)] = draft_id
+      elif not running:
+        break
+
+      done, _ = wait(running, return_when=FIRST_COMPLETED)
+      for future in done:
+        draft_id = running.pop(future)
+        if future.result() is None:
+          report["failed"][draft_id] = "rejected by the API (see the log)"
+          logger.error(f"Publishing draft {draft_id} failed: stopping the batch")
+          continue
+        report["published"].append(draft_id)
+        logger.info(f"Published draft {draft_id} ({len(report['published'])} of {len(report['order'])})")
+        for other, deps in waiting.items():
+          if draft_id in deps:
+            deps.discard(draft_id)
+            if not deps:
+              ready.append(other)
+
+  if report["failed"]:
+    logger.error(
+      f"Batch publish stopped: {len(report['published'])} published ({', '.join(report['published']) or 'none'}), "
+      f"failed: {', '.join(report['failed'])}"
+    )
+  else:
+    logger.info(f"Published {len(report['published'])} drafts")
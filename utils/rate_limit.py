@@ -0,0 +1,77 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Client-side rate limiting shared by all the threads using a ZenodoAPI client.
+"""
+
+import threading
+import time
+
+
+class RateLimiter:
+  """
+  Thread-safe token bucket.
+
+  Tokens are refilled continuously at `rate` per second up to `burst`; each
+  request takes one token, waiting for the bucket to refill when it is empty.
+  """
+
+  def __init__(self, rate, burst=None):
+    """
+    Initialize the bucket (full).
+
+    Args:
+      rate (float): Tokens added per second.
+      burst (int, optional): Bucket capacity (defaults to one second worth of tokens, at least 1).
+    """
+    self.rate = float(rate)
+    self.capacity = float(burst or max(1.0, self.rate))
+    self._tokens = self.capacity
+    self._updated = time.monotonic()
+    self._lock = threading.Lock()
+
+  @classmethod
+  def per_minute(cls, requests_per_minute, burst=None):
+    """Build a limiter from a requests-per-minute budget (None or 0 disables limiting)."""
+    if not requests_per_minute:
+      return None
+    return cls(float(requests_per_minute) / 60.0, burst)
+
+  def acquire(self, tokens=1):
+    """
+    Take `tokens` from the bucket, sleeping until they are available.
+
+    Returns:
+      float: The time spent waiting, in seconds.
+    """
+    waited = 0.0
+    while True:
+      with self._lock:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        # Requests larger than the bucket wait for a full bucket and leave it in debt
+        needed = min(tokens, self.capacity)
+        if self._tokens >= needed:
+          self._tokens -= tokens
+          return waited
+        delay = (needed - self._tokens) / self.rate
+      time.sleep(delay)
+      waited += delay
+
+  def reserve(self, tokens=1):
+    """
+    Take `tokens` from the bucket without waiting, leaving it in debt if needed.
+
+    For callers that wait by other means (e.g. `asyncio.sleep` in an event loop).
+
+    Returns:
+      float: The delay before the tokens may be used, in seconds.
+    """
+    with self._lock:
+      now = time.monotonic()
+      self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+      self._updated = now
+      self._tokens -= tokens
+      return max(0.0, -self._tokens / self.rate)
@@ -0,0 +1,495 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Local cache of Zenodo records.
+
+Layout of the cache (rooted at the configured output directory):
+
+  records/{record_id}/record.json    Full record as returned by the API (`.zst`, `.zz`
+                                     or `.gz` suffix when stored compressed)
+  records/{record_id}/metadata.json  Metadata filtered by metadata_template.json
+  records/{record_id}/files/         Downloaded record files
+  index.json                         Index of cached records (revision, files, hashes)
+  harvest.journal                    Write-ahead journal of an unfinished harvest
+  changes.jsonl                      Feed of the record changes found by harvests (see utils/changes.py)
+  stats.sqlite                       Time series of the record statistics (see utils/stats.py)
+  shards.json, shards/{partition}/   Coordination file and per-partition index and journal
+                                     of an unfinished sharded harvest (see utils/shards.py)
+  dictionary.{zstd,zlib}             Compression dictionary shared by the cached records
+
+Every file is written to a temporary file in the same directory and renamed
+into place, so an interrupted run never leaves a truncated file behind.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from utils.changes import ChangeFeed
+from utils.compression import CODECS, MIN_DICT_SAMPLES, load_codec
+from utils.stats import StatsStore
+
+logger = logging.getLogger("record_cache")
+
+
+@contextmanager
+def atomic_open(path, mode="wb"):
+  """
+  Open a temporary file that replaces `path` when the block completes successfully.
+
+  The data is flushed and fsync'ed before the rename; on error the temporary
+  file is removed and `path` is left untouched.
+
+  Args:
+    path (str): Final path of the file.
+    mode (str, optional): File mode (`wb` or `w`).
+  """
+  directory = os.path.dirname(path) or "."
+  os.makedirs(directory, exist_ok=True)
+  fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+  try:
+    with os.fdopen(fd, mode) as f:
+      yield f
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+  except BaseException:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    raise
+
+
+def atomic_write(path, data):
+  """Atomically write bytes or text to `path`."""
+  with atomic_open(path, "wb" if isinstance(data, bytes) else "w") as f:
+    f.write(data)
+
+
+def atomic_write_json(path, obj, indent=2):
+  """Atomically write `obj` as JSON to `path`."""
+  atomic_write(path, json.dumps(obj, indent=indent, ensure_ascii=False))
+
+
+def project_metadata(record, template):
+  """
+  Filter a record with a metadata template (see `config/metadata_template.json`).
+
+  A `true` value copies the field, an object selects sub-fields and a
+  one-element list applies its template to every item of a list field.
+
+  Args:
+    record (dict): The record (or sub-document) to filter.
+    template (dict): The template.
+
+  Returns:
+    dict: The filtered record.
+  """
+  projected = {}
+  for key, spec in template.items():
+    if key not in record:
+      continue
+    value = record[key]
+    if spec is True:
+      projected[key] = value
+    elif isinstance(spec, dict) and isinstance(value, dict):
+      projected[key] = project_metadata(value, spec)
+    elif isinstance(spec, list) and spec and isinstance(value, list):
+      projected[key] = [project_metadata(item, spec[0]) if isinstance(item, dict) else item for item in value]
+  return projected
+
+
+def metadata_hash(metadata):
+  """Return the SHA-256 of the canonical JSON serialization of `metadata`."""
+  canonical = json.dumps(metadata, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+  return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def safe_file_key(key):
+  """
+  Check that a file key names a single file inside the `files/` directory of a record.
+
+  Keys come from the API, so a key such as `..`, `/etc/passwd` or `../../index.json`
+  must not be joined to a cache path.
+  """
+  return (isinstance(key, str) and key not in ("", ".", "..") and "\0" not in key and not os.path.isabs(key)
+          and os.sep not in key and (os.altsep is None or os.altsep not in key))
+
+
+def shard_dir(output_dir, shard):
+  """Return the directory holding the journal and index changes of a harvest partition."""
+  return os.path.join(output_dir, "shards", str(shard))
+
+
+class HarvestJournal:
+  """
+  Write-ahead journal of an unfinished harvest.
+
+  Each line is a JSON event, appended and fsync'ed once the corresponding
+  work is safely on disk: `start` (harvest parameters), `record` (a record
+  and its index entry) and `page` (a fully processed result page of a
+  harvest source). The journal is removed once the harvest completes and the
+  index is saved.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._file = None
+    self._lock = threading.Lock()
+
+  def exists(self):
+    return os.path.exists(self.path)
+
+  def replay(self):
+    """
+    Read the journal of an interrupted harvest.
+
+    A truncated last line (crash while appending) is ignored.
+
+    Returns:
+      tuple: (start parameters or None, {record_id: index entry}, {source: last completed page})
+    """
+    params, entries, pages = None, {}, {}
+    if not self.exists():
+      return params, entries, pages
+
+    with open(self.path, "r") as f:
+      for line in f:
+        try:
+          event = json.loads(line)
+        except json.JSONDecodeError:
+          logger.warning(f"Ignoring truncated journal line in {self.path}")
+          continue
+        if event["event"] == "start":
+          params = event["params"]
+          pages = {}
+        elif event["event"] == "record":
+          entries[event["id"]] = event["entry"]
+        elif event["event"] == "page":
+          pages[event.get("source")] = event["page"]
+    return params, entries, pages
+
+  def _append(self, event):
+    line = json.dumps(event) + "\n"
+    with self._lock:
+      if self._file is None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a")
+      self._file.write(line)
+      self._file.flush()
+      os.fsync(self._file.fileno())
+
+  def start(self, params):
+    self._append({"event": "start", "params": params})
+
+  def record(self, record_id, entry):
+    self._append({"event": "record", "id": record_id, "entry": entry})
+
+  def page(self, page, source=None):
+    self._append({"event": "page", "page": page, "source": source})
+
+  def close(self):
+    with self._lock:
+      if self._file is not None:
+        self._file.close()
+        self._file = None
+
+  def remove(self):
+    self.close()
+    if self.exists():
+      os.remove(self.path)
+
+
+class RecordCache:
+  """
+  On-disk cache of records, projected metadata and files.
+  """
+
+  def __init__(self, output_dir, template=None, metrics=None, compression=None, shard=None):
+    """
+    Initialize the cache and load its index.
+
+    Args:
+      output_dir (str): Root directory of the cache.
+      template (dict, optional): Metadata template used to build `metadata.json`.
+      metrics (RequestMetrics, optional): Collector recording cache hits and misses.
+      compression (str, optional): Codec used to store `record.json` (`none`, `gzip`, `deflate`, `zstd`).
+        Records are readable whatever codec they were stored with.
+      shard (str, optional): Partition of a sharded harvest. Records are written to the shared
+        cache, but the journal and the index changes are kept in `shards/{shard}/` until merged.
+    """
+    self.output_dir = output_dir
+    self.compression = compression or "none"
+    if self.compression not in CODECS:
+      raise ValueError(f"Unknown cache compression '{self.compression}'. Available: {', '.join(CODECS)}")
+    self._codecs = {}
+    self._codec_lock = threading.Lock()
+    self.records_dir = os.path.join(output_dir, "records")
+    self.index_path = os.path.join(output_dir, "index.json")
+    self.template = template
+    self.metrics = metrics
+    self.shard = shard
+    state_dir = output_dir if shard is None else shard_dir(output_dir, shard)
+    self.journal = HarvestJournal(os.path.join(state_dir, "harvest.journal"))
+    self.changes = ChangeFeed(os.path.join(output_dir, "changes.jsonl"))
+    self.stats = StatsStore(os.path.join(output_dir, "stats.sqlite"))
+    self.index = self._load_index(self.index_path)
+    if shard is not None:
+      # Entries of the shared index, to save only the changes made by the shard
+      self._base_index = dict(self.index)
+      self.shard_index_path = os.path.join(state_dir, "index.json")
+      self.index.update(self._load_index(self.shard_index_path))
+
+  @staticmethod
+  def _load_index(path):
+    if not os.path.exists(path):
+      return {}
+    with open(path, "r") as f:
+      return json.load(f)
+
+  def save_index(self):
+    """Atomically write the index (or, for a shard, the entries it changed)."""
+    if self.shard is None:
+      atomic_write_json(self.index_path, self.index, indent=None)
+    else:
+      changes = {key: entry for key, entry in self.index.items() if self._base_index.get(key) != entry}
+      atomic_write_json(self.shard_index_path, changes, indent=None)
+
+  def claim_record(self, record_id):
+    """
+    Claim a record for the partition of a sharded harvest (always True outside a sharded harvest).
+
+    Partitions of overlapping sources (e.g. two communities sharing records)
+    can list the same record: the first partition creating its claim file in
+    `shards/claims/` stores it, the others skip it. A partition resumed after
+    a crash finds its own claims.
+
+    Returns:
+      bool: True if the record is claimed by this partition.
+    """
+    if self.shard is None:
+      return True
+    path = os.path.join(self.output_dir, "shards", "claims", str(record_id))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+      fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+      with open(path, "r") as f:
+        return f.read().strip() == str(self.shard)
+    with os.fdopen(fd, "w") as f:
+      f.write(f"{self.shard}\n")
+    return True
+
+  def record_dir(self, record_id):
+    return os.path.join(self.records_dir, str(record_id))
+
+  def record_path(self, record_id, codec=None):
+    suffix = CODECS[codec or self.compression].suffix
+    return os.path.join(self.record_dir(record_id), f"record.json{suffix}")
+
+  def find_record_file(self, record_id):
+    """
+    Locate the cached record file, whatever codec it was stored with.
+
+    Returns:
+      tuple: (path, codec name), or (None, None) if the record is not cached.
+    """
+    for name in [self.compression] + [name for name in CODECS if name != self.compression]:
+      path = self.record_path(record_id, name)
+      if os.path.exists(path):
+        return path, name
+    return None, None
+
+  def codec(self, name=None, samples=None):
+    """
+    Return the codec `name` (the cache codec by default), loading its dictionary once.
+
+    Args:
+      name (str, optional): Codec name.
+      samples (list, optional): Serialized records used to train the dictionary if none exists.
+    """
+    name = name or self.compression
+    with self._codec_lock:
+      if name not in self._codecs:
+        codec = load_codec(name, self.output_dir, samples)
+        # Without its dictionary yet, the codec is loaded again until one is trained
+        if codec.dictionary_file is not None and codec.dictionary is None:
+          return codec
+        self._codecs[name] = codec
+      return self._codecs[name]
+
+  def prepare_codec(self, records):
+    """
+    Train the compression dictionary from a batch of records if the cache has none yet.
+
+    Only batches of at least `MIN_DICT_SAMPLES` records train the dictionary.
+    The workers of a sharded harvest never train one: the coordinator does
+    before they start, so that they all share it.
+
+    Args:
+      records (iterable): The records (e.g. a result page being streamed).
+
+    Returns:
+      iterable: The records, to be iterated instead of `records` (a list if they were
+        read to train the dictionary).
+    """
+    codec_class = CODECS[self.compression]
+    if (self.compression in self._codecs or codec_class.dictionary_file is None or self.shard is not None
+        or os.path.exists(os.path.join(self.output_dir, codec_class.dictionary_file))):
+      return records
+    records = list(records)
+    if len(records) >= MIN_DICT_SAMPLES:
+      self.codec(samples=[json.dumps(record).encode() for record in records])
+    return records
+
+  def metadata_path(self, record_id):
+    return os.path.join(self.record_dir(record_id), "metadata.json")
+
+  def file_path(self, record_id, key):
+    """
+    Return the cache path of a record file.
+
+    Raises:
+      ValueError: If the key would resolve outside the `files/` directory of the record
+        (see `safe_file_key`).
+    """
+    if not safe_file_key(key):
+      raise ValueError(f"Unsafe file key {key!r} of record {record_id}")
+    return os.path.join(self.record_dir(record_id), "files", key)
+
+  def is_current(self, record):
+    """
+    Check whether the cached copy of a record is up to date (recording a cache hit or miss).
+
+    Args:
+      record (dict): The record as returned by the API.
+
+    Returns:
+      bool: True if the record is cached with the same revision.
+    """
+    entry = self.index.get(str(record["id"]))
+    hit = (
+      entry is not None
+      and entry.get("revision_id") == record.get("revision_id")
+      and entry.get("updated") == record.get("updated")
+      and self.find_record_file(record["id"])[0] is not None
+    )
+    if self.metrics is not None:
+      self.metrics.record_cache_lookup(hit)
+    return hit
+
+  def load_record(self, record_id):
+    """Return the cached record (decompressed if needed), or None if it is not cached."""
+    path, name = self.find_record_file(record_id)
+    if path is None:
+      return None
+    with open(path, "rb") as f:
+      data = f.read()
+    return json.loads(self.codec(name).decompress(data))
+
+  def load_metadata(self, record_id):
+    """Return the cached projected metadata, or None if it is not cached."""
+    path = self.metadata_path(record_id)
+    if not os.path.exists(path):
+      return None
+    with open(path, "r") as f:
+      return json.load(f)
+
+  def store(self, record, api=None, download_files=False):
+    """
+    Write a record, its projected metadata and (optionally) its files to the cache.
+
+    Files whose checksum matches the previously cached copy are not downloaded again.
+    The index is updated in memory; call `save_index` to persist it.
+
+    Args:
+      record (dict): The record as returned by the API.
+      api (ZenodoAPI, optional): Client used to download the files.
+      download_files (bool, optional): Download the record files.
+
+    Returns:
+      dict: The index entry of the record.
+    """
+    entry = self.write(record, self.project(record))
+    if download_files and api is not None:
+      self.download_files(api, record["id"], entry["files"])
+    self.index[str(record["id"])] = entry
+    return entry
+
+  def project(self, record):
+    """Return the metadata of a record projected with the cache template."""
+    return project_metadata(record, self.template) if self.template else record.get("metadata", {})
+
+  def write(self, record, metadata):
+    """
+    Write a record and its projected metadata, without downloading its files or updating the index.
+
+    Returns:
+      dict: The index entry of the record.
+    """
+    record_id = str(record["id"])
+    files = {
+      key: {"checksum": file_entry.get("checksum"), "size": file_entry.get("size")}
+      for key, file_entry in (record.get("files", {}).get("entries") or {}).items()
+    }
+
+    self._write_record(record_id, record)
+    atomic_write_json(self.metadata_path(record_id), metadata)
+
+    return {
+      "revision_id": record.get("revision_id"),
+      "updated": record.get("updated"),
+      "parent_id": record.get("parent", {}).get("id"),
+      "metadata_sha256": metadata_hash(metadata),
+      "files": files,
+    }
+
+  def download_files(self, api, record_id, files):
+    """
+    Download the files of a record listed in its index entry, skipping unchanged files.
+
+    Args:
+      api (ZenodoAPI): Client used to download the files.
+      record_id (str): The record ID.
+      files (dict): The `files` of the new index entry of the record.
+    """
+    previous = self.index.get(str(record_id), {}).get("files", {})
+    for key, file_entry in files.items():
+      if not safe_file_key(key):
+        logger.warning(f"Skipping file {key!r} of record {record_id}: unsafe file key")
+        continue
+      self._download(api, str(record_id), key, file_entry, previous.get(key))
+
+  def _write_record(self, record_id, record):
+    data = json.dumps(record, indent=None if self.compression != "none" else 2, ensure_ascii=False).encode()
+    codec = self.codec()
+    atomic_write(self.record_path(record_id), codec.compress(data))
+
+    # Remove a copy stored with another codec, so readers never see a stale record
+    for name in CODECS:
+      if name != self.compression and os.path.exists(self.record_path(record_id, name)):
+        os.remove(self.record_path(record_id, name))
+
+  def _download(self, api, record_id, key, file_entry, previous_entry):
+    path = self.file_path(record_id, key)
+    if (previous_entry and previous_entry.get("checksum") == file_entry["checksum"]
+        and os.path.exists(path) and os.path.getsize(path) == file_entry["size"]):
+      return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{key}.", suffix=".tmp", dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+      size = api.download_file(record_id, key, tmp_path)
+      if size is None or (file_entry["size"] is not None and size != file_entry["size"]):
+        raise IOError(f"Incomplete download of {key} for record {record_id} ({size} of {file_entry['size']} bytes)")
+      with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+      os.replace(tmp_path, path)
+    finally:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
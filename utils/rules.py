@@ -0,0 +1,328 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Declarative curation rules applied to the projected metadata of the cache.
+
+A rules file (JSON) lists rules applied in order to every `metadata.json`:
+
+  {"rules": [
+    {"name": "publisher", "path": "$.metadata.publisher", "match": {"equals": "Zenodo"}, "set": "CF Conventions"},
+    {"name": "workshop", "when": {"path": "$.metadata.title", "regex": "CF Workshop"},
+     "path": "$.metadata.subjects", "append": {"subject": "CF Workshop"}},
+    {"name": "empty-subjects", "path": "$.metadata.subjects[*]", "match": {"equals": {"subject": ""}}, "remove": true}
+  ]}
+
+`path` is a JSONPath subset: `$`, `.key`, `['key']`, `[n]` and the `[*]`
+(or `.*`) wildcard. A rule changes the nodes at its path that satisfy its
+`match` condition (`equals`, `in`, `regex`, `exists`; all nodes if absent),
+only in the documents where every `when` condition holds for some node. Its
+action is one of:
+
+  set      Replace the value (a missing key is created if its parent exists)
+  append   Append the value to the list, unless it is already there
+  remove   Remove the node from its list or object
+
+Actions are idempotent, so rules can be applied again to an updated cache.
+Rules are compiled once (paths parsed, regexes compiled) and the cache is
+transformed in one pass, collecting the records that changed. Only those are
+sent to the API, concurrently, by `update_records`. The cache itself is not
+modified: the next harvest fetches the updated records.
+"""
+
+import copy
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.json_stream import loads
+
+logger = logging.getLogger("rules")
+
+ACTIONS = ("set", "append", "remove")
+
+CONDITIONS = ("equals", "in", "regex", "exists")
+
+_MISSING = object()
+
+_STEP = re.compile(r"""\.(?P<name>[\w:-]+)|\.\*|\[\*\]|\[(?P<index>-?\d+)\]|\[(?P<quote>['"])(?P<key>.*?)(?P=quote)\]""")
+
+_WILDCARD = object()
+
+
+def parse_path(path):
+  """
+  Parse a JSONPath (subset) into steps: keys (str), indexes (int) and wildcards.
+
+  Raises:
+    ValueError: If the path is not supported.
+  """
+  if not isinstance(path, str) or not path.startswith("$"):
+    raise ValueError(f"Invalid path {path!r}: paths start with '$'")
+  steps, position = [], 1
+  while position < len(path):
+    match = _STEP.match(path, position)
+    if match is None:
+      raise ValueError(f"Invalid path {path!r} at position {position}")
+    if match.group("name") is not None:
+      steps.append(match.group("name"))
+    elif match.group("index") is not None:
+      steps.append(int(match.group("index")))
+    elif match.group("quote") is not None:
+      steps.append(match.group("key"))
+    else:
+      steps.append(_WILDCARD)
+    position = match.end()
+  if not steps:
+    raise ValueError(f"Invalid path {path!r}: the root document cannot be changed")
+  return tuple(steps)
+
+
+def _select(nodes, step, keep_missing=False):
+  """Return (parent, key, value) of the children of `nodes` selected by `step`."""
+  selected = []
+  for node in nodes:
+    if step is _WILDCARD:
+      if isinstance(node, dict):
+        selected.extend((node, key, value) for key, value in node.items())
+      elif isinstance(node, list):
+        selected.extend((node, index, value) for index, value in enumerate(node))
+    elif isinstance(step, int):
+      if isinstance(node, list) and -len(node) <= step < len(node):
+        selected.append((node, step % len(node), node[step]))
+    elif isinstance(node, dict):
+      value = node.get(step, _MISSING)
+      if keep_missing or value is not _MISSING:
+        selected.append((node, step, value))
+  return selected
+
+
+def find_nodes(document, steps):
+  """
+  Return (parent, key, value) of the nodes at a parsed path.
+
+  The value is `_MISSING` for a missing key of an existing object.
+  """
+  nodes = [document]
+  for step in steps[:-1]:
+    nodes = [value for _, _, value in _select(nodes, step)]
+  return _select(nodes, steps[-1], keep_missing=True)
+
+
+def compile_condition(spec):
+  """
+  Compile a condition (`equals`, `in`, `regex`, `exists`) into a predicate of a node value.
+
+  Raises:
+    ValueError: If the condition is empty or unknown.
+  """
+  unknown = set(spec) - set(CONDITIONS)
+  if unknown or not spec:
+    raise ValueError(f"Invalid condition {spec!r}. Available: {', '.join(CONDITIONS)}")
+  tests = []
+  if "exists" in spec:
+    exists = bool(spec["exists"])
+    tests.append(lambda value: (value is not _MISSING) == exists)
+  if "equals" in spec:
+    expected = spec["equals"]
+    tests.append(lambda value: value is not _MISSING and value == expected)
+  if "in" in spec:
+    choices = list(spec["in"])
+    tests.append(lambda value: value is not _MISSING and value in choices)
+  if "regex" in spec:
+    pattern = re.compile(spec["regex"])
+    tests.append(lambda value: isinstance(value, str) and pattern.search(value) is not None)
+  if len(tests) == 1:
+    return tests[0]
+  return lambda value: all(test(value) for test in tests)
+
+
+class Rule:
+  """
+  A compiled curation rule.
+  """
+
+  def __init__(self, spec, position=0):
+    """
+    Compile a rule.
+
+    Args:
+      spec (dict): The rule (see the module documentation).
+      position (int, optional): Position of the rule in its file, naming unnamed rules.
+
+    Raises:
+      ValueError: If the rule is not valid.
+    """
+    self.name = spec.get("name") or f"rule-{position + 1}"
+    actions = [action for action in ACTIONS if action in spec]
+    if len(actions) != 1:
+      raise ValueError(f"Rule {self.name} must have exactly one action among {', '.join(ACTIONS)}")
+    self.action = actions[0]
+    self.value = spec[self.action]
+    self.steps = parse_path(spec.get("path"))
+    self.match = compile_condition(spec["match"]) if "match" in spec else None
+    when = spec.get("when") or []
+    self.when = [
+      (parse_path(condition.get("path")), compile_condition({k: v for k, v in condition.items() if k != "path"}))
+      for condition in ([when] if isinstance(when, dict) else when)
+    ]
+
+  def applies(self, document):
+    return all(
+      any(test(value) for _, _, value in find_nodes(document, steps)) for steps, test in self.when
+    )
+
+  def apply(self, document):
+    """
+    Apply the rule to a document in place.
+
+    Returns:
+      int: The number of nodes changed.
+    """
+    if self.when and not self.applies(document):
+      return 0
+    nodes = [(parent, key, value) for parent, key, value in find_nodes(document, self.steps)
+             if self.match is None or self.match(value)]
+    if self.action == "set":
+      return self._set(nodes)
+    if self.action == "append":
+      return self._append(nodes)
+    return self._remove(nodes)
+
+  def _set(self, nodes):
+    changed = 0
+    for parent, key, value in nodes:
+      if value != self.value:
+        parent[key] = copy.deepcopy(self.value)
+        changed += 1
+    return changed
+
+  def _append(self, nodes):
+    changed = 0
+    for parent, key, value in nodes:
+      if value is _MISSING:
+        parent[key] = [copy.deepcopy(self.value)]
+        changed += 1
+      elif isinstance(value, list) and self.value not in value:
+        value.append(copy.deepcopy(self.value))
+        changed += 1
+    return changed
+
+  def _remove(self, nodes):
+    # Remove list items from the last one, so that the indexes of the others stay valid
+    removals = sorted(((parent, key) for parent, key, value in nodes if value is not _MISSING),
+                      key=lambda item: item[1] if isinstance(item[1], int) else 0, reverse=True)
+    for parent, key in removals:
+      del parent[key]
+    return len(removals)
+
+
+def compile_rules(specs):
+  """
+  Compile the rules of a rules document.
+
+  Args:
+    specs (dict or list): `{"rules": [...]}` or the list of rules.
+
+  Returns:
+    list: The compiled rules, in order.
+
+  Raises:
+    ValueError: If a rule is not valid.
+  """
+  specs = specs.get("rules", []) if isinstance(specs, dict) else specs
+  rules = [Rule(spec, position) for position, spec in enumerate(specs)]
+  names = [rule.name for rule in rules]
+  duplicates = sorted({name for name in names if names.count(name) > 1})
+  if duplicates:
+    raise ValueError(f"Duplicate rule names: {', '.join(duplicates)}")
+  return rules
+
+
+def load_rules(path):
+  """
+  Load and compile a rules file (JSON).
+
+  Raises:
+    FileNotFoundError: If the file does not exist.
+    ValueError: If a rule is not valid.
+  """
+  with open(path, "r") as f:
+    rules = compile_rules(json.load(f))
+  logger.info(f"Loaded {len(rules)} curation rules from {path}")
+  return rules
+
+
+def apply_rules(document, rules):
+  """
+  Apply rules in order to a document, in place.
+
+  Returns:
+    list: The names of the rules that changed the document.
+  """
+  return [rule.name for rule in rules if rule.apply(document)]
+
+
+def transform_cache(cache, rules, record_ids=None):
+  """
+  Apply rules to the projected metadata of the cached records, in one pass.
+
+  Args:
+    cache (RecordCache): The cache.
+    rules (list): The compiled rules (see `compile_rules`).
+    record_ids (list, optional): The records to transform (all the cached records by default).
+
+  Returns:
+    dict: `changed` records ({id: {"metadata": transformed metadata, "rules": names}}), counts of
+      `records` read and records changed by each rule (`rules`), and `seconds`.
+  """
+  started = time.perf_counter()
+  changed = {}
+  counts = {rule.name: 0 for rule in rules}
+  record_ids = [str(record_id) for record_id in (record_ids or sorted(cache.index))]
+  for record_id in record_ids:
+    path = cache.metadata_path(record_id)
+    if not os.path.exists(path):
+      continue
+    with open(path, "rb") as f:
+      metadata = loads(f.read())
+    names = apply_rules(metadata, rules)
+    if names:
+      changed[record_id] = {"metadata": metadata, "rules": names}
+      for name in names:
+        counts[name] += 1
+
+  report = {"changed": changed, "records": len(record_ids), "rules": counts, "seconds": time.perf_counter() - started}
+  logger.info(
+    f"Applied {len(rules)} rules to {len(record_ids)} records in {report['seconds']:.2f} s: {len(changed)} changed "
+    f"({', '.join(f'{name}: {count}' for name, count in counts.items())})"
+  )
+  return report
+
+
+def update_records(api, changed, workers=4):
+  """
+  Send the transformed metadata of the changed records to the API, concurrently.
+
+  Args:
+    api (ZenodoAPI): The API client.
+    changed (dict): The changed records (see `transform_cache`).
+    workers (int, optional): Number of concurrent updates.
+
+  Returns:
+    dict: The `updated` and `failed` record IDs, and `seconds`.
+  """
+  started = time.perf_counter()
+  record_ids = sorted(changed)
+  with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+    responses = list(executor.map(lambda record_id: api.update_record(record_id, changed[record_id]["metadata"]), record_ids))
+  report = {
+    "updated": [record_id for record_id, response in zip(record_ids, responses) if response is not None],
+    "failed": [record_id for record_id, response in zip(record_ids, responses) if response is None],
+    "seconds": time.perf_counter() - started,
+  }
+  logger.info(f"Updated {len(report['updated'])} records in {report['seconds']:.2f} s ({len(report['failed'])} failed)")
+  return report
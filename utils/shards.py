@@ -0,0 +1,562 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Sharded harvest: a large harvest split into disjoint partitions run by several
+worker processes, on one or several machines sharing the cache directory.
+
+Each source (community or query) is split into `created` date ranges sized
+from `hits.total`, so that every partition lists about `partition_size`
+records. The partitions are listed in a coordination file (`shards.json`) in
+the cache directory; workers claim pending partitions under a lock file and
+harvest them with their own client (and so their own rate-limit budget and
+JSON decoding core).
+
+Partitions write their records directly into the shared cache (they are
+disjoint, and every file is written atomically), but keep their journal and
+index changes in `shards/{partition}/`. A running worker renews the lease of
+its partition; a partition interrupted by a crash is claimed again once its
+lease expires (at once on the same host when the worker process is gone) and
+resumes from its journal. A worker whose partition was reclaimed stops and
+leaves its completion to the new claim. Sources may overlap (e.g. two
+communities sharing records): a record is claimed in `shards/claims/` by the
+first partition listing it and stored once. The worker completing the last
+partition merges the shard indexes into `index.json` and removes the
+coordination state.
+"""
+
+import json
+import logging
+import math
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from utils.compression import MIN_DICT_SAMPLES
+from utils.harvest import HARVEST_SORT, harvest_sources, source_name
+from utils.pipeline import QUEUE_SIZE
+from utils.record_cache import RecordCache, atomic_write_json, shard_dir
+from utils.validation import load_validator
+from utils.zenodo_api import ZenodoAPI
+
+logger = logging.getLogger("shards")
+
+# Default number of records per partition
+PARTITION_SIZE = 10000
+
+# Partitions larger than this multiple of the partition size are split further
+MAX_PARTITION_RATIO = 2
+MAX_SPLIT_DEPTH = 8
+
+# Seconds after which a claimed partition (or the lock file) is considered abandoned
+LEASE_SECONDS = 3600
+LOCK_TIMEOUT = 60
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def _total(response):
+  total = response.get("hits", {}).get("total", 0)
+  return total.get("value", 0) if isinstance(total, dict) else int(total)
+
+
+def _parse_date(value):
+  date = datetime.fromisoformat(value.replace("Z", "+00:00"))
+  if date.tzinfo is None:
+    date = date.replace(tzinfo=timezone.utc)
+  return date.astimezone(timezone.utc)
+
+
+def date_range_query(query, start=None, end=None):
+  """
+  Restrict a search query to records created in [start, end).
+
+  Args:
+    query (str): The query to restrict (None for all records).
+    start (datetime, optional): Inclusive lower bound (unbounded if None).
+    end (datetime, optional): Exclusive upper bound (unbounded if None).
+
+  Returns:
+    str: The restricted query.
+  """
+  low = f'"{start.strftime(DATE_FORMAT)}"' if start else "*"
+  high = f'"{end.strftime(DATE_FORMAT)}"' if end else "*"
+  created = f"created:[{low} TO {high}" + ("}" if end else "]")
+  return f"({query}) AND {created}" if query else created
+
+
+def plan_partitions(api, source, partition_size=PARTITION_SIZE):
+  """
+  Split a source into disjoint `created` date ranges of about `partition_size` records.
+
+  The span between the oldest and newest records is cut into equal ranges,
+  and ranges listing more than twice the partition size (bursts of uploads)
+  are bisected. The first and last ranges are open-ended, so records
+  created during the harvest are still listed.
+
+  Args:
+    api (ZenodoAPI): The API client.
+    source (dict): The harvest source (`community` and/or `query`).
+    partition_size (int, optional): Target number of records per partition.
+
+  Returns:
+    list: Partition sources, each with the source `community` and a restricted `query`.
+  """
+  community, query = source.get("community"), source.get("query")
+
+  def search(q, sort="oldest"):
+    return api.search_records(community, page=1, size=1, sort=sort, query=q)
+
+  oldest = search(query)
+  total = _total(oldest)
+  if total <= partition_size:
+    return [{"community": community, "query": query, "estimated": total}]
+
+  first = _parse_date(oldest["hits"]["hits"][0]["created"])
+  last = _parse_date(search(query, sort="newest")["hits"]["hits"][0]["created"])
+  count = math.ceil(total / partition_size)
+  span = (last - first) / count
+  bounds = [first] + [first + span * i for i in range(1, count)] + [last]
+
+  def split(start, end, depth):
+    # The first and last ranges are open-ended
+    restricted = date_range_query(query, None if start == first else start, None if end == last else end)
+    estimated = _total(search(restricted))
+    if estimated > MAX_PARTITION_RATIO * partition_size and depth < MAX_SPLIT_DEPTH:
+      middle = start + (end - start) / 2
+      return split(start, middle, depth + 1) + split(middle, end, depth + 1)
+    return [{"community": community, "query": restricted, "estimated": estimated}]
+
+  partitions = []
+  for start, end in zip(bounds[:-1], bounds[1:]):
+    partitions.extend(split(start, end, 0))
+  # Empty ranges are dropped, except the last one which lists the records created meanwhile
+  return [partition for partition in partitions[:-1] if partition["estimated"]] + partitions[-1:]
+
+
+def _break_stale_lock(path, timeout):
+  """
+  Remove a lock file not refreshed for `timeout` seconds.
+
+  The file is first renamed to a name of our own, so that of several workers
+  finding the same stale lock only one removes it; a lock refreshed or taken
+  again meanwhile is put back.
+
+  Returns:
+    bool: True if a stale lock was removed.
+  """
+  moved = f"{path}.{uuid.uuid4().hex}"
+  try:
+    os.rename(path, moved)
+  except FileNotFoundError:
+    return False
+  if time.time() - os.path.getmtime(moved) > timeout:
+    logger.warning(f"Removing stale lock {path}")
+    os.remove(moved)
+    return True
+  try:
+    os.link(moved, path)
+  except FileExistsError:
+    logger.error(f"Lock {path} was taken while checking whether it was stale")
+  os.remove(moved)
+  return False
+
+
+def _lock_owner(path):
+  try:
+    with open(path, "r") as f:
+      return f.read().strip()
+  except FileNotFoundError:
+    return None
+
+
+@contextmanager
+def _file_lock(path, timeout=LOCK_TIMEOUT):
+  """
+  Exclusive lock held by creating `path` (works across hosts on a shared file system).
+
+  The holder refreshes the modification time of the lock file every quarter
+  of `timeout` (a lock file older than `timeout` is stale: its holder
+  crashed), and only removes the file if it still holds the lock.
+  """
+  token = f"{worker_id()}:{uuid.uuid4().hex}"
+  while True:
+    try:
+      fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+      break
+    except FileExistsError:
+      try:
+        if time.time() - os.path.getmtime(path) > timeout and _break_stale_lock(path, timeout):
+          continue
+      except FileNotFoundError:
+        continue
+      time.sleep(0.05)
+  os.write(fd, f"{token}\n".encode())
+  os.close(fd)
+
+  released = threading.Event()
+
+  def heartbeat():
+    while not released.wait(timeout / 4):
+      if _lock_owner(path) != token:
+        logger.error(f"Lost lock {path} while holding it")
+        return
+      os.utime(path)
+
+  thread = threading.Thread(target=heartbeat, name="lock-heartbeat", daemon=True)
+  thread.start()
+  try:
+    yield
+  finally:
+    released.set()
+    thread.join()
+    if _lock_owner(path) == token:
+      os.remove(path)
+
+
+def worker_id():
+  """Identify the current worker process (`host:pid`)."""
+  return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _is_abandoned(partition, now, lease_seconds):
+  """
+  Return whether a running partition was abandoned by its worker.
+
+  A worker on this host is abandoned exactly when its process is gone; the
+  lease, renewed by running workers, only decides for workers on other hosts.
+  """
+  if partition["status"] != "running":
+    return False
+  host, _, pid = partition["worker"].rpartition(":")
+  if host == socket.gethostname():
+    try:
+      os.kill(int(pid), 0)
+    except ProcessLookupError:
+      return True
+    except (PermissionError, ValueError):
+      pass
+    else:
+      return False
+  return now - partition["claimed"] > lease_seconds
+
+
+class ShardCoordinator:
+  """
+  Coordination file of a sharded harvest (`shards.json` in the cache directory).
+  """
+
+  def __init__(self, output_dir, lease_seconds=LEASE_SECONDS):
+    self.output_dir = output_dir
+    self.path = os.path.join(output_dir, "shards.json")
+    self.lock_path = os.path.join(output_dir, "shards.lock")
+    self.lease_seconds = lease_seconds
+
+  def exists(self):
+    return os.path.exists(self.path)
+
+  def load(self):
+    with open(self.path, "r") as f:
+      return json.load(f)
+
+  def _save(self, state):
+    atomic_write_json(self.path, state)
+
+  @contextmanager
+  def _locked(self):
+    os.makedirs(self.output_dir, exist_ok=True)
+    with _file_lock(self.lock_path):
+      state = self.load() if self.exists() else None
+      yield state
+      if state is not None:
+        self._save(state)
+
+  def plan(self, api, params, partition_size=PARTITION_SIZE):
+    """
+    Write the partitions of a harvest, unless the same harvest is already planned.
+
+    Args:
+      api (ZenodoAPI): The client used to size the partitions.
+      params (dict): Harvest parameters: `sources`, `size`, `download_files` and `compression`.
+      partition_size (int, optional): Target number of records per partition.
+
+    Returns:
+      dict: The coordination state.
+    """
+    with self._locked() as state:
+      if state is not None and state["params"] == params:
+        done = sum(partition["status"] == "done" for partition in state["partitions"])
+        logger.info(f"Resuming sharded harvest: {done} of {len(state['partitions'])} partitions done")
+        return state
+      if state is not None:
+        raise RuntimeError(f"A sharded harvest with other parameters is unfinished in {self.output_dir} ({self.path})")
+
+      partitions = []
+      for source in params["sources"]:
+        for partition in plan_partitions(api, source, partition_size):
+          partition.update({
+            "id": f"p{len(partitions):04d}", "source": source_name(source),
+            "status": "pending", "worker": None, "claimed": None, "claim": None, "counts": None,
+          })
+          partitions.append(partition)
+      state = {"params": params, "partition_size": partition_size, "partitions": partitions}
+      self._save(state)
+    logger.info(f"Planned {len(partitions)} partitions of about {partition_size} records in {self.path}")
+    return state
+
+  def claim(self):
+    """
+    Claim the next pending (or abandoned) partition.
+
+    The partition gets a new `claim` token, which identifies this claim in
+    `renew` and `complete` (a reclaimed partition has another token).
+
+    Returns:
+      tuple: (partition, harvest parameters), or None if no partition is left.
+    """
+    now = time.time()
+    with self._locked() as state:
+      if state is None:
+        return None
+      for partition in state["partitions"]:
+        if partition["status"] == "pending" or _is_abandoned(partition, now, self.lease_seconds):
+          if partition["status"] == "running":
+            logger.warning(f"Reclaiming partition {partition['id']} abandoned by {partition['worker']}")
+          partition.update({"status": "running", "worker": worker_id(), "claimed": now, "claim": uuid.uuid4().hex})
+          return dict(partition), state["params"]
+    return None
+
+  def _claimed(self, state, partition_id, claim):
+    """Return the partition if it is still running under `claim`, else None."""
+    for partition in (state or {}).get("partitions", []):
+      if partition["id"] == partition_id and partition["status"] == "running" and partition.get("claim") == claim:
+        return partition
+    return None
+
+  def renew(self, partition_id, claim):
+    """
+    Renew the lease of a claimed partition.
+
+    Returns:
+      bool: False if the partition was reclaimed by another worker.
+    """
+    with self._locked() as state:
+      partition = self._claimed(state, partition_id, claim)
+      if partition is not None:
+        partition["claimed"] = time.time()
+    return partition is not None
+
+  def complete(self, partition_id, claim, counts):
+    """
+    Mark a claimed partition as done, merging the shards if it was the last one.
+
+    The call is ignored if the partition was reclaimed by another worker
+    meanwhile: that worker completes it.
+
+    Returns:
+      bool: True if this call merged the harvest.
+    """
+    with _file_lock(self.lock_path):
+      state = self.load() if self.exists() else None
+      partition = self._claimed(state, partition_id, claim)
+      if partition is None:
+        logger.warning(f"Partition {partition_id} was reclaimed by another worker: its completion is left to it")
+        return False
+      partition.update({"status": "done", "counts": counts})
+      # Merged only once every partition is done (none running)
+      if any(partition["status"] != "done" for partition in state["partitions"]):
+        self._save(state)
+        return False
+      self._merge(state)
+      # The coordination state is removed once merged
+      shutil.rmtree(os.path.join(self.output_dir, "shards"), ignore_errors=True)
+      os.remove(self.path)
+    return True
+
+  def _merge(self, state):
+    cache = RecordCache(self.output_dir)
+    for partition in state["partitions"]:
+      path = os.path.join(shard_dir(self.output_dir, partition["id"]), "index.json")
+      if os.path.exists(path):
+        with open(path, "r") as f:
+          cache.index.update(json.load(f))
+    cache.save_index()
+    totals = summarize(state)
+    logger.info(
+      f"Merged {len(state['partitions'])} partitions into {cache.index_path}: "
+      f"{totals['stored']} stored, {totals['unchanged']} unchanged, {totals['resumed']} resumed"
+    )
+
+  def status(self):
+    """Return the number of partitions by status, or None if no sharded harvest is planned."""
+    if not self.exists():
+      return None
+    counts = {}
+    for partition in self.load()["partitions"]:
+      counts[partition["status"]] = counts.get(partition["status"], 0) + 1
+    return counts
+
+
+def summarize(state):
+  """Sum the counts of the done partitions of a coordination state."""
+  totals = {"stored": 0, "unchanged": 0, "duplicates": 0, "invalid": 0, "resumed": 0}
+  for partition in state["partitions"]:
+    for key, value in (partition["counts"] or {}).items():
+      totals[key] = totals.get(key, 0) + value
+  return totals
+
+
+class LeaseLost(Exception):
+  """Raised in a shard worker whose partition was reclaimed by another worker."""
+
+
+@contextmanager
+def _lease(coordinator, partition):
+  """
+  Renew the lease of a claimed partition every quarter of the lease while the block runs.
+
+  Yields:
+    threading.Event: Set if the partition was reclaimed by another worker.
+  """
+  lost = threading.Event()
+  done = threading.Event()
+
+  def heartbeat():
+    while not done.wait(coordinator.lease_seconds / 4):
+      try:
+        renewed = coordinator.renew(partition["id"], partition["claim"])
+      except OSError as e:
+        logger.warning(f"Could not renew the lease of partition {partition['id']}: {e}")
+        continue
+      if not renewed:
+        lost.set()
+        return
+
+  thread = threading.Thread(target=heartbeat, name="lease-heartbeat", daemon=True)
+  thread.start()
+  try:
+    yield lost
+  finally:
+    done.set()
+    thread.join()
+
+
+def run_shard_worker(output_dir, api_settings, template=None, pipeline_settings=None, lease_seconds=LEASE_SECONDS):
+  """
+  Harvest partitions of a planned sharded harvest until none is left.
+
+  Args:
+    output_dir (str): Cache directory holding the coordination file.
+    api_settings (dict): Keyword arguments of the worker's `ZenodoAPI` client.
+    template (dict, optional): Metadata template used to build `metadata.json`.
+    pipeline_settings (dict, optional): Harvest pipeline settings (`stage_workers`, `queue_size`,
+      `validation_schema`).
+    lease_seconds (int, optional): Age after which a running partition is considered abandoned.
+
+  Returns:
+    list: The counts of the partitions harvested by this worker.
+  """
+  coordinator = ShardCoordinator(output_dir, lease_seconds)
+  api = ZenodoAPI(**api_settings)
+  pipeline_settings = pipeline_settings or {}
+  validator = load_validator(pipeline_settings.get("validation_schema"))
+  harvested = []
+  while True:
+    claimed = coordinator.claim()
+    if claimed is None:
+      return harvested
+    partition, params = claimed
+    logger.info(f"Worker {worker_id()} harvesting partition {partition['id']} of {partition['source']} (~{partition['estimated']} records)")
+    cache = RecordCache(output_dir, template, metrics=api.metrics, compression=params["compression"], shard=partition["id"])
+    with _lease(coordinator, partition) as lost:
+
+      def on_record(record_id, entry):
+        # Stop writing into a partition reclaimed by another worker
+        if lost.is_set():
+          raise LeaseLost(f"Partition {partition['id']} was reclaimed by another worker")
+
+      try:
+        counts = harvest_sources(
+          api, cache, [{"name": partition["id"], "community": partition["community"], "query": partition["query"]}],
+          size=params["size"], download_files=params["download_files"], workers=1,
+          stage_workers=pipeline_settings.get("stage_workers"),
+          queue_size=pipeline_settings.get("queue_size", QUEUE_SIZE), validator=validator, on_record=on_record
+        )
+      except LeaseLost as e:
+        logger.error(f"{e}: stopped harvesting it")
+        continue
+    coordinator.complete(partition["id"], partition["claim"], counts)
+    harvested.append(counts)
+
+
+def run_shard_workers(output_dir, api_settings, template=None, processes=4, pipeline_settings=None):
+  """
+  Run `processes` shard workers in a process pool until no partition is left.
+
+  Returns:
+    list: The counts of the partitions harvested by the workers.
+  """
+  processes = max(1, processes)
+  with ProcessPoolExecutor(max_workers=processes) as executor:
+    futures = [
+      executor.submit(run_shard_worker, output_dir, api_settings, template, pipeline_settings)
+      for _ in range(processes)
+    ]
+    return [counts for future in futures for counts in future.result()]
+
+
+def harvest_sharded(api, cache, sources, api_settings, size=1000, download_files=True,
+                    partition_size=PARTITION_SIZE, processes=4, pipeline_settings=None):
+  """
+  Harvest sources into the cache with a pool of worker processes.
+
+  The harvest is planned (or resumed) in the coordination file of the cache,
+  the compression dictionary is trained once from the first result page, and
+  `processes` local workers run the partitions. Workers started on other
+  machines sharing the cache directory (`zenodo.py shard-worker`) take part in
+  the same harvest.
+
+  Args:
+    api (ZenodoAPI): The client used to plan the partitions.
+    cache (RecordCache): The cache to fill (provides directory, template and compression).
+    sources (list): Harvest sources, each with a `community` and/or a `query`.
+    api_settings (dict): Keyword arguments of the workers' `ZenodoAPI` clients.
+    size (int, optional): The number of records per page.
+    download_files (bool, optional): Download the record files.
+    partition_size (int, optional): Target number of records per partition.
+    processes (int, optional): Number of local worker processes.
+    pipeline_settings (dict, optional): Harvest pipeline settings of the workers (see `run_shard_worker`).
+
+  Returns:
+    dict: Counts of `stored`, `unchanged`, `duplicates`, `invalid` and `resumed` records of the partitions.
+  """
+  coordinator = ShardCoordinator(cache.output_dir)
+  params = {"sources": sources, "size": size, "sort": HARVEST_SORT,
+            "download_files": download_files, "compression": cache.compression}
+  state = coordinator.plan(api, params, partition_size)
+
+  # Train the shared dictionary before the workers start, so they all use the same one
+  first = sources[0]
+  sample = api.search_records(first.get("community"), page=1, size=MIN_DICT_SAMPLES, sort=HARVEST_SORT, query=first.get("query"))
+  cache.prepare_codec(sample.get("hits", {}).get("hits", []))
+
+  harvested = run_shard_workers(cache.output_dir, api_settings, cache.template, processes, pipeline_settings)
+
+  # Partitions done before a resumed run, plus those harvested by the local workers
+  totals = summarize(state)
+  for counts in harvested:
+    for key, value in counts.items():
+      totals[key] = totals.get(key, 0) + value
+
+  if coordinator.exists():
+    logger.warning(f"Partitions still running on other workers ({coordinator.status()}); the last one merges the harvest")
+  else:
+    cache.index = RecordCache(cache.output_dir).index
+    logger.info(f"Sharded harvest complete: {len(harvested)} partitions harvested by {max(1, processes)} local workers")
+  return totals
@@ -0,0 +1,243 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Time series of the usage statistics of the cached records.
+
+Every record carries a `stats` block (views, downloads and data volume of
+this version and of all versions) that each harvest overwrites. The stats
+store keeps its history in `stats.sqlite` in the cache directory, one table
+clustered by record and time:
+
+  snapshots(record_id, time, views, unique_views, downloads, unique_downloads,
+            data_volume, all_views, ..., all_data_volume)
+
+A harvest snapshots the statistics of every listed record (including the
+records whose revision did not change), and only the records whose values
+changed since their latest snapshot get a new row. The table stores integers
+only (record IDs, Unix times, counts), without a rowid, so records with a
+non-numeric ID (e.g. the alphanumeric IDs of other InvenioRDM instances) are
+skipped.
+
+Queries answer for the whole community at once in SQL (window functions
+over the snapshots) and return columns as `array.array`, e.g. the total
+downloads of the community after each harvest or the growth of every
+record between two dates.
+"""
+
+import logging
+import os
+import sqlite3
+import time as _time
+from array import array
+from contextlib import closing
+from datetime import datetime
+
+logger = logging.getLogger("stats")
+
+METRICS = ("views", "unique_views", "downloads", "unique_downloads", "data_volume")
+
+# Metrics of this version, then of all the versions of the concept (`all_` prefix)
+COLUMNS = METRICS + tuple(f"all_{metric}" for metric in METRICS)
+
+# Seconds a writer waits for another process (e.g. a shard worker) holding the database
+LOCK_TIMEOUT = 30
+
+_SCHEMA = (
+  "CREATE TABLE IF NOT EXISTS snapshots (record_id INTEGER NOT NULL, time INTEGER NOT NULL, "
+  + ", ".join(f"{column} INTEGER NOT NULL" for column in COLUMNS)
+  + ", PRIMARY KEY (record_id, time)) WITHOUT ROWID"
+)
+
+# Latest snapshot of every record at or before :at
+_LATEST = (
+  "SELECT s.* FROM snapshots s JOIN (SELECT record_id, MAX(time) AS time FROM snapshots WHERE time <= :at "
+  "GROUP BY record_id) l ON s.record_id = l.record_id AND s.time = l.time ORDER BY s.record_id"
+)
+
+
+def stats_row(record):
+  """
+  Return the statistics of a record as a tuple of `COLUMNS`, or None if it has no `stats` block.
+  """
+  stats = record.get("stats")
+  if not stats:
+    return None
+  this, every = stats.get("this_version") or {}, stats.get("all_versions") or {}
+  return tuple(int(this.get(metric) or 0) for metric in METRICS) + tuple(int(every.get(metric) or 0) for metric in METRICS)
+
+
+def _timestamp(value):
+  if value is None:
+    return int(_time.time())
+  if isinstance(value, datetime):
+    return int(value.timestamp())
+  return int(value)
+
+
+def _record_key(record_id):
+  """Return a record ID as stored in the table, or None if it is not numeric."""
+  record_id = str(record_id)
+  return int(record_id) if record_id.isdecimal() and record_id.isascii() else None
+
+
+def _check_column(column):
+  if column not in COLUMNS:
+    raise ValueError(f"Unknown statistic '{column}'. Available: {', '.join(COLUMNS)}")
+
+
+def _columns(names, rows):
+  """Transpose query rows into a dict of integer arrays."""
+  columns = {name: array("q") for name in names}
+  for row in rows:
+    for name, value in zip(names, row):
+      columns[name].append(value)
+  return columns
+
+
+class StatsStore:
+  """
+  Append-only store of record statistics snapshots.
+  """
+
+  def __init__(self, path):
+    """
+    Initialize the store (the database is created on the first snapshot).
+
+    Args:
+      path (str): Path of the SQLite database.
+    """
+    self.path = path
+
+  def exists(self):
+    return os.path.exists(self.path)
+
+  def _connect(self):
+    connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+    connection.execute(_SCHEMA)
+    return connection
+
+  def snapshot(self, stats, time=None):
+    """
+    Store the statistics of records whose values changed since their latest snapshot.
+
+    Args:
+      stats (dict): Rows of `COLUMNS` (see `stats_row`) by record ID.
+      time (datetime or int, optional): Time of the snapshot (now by default).
+
+    Returns:
+      dict: Counts of `written` and `unchanged` records (records with a non-numeric ID are skipped).
+    """
+    when = _timestamp(time)
+    keyed, skipped = {}, []
+    for record_id, row in stats.items():
+      key = _record_key(record_id)
+      if key is None:
+        skipped.append(record_id)
+      else:
+        keyed[key] = row
+    if skipped:
+      logger.warning(f"Stats snapshot: skipping {len(skipped)} records with a non-numeric ID (e.g. {skipped[0]})")
+    with closing(self._connect()) as connection, connection:
+      latest = {row[0]: row[2:] for row in connection.execute(_LATEST, {"at": when})}
+      rows = [(key, when) + tuple(row) for key, row in keyed.items() if latest.get(key) != tuple(row)]
+      connection.executemany(
+        f"INSERT OR REPLACE INTO snapshots VALUES ({', '.join('?' * (len(COLUMNS) + 2))})", rows
+      )
+    counts = {"written": len(rows), "unchanged": len(keyed) - len(rows)}
+    logger.info(f"Stats snapshot: {counts['written']} records changed, {counts['unchanged']} unchanged")
+    return counts
+
+  def _query(self, names, sql, params):
+    if not self.exists():
+      return _columns(names, [])
+    with closing(self._connect()) as connection:
+      return _columns(names, connection.execute(sql, params))
+
+  def history(self, record_id, columns=COLUMNS):
+    """
+    Return the snapshots of a record.
+
+    Returns:
+      dict: Arrays of `time` and of each requested column, in time order (empty for a
+        non-numeric record ID).
+    """
+    for column in columns:
+      _check_column(column)
+    key = _record_key(record_id)
+    if key is None:
+      return _columns(("time",) + tuple(columns), [])
+    return self._query(
+      ("time",) + tuple(columns),
+      f"SELECT time, {', '.join(columns)} FROM snapshots WHERE record_id = ? ORDER BY time",
+      (key,),
+    )
+
+  def latest(self, at=None, columns=COLUMNS):
+    """
+    Return the statistics of every record as of a time.
+
+    Args:
+      at (datetime or int, optional): The time (now by default).
+      columns (tuple, optional): The statistics to return.
+
+    Returns:
+      dict: Arrays of `record_id`, `time` (of the snapshot) and of each requested column.
+    """
+    for column in columns:
+      _check_column(column)
+    return self._query(
+      ("record_id", "time") + tuple(columns),
+      f"SELECT record_id, time, {', '.join(columns)} FROM ({_LATEST})",
+      {"at": _timestamp(at)},
+    )
+
+  def community_series(self, column="downloads"):
+    """
+    Return the community total of a statistic after each snapshot.
+
+    Each record contributes its latest value at every time, so the total
+    after a snapshot is the running sum of the changes of all records.
+    Totals of `all_` statistics count a concept once per cached version.
+
+    Returns:
+      dict: Arrays of `time` and of the total.
+    """
+    _check_column(column)
+    return self._query(
+      ("time", column),
+      f"SELECT time, SUM(SUM(delta)) OVER (ORDER BY time) FROM ("
+      f"SELECT time, {column} - COALESCE(LAG({column}) OVER (PARTITION BY record_id ORDER BY time), 0) AS delta "
+      f"FROM snapshots) GROUP BY time ORDER BY time",
+      {},
+    )
+
+  def growth(self, column="downloads", since=None, until=None, limit=None):
+    """
+    Return the growth of a statistic of every record between two times.
+
+    A record first snapshotted after `since` grows from 0.
+
+    Args:
+      column (str, optional): The statistic.
+      since (datetime or int, optional): Start (by default, the growth from 0).
+      until (datetime or int, optional): End (now by default).
+      limit (int, optional): Return only the records that grew the most.
+
+    Returns:
+      dict: Arrays of `record_id`, `start`, `end` and `delta`, by decreasing `delta`.
+    """
+    _check_column(column)
+    sql = (
+      f"WITH bounds AS (SELECT record_id, MAX(CASE WHEN time <= :since THEN time END) AS t0, "
+      f"MAX(time) AS t1 FROM snapshots WHERE time <= :until GROUP BY record_id) "
+      f"SELECT b.record_id, COALESCE(s0.{column}, 0) AS start, s1.{column}, s1.{column} - COALESCE(s0.{column}, 0) AS delta "
+      f"FROM bounds b JOIN snapshots s1 ON s1.record_id = b.record_id AND s1.time = b.t1 "
+      f"LEFT JOIN snapshots s0 ON s0.record_id = b.record_id AND s0.time = b.t0 "
+      f"ORDER BY delta DESC, b.record_id"
+    )
+    params = {"since": -1 if since is None else _timestamp(since), "until": _timestamp(until)}
+    if limit is not None:
+      sql += " LIMIT :limit"
+      params["limit"] = int(limit)
+    return self._query(("record_id", "start", "end", "delta"), sql, params)
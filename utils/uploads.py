@@ -0,0 +1,242 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Bulk creation of drafts from local metadata folders.
+
+A batch directory holds one folder per record, laid out like the cache:
+
+  {folder}/metadata.json   Draft body (`metadata`, `access`, `files`, `custom_fields`)
+  {folder}/files/          Files uploaded to the draft
+  uploads.journal          Drafts created and files uploaded (written by the upload)
+
+The upload runs as a pipeline (see `utils.pipeline`): the `draft` stage
+creates the draft of each folder and registers its files, and the `upload`
+stage streams the files from disk with several workers, so the large files
+of different records are uploaded concurrently. Each committed file is
+checked against its local MD5 checksum.
+
+The journal is kept after the upload: running the same batch again reuses
+the drafts already created and uploads only the files that are not yet
+committed with the same checksum. It also maps each folder to its draft
+for later publishing.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from utils.logging_utils import ProgressLog
+from utils.pipeline import Pipeline, Stage
+from utils.verify import hash_file
+
+logger = logging.getLogger("uploads")
+
+# Default number of workers of each upload stage
+STAGE_WORKERS = {"draft": 2, "upload": 4}
+
+JOURNAL_FILE = "uploads.journal"
+
+
+def find_upload_folders(batch_dir):
+  """Return the folders of a batch directory that hold a `metadata.json`, sorted by name."""
+  return sorted(
+    name for name in os.listdir(batch_dir)
+    if os.path.isfile(os.path.join(batch_dir, name, "metadata.json"))
+  )
+
+
+def local_files(folder_path):
+  """Return the files of an upload folder as {key: path}."""
+  files_dir = os.path.join(folder_path, "files")
+  if not os.path.isdir(files_dir):
+    return {}
+  return {
+    name: os.path.join(files_dir, name) for name in sorted(os.listdir(files_dir))
+    if os.path.isfile(os.path.join(files_dir, name)) and not name.startswith(".")
+  }
+
+
+class UploadJournal:
+  """
+  Append-only journal of a batch upload (`uploads.journal` in the batch directory).
+
+  Each line is a JSON event: `draft` (a folder and the ID of the draft created
+  for it) or `file` (a file committed to the draft, with its checksum).
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._lock = threading.Lock()
+
+  def exists(self):
+    return os.path.exists(self.path)
+
+  def replay(self):
+    """
+    Read the journal.
+
+    Returns:
+      dict: By folder, the `draft_id` and the committed `files` ({key: checksum}).
+    """
+    uploads = {}
+    if not self.exists():
+      return uploads
+    with open(self.path, "r") as f:
+      for line in f:
+        try:
+          event = json.loads(line)
+        except ValueError:
+          logger.warning(f"Ignoring truncated journal line in {self.path}")
+          continue
+        upload = uploads.setdefault(event["folder"], {"draft_id": None, "files": {}})
+        if event["event"] == "draft":
+          upload["draft_id"] = event["draft_id"]
+          upload["files"] = {}
+        elif event["event"] == "file":
+          upload["files"][event["key"]] = event["checksum"]
+    return uploads
+
+  def _append(self, event):
+    with self._lock:
+      with open(self.path, "a") as f:
+        f.write(json.dumps(event) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+  def draft(self, folder, draft_id):
+    self._append({"event": "draft", "folder": folder, "draft_id": draft_id})
+
+  def file(self, folder, key, checksum):
+    self._append({"event": "file", "folder": folder, "key": key, "checksum": checksum})
+
+
+def upload_batch(api, batch_dir, workers=4, stage_workers=None):
+  """
+  Create a draft for every folder of a batch directory and upload its files.
+
+  A folder that fails (e.g. a rejected draft or an interrupted upload) is
+  reported and left for the next run, while the other folders proceed.
+
+  Args:
+    api (ZenodoAPI): The API client.
+    batch_dir (str): The batch directory.
+    workers (int, optional): Number of files uploaded concurrently.
+    stage_workers (dict, optional): Number of worker threads by stage name (see `STAGE_WORKERS`).
+
+  Returns:
+    dict: `drafts` by folder, counts of `created` drafts, `uploaded` and `skipped` files,
+      uploaded `bytes`, `seconds`, `mb_per_second`, and the `failed` folders.
+  """
+  journal = UploadJournal(os.path.join(batch_dir, JOURNAL_FILE))
+  batch = _Batch(api, batch_dir, journal)
+  counts = dict(STAGE_WORKERS, upload=workers, **(stage_workers or {}))
+  pipeline = Pipeline([
+    Stage("draft", batch.draft, counts["draft"]),
+    Stage("upload", batch.upload, counts["upload"]),
+  ], metrics=api.metrics)
+
+  started = time.perf_counter()
+  pipeline.run(find_upload_folders(batch_dir))
+  seconds = time.perf_counter() - started
+
+  report = dict(batch.counts, drafts=batch.drafts, failed=sorted(batch.failed), seconds=seconds,
+                mb_per_second=batch.counts["bytes"] / seconds / 1e6 if seconds else 0.0)
+  logger.info(
+    f"Upload of {len(batch.drafts)} drafts complete: {report['created']} created, {report['uploaded']} files uploaded "
+    f"({report['bytes'] / 1e6:.1f} MB, {report['mb_per_second']:.1f} MB/s), {report['skipped']} already uploaded, "
+    f"{len(report['failed'])} folder(s) failed"
+  )
+  return report
+
+
+class _Batch:
+  """The stage functions of a batch upload."""
+
+  def __init__(self, api, batch_dir, journal):
+    self.api = api
+    self.batch_dir = batch_dir
+    self.journal = journal
+    self.uploads = journal.replay()
+    self.drafts = {folder: upload["draft_id"] for folder, upload in self.uploads.items() if upload["draft_id"]}
+    self.counts = {"created": 0, "uploaded": 0, "skipped": 0, "bytes": 0}
+    self.failed = set()
+    self.lock = threading.Lock()
+    self.progress = ProgressLog(logger, "Upload progress", rate="files")
+
+  def _fail(self, folder, message):
+    logger.error(f"Upload of {folder} failed: {message}")
+    with self.lock:
+      self.failed.add(folder)
+
+  def _count(self, key, n=1):
+    with self.lock:
+      self.counts[key] += n
+
+  def draft(self, folder):
+    """Create the draft of a folder (unless journaled) and register the files left to upload."""
+    path = os.path.join(self.batch_dir, folder)
+    files = local_files(path)
+    draft_id = self.drafts.get(folder)
+    if draft_id is None:
+      with open(os.path.join(path, "metadata.json"), "r") as f:
+        metadata = json.load(f)
+      draft = self.api.create_draft(metadata)
+      if draft is None:
+        return self._fail(folder, "the draft could not be created")
+      draft_id = str(draft["id"])
+      self.journal.draft(folder, draft_id)
+      with self.lock:
+        self.drafts[folder] = draft_id
+      self._count("created")
+      remote = {}
+    else:
+      remote = self.api.list_draft_files(draft_id)
+      if remote is None:
+        return self._fail(folder, f"the files of draft {draft_id} could not be listed")
+
+    pending, register = [], []
+    committed = self.uploads.get(folder, {}).get("files", {})
+    for key, file_path in files.items():
+      entry = remote.get(key)
+      if entry is not None and entry.get("status") == "completed":
+        if entry.get("size") in (None, os.path.getsize(file_path)):
+          checksum = f"md5:{hash_file(file_path)[0]}"
+          if checksum == entry.get("checksum"):
+            if key not in committed:
+              self.journal.file(folder, key, checksum)
+            self._count("skipped")
+            continue
+        # A different file was committed under this key: replace it
+        if not self.api.delete_draft_file(draft_id, key):
+          return self._fail(folder, f"{key} could not be replaced in draft {draft_id}")
+        entry = None
+      if entry is None:
+        register.append(key)
+      pending.append(key)
+
+    if register and self.api.start_file_uploads(draft_id, register) is None:
+      return self._fail(folder, f"the files could not be registered in draft {draft_id}")
+    for key in pending:
+      yield {"folder": folder, "draft_id": draft_id, "key": key, "path": files[key]}
+
+  def upload(self, item):
+    """Stream a file to its draft, commit it and check its checksum."""
+    folder, draft_id, key = item["folder"], item["draft_id"], item["key"]
+    checksum, size = hash_file(item["path"])
+    checksum = f"md5:{checksum}"
+    if self.api.upload_file_content(draft_id, key, item["path"]) is None:
+      return self._fail(folder, f"{key} could not be uploaded to draft {draft_id}")
+    entry = self.api.commit_file_upload(draft_id, key)
+    if entry is None:
+      return self._fail(folder, f"{key} could not be committed to draft {draft_id}")
+    if entry.get("checksum") not in (None, checksum):
+      return self._fail(folder, f"{key} was committed with checksum {entry.get('checksum')}, expected {checksum}")
+    self.journal.file(folder, key, checksum)
+    self._count("uploaded")
+    self._count("bytes", size)
+    self.progress.add(files=1, bytes=size)
+    logger.debug(f"Uploaded {key} of {folder} to draft {draft_id} ({size} bytes)")
+    return ()
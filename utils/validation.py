@@ -0,0 +1,51 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Validation of projected record metadata against a JSON schema.
+
+Validation needs the optional `jsonschema` package; without it (or without a
+configured schema) validation is disabled.
+"""
+
+import json
+import logging
+
+try:
+  import jsonschema
+except ImportError:
+  jsonschema = None
+
+logger = logging.getLogger("validation")
+
+
+def load_validator(schema_path):
+  """
+  Build a validator for projected metadata (see `config/metadata_schema.json`).
+
+  Args:
+    schema_path (str): Path of the JSON schema (None disables validation).
+
+  Returns:
+    callable: A function returning the list of error messages of a metadata document,
+      or None if validation is disabled.
+  """
+  if not schema_path:
+    return None
+  if jsonschema is None:
+    logger.warning(f"The 'jsonschema' package is not installed: metadata is not validated against {schema_path}.")
+    return None
+
+  with open(schema_path, "r") as f:
+    schema = json.load(f)
+  validator_class = jsonschema.validators.validator_for(schema)
+  validator_class.check_schema(schema)
+  validator = validator_class(schema)
+
+  def validate(metadata):
+    return [
+      f"{'/'.join(str(part) for part in error.absolute_path) or '<root>'}: {error.message}"
+      for error in validator.iter_errors(metadata)
+    ]
+
+  return validate
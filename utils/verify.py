@@ -0,0 +1,229 @@
+# Copyright (c) 2024 Antonio S. Cofiño
+# Licensed under the Mozilla Public License, v. 2.0. See LICENSE file for details.
+
+"""
+Integrity verification and repair of the record cache.
+
+Every indexed record is checked against its index entry:
+
+  record        record.json is missing, unreadable or of another revision
+  metadata      metadata.json is missing or does not match `metadata_sha256`
+  missing_file  A file of the record is missing (when files are downloaded)
+  size          A file does not have the size of its `files.entries[]` entry
+  checksum      A file does not match its `files.entries[].checksum`
+  extra_file    A file of the record directory is not listed in the index
+                (e.g. left behind by an interrupted download)
+  orphan        A record directory is not listed in the index
+
+The records are verified by a pool of worker processes, hashing the files
+with large sequential reads into a reused buffer. Repairing re-fetches only
+the broken records and downloads only their broken files.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.record_cache import RecordCache, metadata_hash, safe_file_key
+
+logger = logging.getLogger("verify")
+
+# Size of the reads while hashing files
+READ_SIZE = 1024 * 1024
+
+# Records handed to a worker process at a time
+CHUNK_SIZE = 16
+
+PROBLEMS = ("record", "metadata", "missing_file", "size", "checksum", "extra_file", "orphan")
+
+
+def hash_file(path, algorithm="md5", read_size=READ_SIZE):
+  """
+  Hash a file with sequential reads into a reused buffer.
+
+  Returns:
+    tuple: (hex digest, size in bytes).
+  """
+  digest = hashlib.new(algorithm)
+  buffer = bytearray(read_size)
+  view = memoryview(buffer)
+  size = 0
+  with open(path, "rb", buffering=0) as f:
+    while True:
+      n = f.readinto(buffer)
+      if not n:
+        break
+      digest.update(view[:n])
+      size += n
+  return digest.hexdigest(), size
+
+
+def verify_cache(output_dir, check_files=True, processes=4):
+  """
+  Verify every record of a cache.
+
+  Args:
+    output_dir (str): Root directory of the cache.
+    check_files (bool, optional): Verify the record files (disable for caches harvested without files).
+    processes (int, optional): Number of worker processes hashing the records.
+
+  Returns:
+    dict: `records` verified, `files` and `bytes` hashed, `seconds`, `mb_per_second`,
+      and the `problems` found (dicts with `record_id`, `problem`, `path` and `detail`).
+  """
+  cache = RecordCache(output_dir)
+  started = time.perf_counter()
+  problems = [_problem(record_id, "orphan", cache.record_dir(record_id), "not in index.json")
+              for record_id in _orphans(cache)]
+
+  files = hashed = 0
+  items = list(cache.index.items())
+  with ProcessPoolExecutor(max_workers=max(1, processes), initializer=_init_worker, initargs=(output_dir,)) as executor:
+    results = executor.map(_verify_record, items, [check_files] * len(items), chunksize=CHUNK_SIZE)
+    for record_files, record_bytes, record_problems in results:
+      files += record_files
+      hashed += record_bytes
+      problems.extend(record_problems)
+
+  seconds = time.perf_counter() - started
+  report = {
+    "records": len(items),
+    "files": files,
+    "bytes": hashed,
+    "seconds": seconds,
+    "mb_per_second": hashed / seconds / 1e6 if seconds else 0.0,
+    "problems": problems,
+  }
+  logger.info(
+    f"Verified {report['records']} records and {files} files ({hashed / 1e6:.1f} MB) in {seconds:.2f} s "
+    f"({report['mb_per_second']:.1f} MB/s): {len(problems)} problem(s)"
+  )
+  return report
+
+
+def repair_cache(api, output_dir, problems, template=None, compression=None, download_files=True):
+  """
+  Repair the problems found by `verify_cache`, re-fetching only the broken records.
+
+  Broken files are removed and downloaded again, extra files are removed, and
+  orphaned records are re-fetched into the index (or removed if they no longer exist).
+
+  Args:
+    api (ZenodoAPI): Client used to fetch the records and files.
+    output_dir (str): Root directory of the cache.
+    problems (list): The `problems` of a `verify_cache` report.
+    template (dict, optional): Metadata template of the cache.
+    compression (str, optional): Codec used to store `record.json`.
+    download_files (bool, optional): Download the files of the repaired records.
+
+  Returns:
+    dict: Lists of `repaired`, `removed` and `failed` record IDs.
+  """
+  cache = RecordCache(output_dir, template, compression=compression)
+  broken = {}
+  for problem in problems:
+    broken.setdefault(problem["record_id"], []).append(problem)
+
+  result = {"repaired": [], "removed": [], "failed": []}
+  for record_id, record_problems in broken.items():
+    for problem in record_problems:
+      if problem["problem"] in ("size", "checksum", "extra_file") and os.path.exists(problem["path"]):
+        os.remove(problem["path"])
+    if all(problem["problem"] == "extra_file" for problem in record_problems):
+      result["repaired"].append(record_id)
+      continue
+
+    record = api.fetch_record(record_id)
+    if record is None:
+      if record_id not in cache.index:
+        shutil.rmtree(cache.record_dir(record_id), ignore_errors=True)
+        result["removed"].append(record_id)
+      else:
+        result["failed"].append(record_id)
+      continue
+    cache.store(record, api, download_files=download_files)
+    result["repaired"].append(record_id)
+
+  cache.save_index()
+  logger.info(
+    f"Repaired {len(result['repaired'])} records, removed {len(result['removed'])} orphans, "
+    f"{len(result['failed'])} could not be fetched"
+  )
+  return result
+
+
+def _problem(record_id, problem, path, detail):
+  return {"record_id": record_id, "problem": problem, "path": path, "detail": detail}
+
+
+def _orphans(cache):
+  if not os.path.isdir(cache.records_dir):
+    return []
+  return sorted(name for name in os.listdir(cache.records_dir) if name not in cache.index)
+
+
+# Cache reader of each worker process (loads the compression dictionaries once)
+_cache = None
+
+
+def _init_worker(output_dir):
+  global _cache
+  _cache = RecordCache(output_dir)
+
+
+def _verify_record(item, check_files):
+  """Verify one record in a worker process; returns (files hashed, bytes hashed, problems)."""
+  record_id, entry = item
+  problems = []
+  try:
+    record = _cache.load_record(record_id)
+    detail = "missing" if record is None else None
+    if record is not None and record.get("revision_id") != entry.get("revision_id"):
+      detail = f"revision {record.get('revision_id')}, indexed {entry.get('revision_id')}"
+  except Exception as e:
+    detail = f"unreadable: {e}"
+  if detail:
+    problems.append(_problem(record_id, "record", _cache.record_dir(record_id), detail))
+
+  try:
+    metadata = _cache.load_metadata(record_id)
+    detail = "missing" if metadata is None else None
+    if metadata is not None and metadata_hash(metadata) != entry.get("metadata_sha256"):
+      detail = "hash mismatch"
+  except ValueError as e:
+    detail = f"unreadable: {e}"
+  if detail:
+    problems.append(_problem(record_id, "metadata", _cache.metadata_path(record_id), detail))
+
+  files = hashed = 0
+  if not check_files:
+    return files, hashed, problems
+  expected = entry.get("files", {})
+  files_dir = os.path.join(_cache.record_dir(record_id), "files")
+  present = set(os.listdir(files_dir)) if os.path.isdir(files_dir) else set()
+  for key in sorted(present - set(expected)):
+    problems.append(_problem(record_id, "extra_file", os.path.join(files_dir, key), "not listed in the index"))
+  for key, file_entry in expected.items():
+    if not safe_file_key(key):
+      logger.warning(f"Skipping file {key!r} of record {record_id}: unsafe file key")
+      continue
+    path = _cache.file_path(record_id, key)
+    if not os.path.exists(path):
+      problems.append(_problem(record_id, "missing_file", path, key))
+      continue
+    size = os.path.getsize(path)
+    if file_entry.get("size") is not None and size != file_entry["size"]:
+      problems.append(_problem(record_id, "size", path, f"{size} bytes, expected {file_entry['size']}"))
+      continue
+    algorithm, _, checksum = (file_entry.get("checksum") or "").partition(":")
+    if not checksum or algorithm not in hashlib.algorithms_available:
+      continue
+    digest, size = hash_file(path, algorithm)
+    files += 1
+    hashed += size
+    if digest != checksum:
+      problems.append(_problem(record_id, "checksum", path, f"{algorithm}:{digest}, expected {file_entry['checksum']}"))
+  return files, hashed, problems
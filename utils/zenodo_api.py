@@ -3,27 +3,78 @@
 
 import logging
 import os
+import time
+from urllib.parse import quote
+
+import requests
 from inveniordm_py.client import InvenioAPI
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.json_stream import iter_hits, loads
+from utils.metrics import RequestMetrics, endpoint_name
+from utils.rate_limit import RateLimiter
 
 logger = logging.getLogger("zenodo_api")
 
 
+class ThrottleAwareRetry(Retry):
+  """
+  Retry policy that also retries non-idempotent requests answered with 429.
+
+  A throttled request is rejected before it is processed, so retrying it
+  cannot apply a change (e.g. a publish) twice.
+  """
+
+  def is_retry(self, method, status_code, has_retry_after=False):
+    if status_code == 429:
+      method = "GET"
+    return super().is_retry(method, status_code, has_retry_after)
+
+
+class _CountingReader:
+  """File-like wrapper counting the bytes read from a stream."""
+
+  def __init__(self, stream):
+    self.stream = stream
+    self.count = 0
+
+  def read(self, size=-1):
+    data = self.stream.read(size)
+    self.count += len(data)
+    return data
+
+
 class ZenodoAPI:
   """
   Custom wrapper for the InvenioRDM API client to handle Zenodo API requests.
   """
 
-  def __init__(self, base_url=None, access_token=None, **kwargs):
+  # Responses retried (with exponential backoff) before giving up
+  RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+  def __init__(self, base_url=None, access_token=None, retry_attempts=3, metrics=None,
+               rate_limit_per_minute=None, pool_size=10, env=True, bandwidth_limit=None, **kwargs):
     """
     Initialize the ZenodoAPI wrapper.
 
+    A single client can be shared by several threads: they share its
+    connection pool and its rate-limit budget.
+
     Args:
       base_url (str, optional): Base URL of the Zenodo API (defaults to env `ZENODO_BASE_URL`).
       access_token (str, optional): Access token for authentication (defaults to env `ZENODO_ACCESS_TOKEN`).
+      retry_attempts (int, optional): Number of retries for throttled or failed idempotent requests.
+      metrics (RequestMetrics, optional): Collector recording every request (a new one is created by default).
+      rate_limit_per_minute (int, optional): Maximum number of requests per minute (unlimited by default).
+      pool_size (int, optional): Maximum number of pooled connections per host.
+      env (bool, optional): Read a missing base URL or access token from the environment.
+      bandwidth_limit (float, optional): Maximum download rate of the file contents, in bytes per second
+        (shared by all the threads; unlimited by default).
       **kwargs: Additional parameters to customize the RDMClient.
     """
-    self.base_url = base_url or os.getenv('ZENODO_BASE_URL', 'https://zenodo.org/api')
-    self.access_token = access_token or os.getenv('ZENODO_ACCESS_TOKEN', None)
+    self.base_url = base_url or (os.getenv('ZENODO_BASE_URL', 'https://zenodo.org/api') if env else 'https://zenodo.org/api')
+    self.access_token = access_token or (os.getenv('ZENODO_ACCESS_TOKEN', None) if env else None)
     
     if not self.base_url:
       raise ValueError("Base URL for Zenodo API is not defined. Check 'ZENODO_BASE_URL' environment variable.")
@@ -39,27 +90,200 @@ class ZenodoAPI:
       logger.error(f"Failed to initialize RDMClient: {e}", exc_info=True)
       raise e
 
+    # All requests go through the client session: retries are handled by the
+    # transport adapter and every response is recorded by the metrics hook.
+    self.session = self.client.session
+    retry = ThrottleAwareRetry(
+      total=int(retry_attempts or 0),
+      backoff_factor=0.5,
+      status_forcelist=self.RETRY_STATUS_CODES,
+      respect_retry_after_header=True,
+      raise_on_status=False,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+
+    self.metrics = metrics or RequestMetrics(base_url=self.base_url)
+    self.session.hooks["response"].append(self.metrics.response_hook)
+    self.rate_limiter = RateLimiter.per_minute(rate_limit_per_minute)
+    self.bandwidth_limiter = RateLimiter(bandwidth_limit) if bandwidth_limit else None
+
     logger.info(f"ZenodoAPI initialized with base_url: {self.base_url} and access_token: {'****' if self.access_token else 'None'}")
 
-  def fetch_records(self, community_id, page=1, size=1000):
+  def url(self, path):
+    """Build the full URL of an API endpoint path (e.g. `records/123`)."""
+    return f"{self.base_url.rstrip('/')}/{path.lstrip('/')}"
+
+  def _throttle(self):
+    """Wait for the shared rate-limit budget before sending a request."""
+    if self.rate_limiter is not None:
+      self.rate_limiter.acquire()
+
+  def _send(self, method, path, **kwargs):
+    """
+    Send a request to the API (waiting for the rate-limit budget) and check its status.
+
+    Args:
+      method (str): HTTP method.
+      path (str): Endpoint path relative to the base URL.
+      **kwargs: Extra arguments for `requests.Session.request` (e.g. `json`, `params`, `stream`).
+
+    Returns:
+      requests.Response: The response.
+
+    Raises:
+      requests.HTTPError: If the API responds with an error status.
+    """
+    url = self.url(path)
+    self._throttle()
+    started = time.perf_counter()
+    try:
+      response = self.session.request(method, url, **kwargs)
+    except requests.RequestException as e:
+      # Transport errors never reach the response hook; record them here
+      self.metrics.observe(endpoint_name(method, url, self.base_url), time.perf_counter() - started, type(e).__name__)
+      raise
+    if not response.ok:
+      response.close()
+    response.raise_for_status()
+    return response
+
+  def _request(self, method, path, **kwargs):
+    """
+    Send a request to the API and decode the JSON response.
+
+    Args:
+      method (str): HTTP method.
+      path (str): Endpoint path relative to the base URL.
+      **kwargs: Extra arguments for `requests.Session.request` (e.g. `json`, `params`).
+
+    Returns:
+      dict: The decoded JSON response (empty for responses without content).
+
+    Raises:
+      requests.HTTPError: If the API responds with an error status.
+    """
+    response = self._send(method, path, **kwargs)
+    if not response.content:
+      return {}
+    return loads(response.content)
+
+  @staticmethod
+  def _search_params(community_id, page, size, sort, query):
+    params = {"page": page, "size": size}
+    if community_id:
+      params["communities"] = community_id
+    if query:
+      params["q"] = query
+    if sort:
+      params["sort"] = sort
+    return params
+
+  def search_records(self, community_id=None, page=1, size=1000, sort=None, query=None):
+    """
+    Search the records of a Zenodo community and return the full search response.
+
+    Unlike `fetch_records`, errors are raised so callers can tell a failed
+    request apart from an empty page.
+
+    Args:
+      community_id (str, optional): The Zenodo community ID (all records if omitted).
+      page (int, optional): The page to retrieve.
+      size (int, optional): The number of records per page.
+      sort (str, optional): Sort order (e.g. `oldest`, `newest`, `updated-desc`).
+      query (str, optional): Search query (Elasticsearch query string syntax).
+
+    Returns:
+      dict: The search response (`hits.hits`, `hits.total`, `links`).
+
+    Raises:
+      requests.RequestException: If the request fails.
+    """
+    return self._request("GET", "records", params=self._search_params(community_id, page, size, sort, query))
+
+  def open_search_records(self, community_id=None, page=1, size=1000, sort=None, query=None):
+    """
+    Send a search request like `search_records`, returning the open streamed response.
+
+    Used by the harvest pipeline, which reads the hits in its decode stage
+    (see `iter_response_hits`). The caller closes the response.
+
+    Returns:
+      requests.Response: The response, with its body not yet read.
+
+    Raises:
+      requests.RequestException: If the request fails.
+    """
+    response = self._send("GET", "records", params=self._search_params(community_id, page, size, sort, query), stream=True)
+    response.raw.decode_content = True
+    return response
+
+  def iter_response_hits(self, response, meta=None):
+    """
+    Decode the hits of an open search response one by one from its stream.
+
+    Args:
+      response (requests.Response): A streamed search response (see `open_search_records`).
+      meta (dict, optional): Filled with `total` and `links` of the response (complete once the
+        iteration ends).
+
+    Yields:
+      dict: The records of the page.
+    """
+    stream = _CountingReader(response.raw)
+    yield from iter_hits(stream, meta)
+    if "Content-Length" not in response.headers:
+      self.metrics.add_bytes(endpoint_name("GET", self.url("records"), self.base_url), bytes_in=stream.count)
+
+  def iter_search_records(self, community_id=None, page=1, size=1000, sort=None, query=None, meta=None):
+    """
+    Search records like `search_records`, decoding the hits one by one from the response stream.
+
+    The first record is available as soon as it is received and only one
+    record is held in memory at a time.
+
+    Args:
+      community_id (str, optional): The Zenodo community ID (all records if omitted).
+      page (int, optional): The page to retrieve.
+      size (int, optional): The number of records per page.
+      sort (str, optional): Sort order (e.g. `oldest`, `newest`, `updated-desc`).
+      query (str, optional): Search query (Elasticsearch query string syntax).
+      meta (dict, optional): Filled with `total` and `links` of the response (complete once the
+        iteration ends).
+
+    Yields:
+      dict: The records of the page.
+
+    Raises:
+      requests.RequestException: If the request fails.
+    """
+    with self.open_search_records(community_id, page=page, size=size, sort=sort, query=query) as response:
+      yield from self.iter_response_hits(response, meta)
+
+  def fetch_records(self, community_id, page=1, size=1000, query=None):
     """
     Fetch records from a specific Zenodo community.
     
     Args:
-      community_id (str): The Zenodo community ID.
+      community_id (str): The Zenodo community ID (None searches all records).
       page (int, optional): The page to start from.
       size (int, optional): The number of records to retrieve per page.
+      query (str, optional): Search query restricting the records.
     
     Returns:
       list: A list of records from the Zenodo community.
     """
+    source = f"community {community_id}" if community_id else "all records"
+    if query:
+      source += f" matching '{query}'"
     try:
-      response = self.client.get(f"records?communities={community_id}&page={page}&size={size}")
+      response = self.search_records(community_id, page=page, size=size, query=query)
       records = response.get('hits', {}).get('hits', [])
-      logger.info(f"Fetched {len(records)} records from community {community_id} (Page {page})")
+      logger.info(f"Fetched {len(records)} records from {source} (Page {page})")
       return records
     except Exception as e:
-      logger.error(f"Error fetching records from community {community_id}: {e}", exc_info=True)
+      logger.error(f"Error fetching records from {source}: {e}", exc_info=True)
       return []
 
   def fetch_record(self, record_id):
@@ -73,13 +297,194 @@ class ZenodoAPI:
       dict: The JSON response containing the record data, or None if not found.
     """
     try:
-      response = self.client.get(f"records/{record_id}")
+      response = self._request("GET", f"records/{record_id}")
       logger.info(f"Successfully fetched record {record_id}")
       return response
     except Exception as e:
       logger.error(f"Error fetching record {record_id}: {e}", exc_info=True)
       return None
 
+  def download_file(self, record_id, key, dest_path, chunk_size=1024 * 1024):
+    """
+    Download a record file, streaming it to disk.
+
+    Args:
+      record_id (str): The ID of the record.
+      key (str): The file key (name) within the record.
+      dest_path (str): Path where the file content is written.
+      chunk_size (int, optional): Size of the chunks read from the response.
+
+    Returns:
+      int: The number of bytes written, or None if an error occurs.
+    """
+    try:
+      url = self.url(f"records/{record_id}/files/{quote(key)}/content")
+      self._throttle()
+      with self.session.get(url, stream=True) as response:
+        response.raise_for_status()
+        size = 0
+        with open(dest_path, "wb") as f:
+          for chunk in response.iter_content(chunk_size=chunk_size):
+            f.write(chunk)
+            size += len(chunk)
+            if self.bandwidth_limiter is not None:
+              self.bandwidth_limiter.acquire(len(chunk))
+        if "Content-Length" not in response.headers:
+          self.metrics.add_bytes(endpoint_name("GET", url, self.base_url), bytes_in=size)
+      logger.debug(f"Downloaded {key} of record {record_id} ({size} bytes)")
+      return size
+    except Exception as e:
+      logger.error(f"Error downloading file {key} of record {record_id}: {e}", exc_info=True)
+      return None
+
+  def create_draft(self, metadata):
+    """
+    Create a new draft record.
+
+    Args:
+      metadata (dict): The draft body (`metadata`, `access`, `files`, `custom_fields`).
+
+    Returns:
+      dict: The created draft (with its `id`), or None if an error occurs.
+    """
+    try:
+      response = self._request("POST", "records", json=metadata)
+      logger.info(f"Draft {response.get('id')} created successfully")
+      return response
+    except Exception as e:
+      logger.error(f"Error creating draft: {e}", exc_info=True)
+      return None
+
+  def fetch_draft(self, record_id):
+    """
+    Fetch a draft record by ID.
+
+    Args:
+      record_id (str): The ID of the draft.
+
+    Returns:
+      dict: The draft, or None if not found.
+    """
+    try:
+      return self._request("GET", f"records/{record_id}/draft")
+    except Exception as e:
+      logger.error(f"Error fetching draft {record_id}: {e}", exc_info=True)
+      return None
+
+  def publish_draft(self, record_id):
+    """
+    Publish a draft (e.g. created with `create_draft`) through the draft publish action.
+
+    Args:
+      record_id (str): The ID of the draft.
+
+    Returns:
+      dict: The published record, or None if an error occurs.
+    """
+    try:
+      response = self._request("POST", f"records/{record_id}/draft/actions/publish")
+      logger.info(f"Draft {record_id} published successfully")
+      return response
+    except Exception as e:
+      logger.error(f"Error publishing draft {record_id}: {e}", exc_info=True)
+      return None
+
+  def list_draft_files(self, record_id):
+    """
+    List the files of a draft.
+
+    Args:
+      record_id (str): The ID of the draft.
+
+    Returns:
+      dict: The file entries by key (with `status` and `checksum`), or None if an error occurs.
+    """
+    try:
+      response = self._request("GET", f"records/{record_id}/draft/files")
+      return {entry["key"]: entry for entry in response.get("entries", [])}
+    except Exception as e:
+      logger.error(f"Error listing files of draft {record_id}: {e}", exc_info=True)
+      return None
+
+  def start_file_uploads(self, record_id, keys):
+    """
+    Register files to be uploaded to a draft.
+
+    Args:
+      record_id (str): The ID of the draft.
+      keys (list): The file keys (names).
+
+    Returns:
+      dict: The JSON response, or None if an error occurs.
+    """
+    try:
+      return self._request("POST", f"records/{record_id}/draft/files", json=[{"key": key} for key in keys])
+    except Exception as e:
+      logger.error(f"Error starting uploads to draft {record_id}: {e}", exc_info=True)
+      return None
+
+  def upload_file_content(self, record_id, key, path):
+    """
+    Upload the content of a registered draft file, streaming it from disk.
+
+    The file object is handed to the transport, which sends it in blocks
+    (never loading it in memory) and rewinds it if the request is retried.
+
+    Args:
+      record_id (str): The ID of the draft.
+      key (str): The file key (name).
+      path (str): Path of the local file.
+
+    Returns:
+      dict: The file entry, or None if an error occurs.
+    """
+    try:
+      with open(path, "rb") as f:
+        response = self._request(
+          "PUT", f"records/{record_id}/draft/files/{quote(key)}/content",
+          data=f, headers={"Content-Type": "application/octet-stream"},
+        )
+      logger.debug(f"Uploaded {key} to draft {record_id} ({os.path.getsize(path)} bytes)")
+      return response
+    except Exception as e:
+      logger.error(f"Error uploading {key} to draft {record_id}: {e}", exc_info=True)
+      return None
+
+  def commit_file_upload(self, record_id, key):
+    """
+    Complete the upload of a draft file.
+
+    Args:
+      record_id (str): The ID of the draft.
+      key (str): The file key (name).
+
+    Returns:
+      dict: The committed file entry (with its `checksum`), or None if an error occurs.
+    """
+    try:
+      return self._request("POST", f"records/{record_id}/draft/files/{quote(key)}/commit")
+    except Exception as e:
+      logger.error(f"Error committing {key} of draft {record_id}: {e}", exc_info=True)
+      return None
+
+  def delete_draft_file(self, record_id, key):
+    """
+    Delete a file from a draft.
+
+    Args:
+      record_id (str): The ID of the draft.
+      key (str): The file key (name).
+
+    Returns:
+      bool: True if the file was deleted.
+    """
+    try:
+      self._request("DELETE", f"records/{record_id}/draft/files/{quote(key)}")
+      return True
+    except Exception as e:
+      logger.error(f"Error deleting {key} of draft {record_id}: {e}", exc_info=True)
+      return False
+
   def update_record(self, record_id, metadata):
     """
     Update metadata for a specific record.
@@ -92,8 +497,8 @@ class ZenodoAPI:
       dict: The JSON response from the update API call, or None if an error occurs.
     """
     try:
-      response = self.client.put(f"records/{record_id}", json=metadata)
-      logger.info(f"Record {record_id} updated successfully")
+      response = self._request("PUT", f"records/{record_id}", json=metadata)
+      logger.debug(f"Record {record_id} updated successfully")
       return response
     except Exception as e:
       logger.error(f"Error updating record {record_id}: {e}", exc_info=True)
@@ -110,7 +515,7 @@ class ZenodoAPI:
       dict: The JSON response from the publish API call, or None if an error occurs.
     """
     try:
-      response = self.client.post(f"records/{record_id}/actions/publish")
+      response = self._request("POST", f"records/{record_id}/actions/publish")
       logger.info(f"Record {record_id} published successfully")
       return response
     except Exception as e:
@@ -128,7 +533,7 @@ class ZenodoAPI:
       dict: The JSON response from the delete API call, or None if an error occurs.
     """
     try:
-      response = self.client.delete(f"records/{record_id}")
+      response = self._request("DELETE", f"records/{record_id}")
       logger.info(f"Record {record_id} deleted successfully")
       return response
     except Exception as e: